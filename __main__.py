@@ -1,13 +1,27 @@
 import arcade
 import menu_view
-from constants import WIDTH, HEIGHT
+from constants import WIDTH, HEIGHT, METRICS_FILE, METRICS_INTERVAL
+from profiler import profiler
+from idle_throttle import idle_throttle
+from metrics import metrics, PrometheusFileWriter
 
 
 def main():
     window = arcade.Window(WIDTH, HEIGHT, "Tile Miner")
+    profiler.attach(window)
+    idle_throttle.attach(window)
     main_view = menu_view.MainMenu(6, 6, 3, 0)
     window.show_view(main_view)
-    arcade.run()
+    if METRICS_FILE is not None:
+        metrics_writer = PrometheusFileWriter(metrics, METRICS_FILE, METRICS_INTERVAL)
+        metrics_writer.start()
+        try:
+            arcade.run()
+        finally:
+            # Writes the last snapshot even if the game exits with an error
+            metrics_writer.stop()
+    else:
+        arcade.run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,160 @@
+import argparse
+from functools import lru_cache
+import hashlib
+import json
+import os
+
+import arcade
+import numpy as np
+from PIL import Image
+
+from constants import SCALE_FACTOR
+
+dirname = os.path.dirname(__file__)
+IMAGE_DIR = os.path.join(dirname, "images")
+
+# Built atlases are cached here, keyed by the source images and the tile scale
+ATLAS_CACHE_DIR = os.path.join(dirname, "asset_cache")
+
+# Bump when the layout or file format of the atlas changes, so that atlases cached by older versions are rebuilt
+ATLAS_FORMAT_VERSION = 1
+
+# Tile images (in images/, without the .png extension) indexed by tile type value. They are scaled to the tile scale.
+TILE_IMAGES = ('empty_alt', 'one_alt', 'two_alt', 'three_alt', 'four_alt')
+
+# Button images, packed at their own size
+BUTTON_IMAGES = ('red_button_normal', 'red_button_hover', 'red_button_press')
+
+# Width of the atlas and space left around each image, so that sampling at an image's edge never reaches a neighbour
+ATLAS_WIDTH = 512
+PADDING = 1
+
+
+def _source_path(name):
+    return os.path.join(IMAGE_DIR, f"{name}.png")
+
+
+def atlas_key(scale=SCALE_FACTOR):
+    """
+    Key of the atlas for the current source images at a given tile scale: a hash of the images' contents, the scale
+    and the atlas format version.
+    :param scale: tile scale
+    :return: hex string
+    """
+    digest = hashlib.sha256(f"{ATLAS_FORMAT_VERSION}:{scale!r}".encode())
+    for name in TILE_IMAGES + BUTTON_IMAGES:
+        with open(_source_path(name), 'rb') as f:
+            digest.update(name.encode() + b'\0' + hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()[:16]
+
+
+def _pack(images):
+    """
+    Pack images into rows ("shelves"), tallest first.
+    :param images: dictionary of name to PIL image
+    :return: (atlas width, atlas height, dictionary of name to (left, top) position)
+    """
+    positions = {}
+    x = y = shelf_height = 0
+    for name in sorted(images, key=lambda n: (-images[n].height, n)):
+        width, height = images[name].size
+        if x + width + 2 * PADDING > ATLAS_WIDTH and x > 0:
+            x, y, shelf_height = 0, y + shelf_height, 0
+        positions[name] = (x + PADDING, y + PADDING)
+        x += width + 2 * PADDING
+        shelf_height = max(shelf_height, height + 2 * PADDING)
+    return ATLAS_WIDTH, y + shelf_height, positions
+
+
+def build_atlas(scale=SCALE_FACTOR):
+    """
+    Decode, scale and pack the tile and button images.
+    :param scale: tile scale. Tiles are resampled once, here, to (int(width * scale), int(height * scale)).
+    :return: (RGBA uint8 array of shape (height, width, 4), dictionary of name to (left, top, right, bottom) box)
+    """
+    images = {}
+    for name in TILE_IMAGES + BUTTON_IMAGES:
+        image = Image.open(_source_path(name)).convert('RGBA')
+        if name in TILE_IMAGES and scale != 1:
+            image = image.resize((int(image.width * scale), int(image.height * scale)), Image.LANCZOS)
+        images[name] = image
+    width, height, positions = _pack(images)
+    atlas = Image.new('RGBA', (width, height))
+    regions = {}
+    for name, (left, top) in positions.items():
+        atlas.paste(images[name], (left, top))
+        regions[name] = (left, top, left + images[name].width, top + images[name].height)
+    return np.asarray(atlas), regions
+
+
+def cached_atlas_path(scale=SCALE_FACTOR, cache_dir=ATLAS_CACHE_DIR):
+    """
+    Build the atlas for a tile scale unless it is already cached, and return where it is cached.
+    :param scale: tile scale
+    :param cache_dir: cache directory
+    :return: path of the cached pixels (.npy); the regions are next to it with a .json extension
+    """
+    path = os.path.join(cache_dir, f"atlas-{atlas_key(scale)}.npy")
+    if not os.path.exists(path):
+        pixels, regions = build_atlas(scale)
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written under temporary names and moved into place, so that a half-written atlas is never picked up
+        with open(f"{path}.tmp", 'wb') as f:
+            np.save(f, pixels)
+        with open(f"{path[:-4]}.json.tmp", 'w') as f:
+            json.dump(regions, f)
+        os.replace(f"{path[:-4]}.json.tmp", f"{path[:-4]}.json")
+        os.replace(f"{path}.tmp", path)
+    return path
+
+
+class TextureAtlas(object):
+    """
+    TextureAtlas class. The tile and button textures, cut from one pre-decoded and pre-scaled image.
+    """
+
+    def __init__(self, pixels, regions, key):
+        """
+        TextureAtlas construct.
+        :param pixels: RGBA uint8 array of the whole atlas
+        :param regions: dictionary of image name to (left, top, right, bottom) box in the atlas
+        :param key: atlas key, which keeps the texture names apart from those of other atlases
+        """
+        image = Image.fromarray(pixels, 'RGBA')
+        # Hit boxes are not used by the game, so none is traced from the images
+        self._textures = {name: arcade.Texture(f"atlas-{key}-{name}", image.crop(tuple(box)),
+                                               hit_box_algorithm="None")
+                          for name, box in regions.items()}
+        self.tile_textures = tuple(self._textures[name] for name in TILE_IMAGES)
+
+    def texture(self, name):
+        """
+        Texture of an image in the atlas.
+        :param name: image name, e.g. 'red_button_normal'
+        :return: arcade.Texture
+        """
+        return self._textures[name]
+
+
+@lru_cache(maxsize=None)
+def load_atlas(scale=SCALE_FACTOR):
+    """
+    Load the atlas for a tile scale, building it first if it is not cached yet. Loaded atlases are shared.
+    :param scale: tile scale
+    :return: TextureAtlas
+    """
+    path = cached_atlas_path(scale)
+    with open(f"{path[:-4]}.json") as f:
+        regions = json.load(f)
+    return TextureAtlas(np.load(path), regions, os.path.basename(path)[6:-4])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the pre-scaled tile and button texture atlas.")
+    parser.add_argument('--scale', type=float, default=SCALE_FACTOR, help="tile scale")
+    args = parser.parse_args()
+    print(f"Atlas cached at {cached_atlas_path(args.scale)}")
+
+
+if __name__ == "__main__":
+    main()
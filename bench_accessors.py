@@ -0,0 +1,123 @@
+"""
+Microbenchmark for attribute access on the engine's hot paths. Compares the validated properties (the "before"
+path) with the unchecked storage used by the inner loops (the "after" path).
+
+Run with: python bench_accessors.py
+"""
+import random
+import timeit
+
+from tile import Tile, TileType
+from board import Board
+from dashboard import Dashboard
+
+# Board size used for the whole-operation benchmarks
+BENCH_ROWS = 20
+BENCH_COLUMNS = 20
+
+
+def make_board(rows, columns, seed=0):
+    rng = random.Random(seed)
+    nonempty_types = [i for i in TileType if i != TileType.EMPTY]
+    setup = []
+    for i in range(rows):
+        setup.append([])
+        for j in range(columns):
+            tile = Tile(rng.choice(nonempty_types))
+            tile.coordinates = (i, j)
+            setup[i].append(tile)
+    return Board(rows, columns, setup)
+
+
+def legacy_find_group_and_perimeter(board, row_pos, col_pos):
+    """
+    The group search as it was before the type grid: every neighbour is read through Tile.tile_type and
+    Tile.coordinates.
+    """
+    tiles = board.board
+    target_type = tiles[row_pos][col_pos].tile_type
+    group = [(row_pos, col_pos)]
+    perimeter = []
+    queue = [(row_pos, col_pos)]
+    while queue:
+        node = queue.pop(0)
+        adjacent_tiles = []
+        if node[0] > 0:
+            adjacent_tiles.append(tiles[node[0] - 1][node[1]])
+        if node[1] > 0:
+            adjacent_tiles.append(tiles[node[0]][node[1] - 1])
+        if node[1] < board.board_column - 1:
+            adjacent_tiles.append(tiles[node[0]][node[1] + 1])
+        if node[0] < board.board_row - 1:
+            adjacent_tiles.append(tiles[node[0] + 1][node[1]])
+        selected_tiles = [t.coordinates for t in adjacent_tiles if t.tile_type == target_type and
+                          t.coordinates not in group]
+        boundary_tiles = [t.coordinates for t in adjacent_tiles if t.tile_type != target_type and
+                          t.coordinates not in perimeter]
+        group.extend(selected_tiles)
+        perimeter.extend(boundary_tiles)
+        queue.extend(selected_tiles)
+    return group, perimeter
+
+
+def legacy_any_legal_moves(board):
+    """
+    A full scan of the board reading every tile type through the Tile.tile_type property (the worst case of the old
+    check, i.e. a board with no moves left).
+    """
+    tiles = board.board
+    for i in range(board.board_row):
+        for j in range(board.board_column):
+            tile_type = tiles[i][j].tile_type
+            if tile_type == TileType.EMPTY:
+                continue
+            if j + 1 < board.board_column and tiles[i][j + 1].tile_type == tile_type:
+                return True
+            if i + 1 < board.board_row and tiles[i + 1][j].tile_type == tile_type:
+                return True
+    return False
+
+
+def report(name, before, after, number):
+    print(f"{name:<40} {1e9 * before / number:>10.1f} ns {1e9 * after / number:>10.1f} ns "
+          f"{before / after:>7.2f}x")
+
+
+def main():
+    print(f"{'':<40} {'before':>13} {'after':>13} {'speedup':>8}")
+
+    tile = Tile(TileType.ONE_TILE)
+    number = 1000000
+    report("Tile.tile_type read", timeit.timeit(lambda: tile.tile_type, number=number),
+           timeit.timeit(lambda: tile._tile_type, number=number), number)
+
+    board = make_board(BENCH_ROWS, BENCH_COLUMNS)
+    report("Board.board_row read", timeit.timeit(lambda: board.board_row, number=number),
+           timeit.timeit(lambda: board._board_row, number=number), number)
+
+    dashboard = Dashboard({}, timer=60)
+
+    def set_timer():
+        dashboard.timer -= 1e-9
+
+    report("Dashboard timer per-frame update", timeit.timeit(set_timer, number=number),
+           timeit.timeit(lambda: dashboard.tick(1e-9), number=number), number)
+
+    number = 2000
+    cells = [(i, j) for i in range(BENCH_ROWS) for j in range(BENCH_COLUMNS)]
+    report(f"group search, every cell of {BENCH_ROWS}x{BENCH_COLUMNS}",
+           timeit.timeit(lambda: [legacy_find_group_and_perimeter(board, *c) for c in cells], number=number // 100),
+           timeit.timeit(lambda: [board.find_group_and_perimeter(*c) for c in cells], number=number // 100),
+           number // 100)
+
+    # Worst case for the legal-move check: a checkerboard has no moves, so every cell is scanned
+    for i in range(BENCH_ROWS):
+        for j in range(BENCH_COLUMNS):
+            board.set_tile_type(i, j, TileType.ONE_TILE if (i + j) % 2 == 0 else TileType.TWO_TILE)
+    report(f"any_legal_moves, no moves on {BENCH_ROWS}x{BENCH_COLUMNS}",
+           timeit.timeit(lambda: legacy_any_legal_moves(board), number=number),
+           timeit.timeit(board.any_legal_moves, number=number), number)
+
+
+if __name__ == "__main__":
+    main()
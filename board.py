@@ -3,25 +3,53 @@ import numpy as np
 
 from constants import *
 from tile import Tile, TileType
+import headless_board
+from topology import get_topology
+from profiler import profiler
+from metrics import metrics
 
 
 class Board(object):
     """
-    Board class.
+    Board class. The Tile sprites are the view of the board; the tile types are also kept in a plain uint8 grid which
+    the group search and legal-move check read directly, without going through the validated Tile properties.
     """
 
-    def __init__(self, row, column, board_setup=None):
+    __slots__ = ('_board', '_board_row', '_board_column', '_types', '_version', '_metrics_label', '_row_offset',
+                 '_topology', '_dirty_tiles')
+
+    def __init__(self, row, column, board_setup=None, allow_empty=False, topology=SQUARE_TOPOLOGY):
         """
         Board class construct.
 
         :param row: # of rows in the board
         :param column: # of columns in the board
         :param board_setup: initial board setup to use when initialising the state of the board. Default is None.
+        :param allow_empty: accept empty tiles in board_setup, e.g. when restoring a saved game. Default is False.
+        :param topology: which tiles neighbour each other, one of TOPOLOGIES. Default is square.
         """
-        self.board: list = []
+        self._board: list = []
         self.board_row: int = row
         self.board_column: int = column
-        self._initialise_board(board_setup)
+        self._initialise_board(board_setup, allow_empty)
+
+        # Incremented whenever a tile type changes, so that results computed from an older board can be recognised
+        self._version = 0
+
+        # Board size label used to break down the engine counters by board size
+        self._metrics_label = f"{row}x{column}"
+
+        # Endless mode: the rows of _board and _types are used as a ring buffer, and this is the index of the row at
+        # the bottom of the screen. Every method takes and returns positions relative to the bottom row (the Tile
+        # coordinates keep their place in the buffer).
+        self._row_offset = 0
+
+        # Precomputed neighbour table shared with every other board of the same shape and topology
+        self._topology = get_topology(row, column, topology)
+
+        # Sprites whose texture, colour or position changed since the last take_dirty_tiles(), so that a cached
+        # rendering of the board only has to redraw them
+        self._dirty_tiles = set()
 
     @property
     def board(self):
@@ -32,6 +60,12 @@ class Board(object):
         if not isinstance(value, list):
             raise TypeError(f"Incorrect variable type assigned to board: {value}")
         self._board = value
+        # The new sprites replace the whole board, so the unchecked type grid is rebuilt from them and anything
+        # computed from the old board is out of date
+        self._types = np.array([[tile.tile_type.value for tile in row] for row in value], dtype=np.uint8)
+        self._row_offset = 0
+        self._version += 1
+        self._dirty_tiles.update(tile for row in value for tile in row)
 
     @property
     def board_row(self):
@@ -57,12 +91,31 @@ class Board(object):
             raise ValueError(f"Row must be greater than 3: {value}")
         self._board_column = value
 
-    def _initialise_board(self, board_setup):
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def topology(self):
+        return self._topology
+
+    @property
+    def type_grid(self):
+        """
+        Copy of the current tile types as a 2D uint8 array (0 for empty tiles), bottom row first.
+        :return: numpy array
+        """
+        if self._row_offset:
+            return np.roll(self._types, -self._row_offset, axis=0)
+        return self._types.copy()
+
+    def _initialise_board(self, board_setup, allow_empty=False):
         """
         Initialise the board with non-empty Tile objects
 
         :param board_setup: 2D-array with prescribed non-empty Tile objects i.e. tile_type is at least one. If None,
         the board will instead be randomised with non-empty Tile objects.
+        :param allow_empty: accept empty Tile objects in board_setup
         :return:
         """
         if board_setup is None:
@@ -83,13 +136,19 @@ class Board(object):
                     if not isinstance(board_setup[i][j], Tile):
                         raise TypeError(f"INITIALISATION ERROR: board position ({i}, {j}) "
                                         f"is not an instance of class Tile.")
-                    if board_setup[i][j].tile_type == TileType.EMPTY:
+                    if board_setup[i][j].tile_type == TileType.EMPTY and not allow_empty:
                         raise ValueError(f"INITIALISATION ERROR: tile_type of board position ({i}, {j}) is zero. "
                                          f"Must be at least one.")
             self._board = board_setup
 
+        # Unchecked copy of the tile types, kept in step with the sprites by set_tile_type
+        self._types = np.array([[tile.tile_type.value for tile in row] for row in self._board], dtype=np.uint8)
+
+    def _buffer_row(self, row_pos):
+        return (row_pos + self._row_offset) % self._board_row
+
     def _get_tile_sprite(self, row_pos, col_pos):
-        return self._board[row_pos][col_pos]
+        return self._board[(row_pos + self._row_offset) % self._board_row][col_pos]
 
     def get_tile_type(self, row_pos, col_pos):
         """
@@ -98,7 +157,7 @@ class Board(object):
         :param col_pos: Column index of tile
         :return: tile_type from Tile class at (row_pos, col_pos)
         """
-        return self._board[row_pos][col_pos].tile_type
+        return self._get_tile_sprite(row_pos, col_pos).tile_type
 
     def set_tile_type(self, row_pos, col_pos, new_tile_type):
         """
@@ -109,8 +168,13 @@ class Board(object):
         :param new_tile_type: TileType enum
         :return:
         """
-        self._board[row_pos][col_pos].tile_type = new_tile_type
-        self._board[row_pos][col_pos].set_tile_texture()
+        tile = self._get_tile_sprite(row_pos, col_pos)
+        tile.tile_type = new_tile_type
+        self._types[self._buffer_row(row_pos), col_pos] = new_tile_type.value
+        self._version += 1
+        tile.set_tile_texture()
+        self._dirty_tiles.add(tile)
+        metrics.add('texture_swaps', board=self._metrics_label)
 
     def remove_tiles(self, tile_coordinates):
         """
@@ -120,6 +184,7 @@ class Board(object):
         """
         for coord in tile_coordinates:
             self.set_tile_type(coord[0], coord[1], TileType.EMPTY)
+        metrics.add('tiles_removed', len(tile_coordinates), board=self._metrics_label)
 
     def increment_board_tiles(self, tile_coordinates):
         """
@@ -127,19 +192,115 @@ class Board(object):
         :param tile_coordinates: list of tile co-ordinates, each of the form (row_pos, col_pos).
         :return:
         """
+        rows, cols, _ = headless_board.increment_tiles(self._types, tile_coordinates, self._row_offset)
+        self._sync_sprites(zip(rows, cols))
+        metrics.add('tiles_incremented', len(rows), board=self._metrics_label)
+
+    def apply_move(self, row_pos, col_pos):
+        """
+        Play a move: find the group containing (row_pos, col_pos), remove it, increment its non-empty perimeter tiles
+        and score it in one pass over the type grid. Only the sprites of the changed cells are then updated, each
+        exactly once.
+        :param row_pos: row position selected
+        :param col_pos: column position selected
+        :return: MoveResult listing the changed cells, or None if the selected tile is empty or on its own
+        """
+        move = headless_board.apply_move(self._types, row_pos, col_pos, self._row_offset, self._topology)
+        metrics.add('groups_found', board=self._metrics_label)
+        if move is None:
+            return None
+        self._sync_sprites((row, col) for row, col, _ in move.changed)
+        metrics.add('bfs_nodes_visited', len(move.group), board=self._metrics_label)
+        metrics.add('tiles_removed', len(move.group), board=self._metrics_label)
+        metrics.add('tiles_incremented', len(move.incremented), board=self._metrics_label)
+        return move
+
+    def apply_gravity(self, rng):
+        """
+        Let tiles fall into the empty cells and refill the top of each column, as in gravity mode. The type grid is
+        compacted in one vectorized step; the sprites themselves are then moved between cells rather than re-textured,
+        so only the refilled cells load a new texture.
+        :param rng: random.Random instance the new tiles are drawn from
+        :return: list of the sprites that changed cell, with their coordinates already updated. Their screen position
+        is left to the caller.
+        """
+        sources, refilled = headless_board.apply_gravity(self._types, rng)
+        moved_rows, moved_cols = np.nonzero(sources != np.arange(self._board_row)[:, np.newaxis])
+        old_sprites = [self._board[row][col] for row, col in zip(sources[moved_rows, moved_cols].tolist(),
+                                                                   moved_cols.tolist())]
+        moved = []
+        for row, col, tile in zip(moved_rows.tolist(), moved_cols.tolist(), old_sprites):
+            self._board[row][col] = tile
+            tile.coordinates = (row, col)
+            moved.append(tile)
+        # Every cell a sprite left is filled by another moved sprite or a refilled one, so these cover the change
+        self._dirty_tiles.update(moved)
+        self._sync_sprites(zip(*np.nonzero(refilled)))
+        metrics.add('tiles_moved', len(moved), board=self._metrics_label)
+        return moved
+
+    def scroll(self, rng):
+        """
+        Endless mode: scroll cleared rows off the bottom of the board, and keep scrolling while there are no legal
+        moves. The sprites of a row that scrolls off are recycled as the new top row, so nothing is allocated however
+        long the game goes on.
+        :param rng: random.Random instance the new tiles are drawn from
+        :return: # of rows scrolled. The rows that arrived are the top rows of the board; positioning their sprites on
+        screen is left to the caller.
+        """
+        self._row_offset, scrolled = headless_board.scroll_rows(self._types, self._row_offset, rng,
+                                                                       self._topology)
+        if scrolled:
+            arrived = range(max(self._board_row - scrolled, 0), self._board_row)
+            self._sync_sprites((row, col) for row in arrived for col in range(self._board_column))
+            metrics.add('rows_scrolled', scrolled, board=self._metrics_label)
+        return scrolled
+
+    def row_sprites(self, row_pos):
+        """
+        Sprites of a row of the board.
+        :param row_pos: row position, relative to the bottom row
+        :return: list of Tile objects
+        """
+        return self._board[self._buffer_row(row_pos)]
+
+    def _sync_sprites(self, tile_coordinates):
+        """
+        Bring the sprites at the given co-ordinates in line with the type grid after it has been changed directly.
+        :param tile_coordinates: iterable of tile co-ordinates, each of the form (row_pos, col_pos).
+        :return:
+        """
+        swaps = 0
+        for row_pos, col_pos in tile_coordinates:
+            row_pos = self._buffer_row(row_pos)
+            tile = self._board[row_pos][col_pos]
+            tile.tile_type = TileType(self._types.item(row_pos, col_pos))
+            tile.set_tile_texture()
+            self._dirty_tiles.add(tile)
+            swaps += 1
+        self._version += 1
+        metrics.add('texture_swaps', swaps, board=self._metrics_label)
+
+    def restore_tiles(self, tile_coordinates, tile_type):
+        """
+        Put back removed tiles, e.g. when a move is undone. Reverses remove_tiles.
+        :param tile_coordinates: list of tile co-ordinates, each of the form (row_pos, col_pos).
+        :param tile_type: TileType enum the tiles had before they were removed
+        :return:
+        """
         for coord in tile_coordinates:
-            if self.get_tile_type(coord[0], coord[1]) == TileType.ONE_TILE:
-                self.set_tile_type(coord[0], coord[1], TileType.TWO_TILE)
-                continue
-            if self.get_tile_type(coord[0], coord[1]) == TileType.TWO_TILE:
-                self.set_tile_type(coord[0], coord[1], TileType.THREE_TILE)
-                continue
-            if self.get_tile_type(coord[0], coord[1]) == TileType.THREE_TILE:
-                self.set_tile_type(coord[0], coord[1], TileType.FOUR_TILE)
-                continue
-            if self.get_tile_type(coord[0], coord[1]) == TileType.FOUR_TILE:
-                self.set_tile_type(coord[0], coord[1], TileType.ONE_TILE)
-                continue
+            self.set_tile_type(coord[0], coord[1], tile_type)
+
+    def decrement_board_tiles(self, tile_coordinates):
+        """
+        Decrement selected non-empty tiles, resetting type one back to four. Reverses increment_board_tiles.
+        :param tile_coordinates: list of tile co-ordinates, each of the form (row_pos, col_pos).
+        :return:
+        """
+        for coord in tile_coordinates:
+            tile_type = self._types.item(self._buffer_row(coord[0]), coord[1])
+            if tile_type != TileType.EMPTY.value:
+                self.set_tile_type(coord[0], coord[1], TileType((tile_type - 2) % 4 + 1))
 
     def find_group_and_perimeter(self, row_pos, col_pos):
         """
@@ -149,50 +310,37 @@ class Board(object):
         :param col_pos: column position selected
         :return: List, List
         """
-        target_type = self.get_tile_type(row_pos, col_pos)
-        group = [(row_pos, col_pos)]
-        perimeter = []
-        queue = [(row_pos, col_pos)]
-
-        while queue:
-            node = queue.pop(0)
-            adjacent_tiles = []
-
-            # Append the top tile
-            if node[0] > 0:
-                adjacent_tiles.append(self._board[node[0] - 1][node[1]])
-            # Append the left tile
-            if node[1] > 0:
-                adjacent_tiles.append(self._board[node[0]][node[1] - 1])
-            # Append the right tile
-            if node[1] < self._board_column - 1:
-                adjacent_tiles.append(self._board[node[0]][node[1] + 1])
-            # Append the bottom tile
-            if node[0] < self._board_row - 1:
-                adjacent_tiles.append(self._board[node[0] + 1][node[1]])
-
-            selected_tiles = [t.coordinates for t in adjacent_tiles if t.tile_type == target_type and
-                              t.coordinates not in group]
-            boundary_tiles = [t.coordinates for t in adjacent_tiles if t.tile_type != target_type and
-                              t.coordinates not in perimeter]
-            group.extend(selected_tiles)
-            perimeter.extend(boundary_tiles)
-            queue.extend(selected_tiles)
-
+        group, perimeter = headless_board.find_group_and_perimeter(self._types, row_pos, col_pos, self._row_offset,
+                                                                   self._topology)
+        metrics.add('groups_found', board=self._metrics_label)
+        metrics.add('bfs_nodes_visited', len(group), board=self._metrics_label)
         return group, perimeter
 
     def highlight_group(self, group, counter):
         if len(group) == 1:
             return
+        shade = int(255 * 0.5 * (np.sin(HIGHLIGHT_SPEED * counter) + 1))
         for coord in group:
-            if self.get_tile_type(coord[0], coord[1]) == TileType.EMPTY:
+            if self._types.item(self._buffer_row(coord[0]), coord[1]) == TileType.EMPTY.value:
                 continue
-            self._get_tile_sprite(coord[0], coord[1]).color = (255,
-                                                               int(255 * 0.5 * (np.sin(HIGHLIGHT_SPEED * counter) + 1)),
-                                                               int(255 * 0.5 * (np.sin(HIGHLIGHT_SPEED * counter) + 1)))
+            tile = self._get_tile_sprite(coord[0], coord[1])
+            tile.color = (255, shade, shade)
+            self._dirty_tiles.add(tile)
 
     def _flush_tile(self, row_pos, col_pos):
-        self._get_tile_sprite(row_pos, col_pos).color = (255, 255, 255)
+        tile = self._get_tile_sprite(row_pos, col_pos)
+        if tile.color != (255, 255, 255):
+            tile.color = (255, 255, 255)
+            self._dirty_tiles.add(tile)
+
+    def take_dirty_tiles(self):
+        """
+        Sprites whose texture, colour or position has changed since the last call. Sprites moved on screen by the
+        caller, e.g. after scrolling, are not included.
+        :return: set of Tile objects
+        """
+        dirty, self._dirty_tiles = self._dirty_tiles, set()
+        return dirty
 
     def flush_tiles(self, group):
         for coord in group:
@@ -209,54 +357,8 @@ class Board(object):
         non-empty contiguous tiles of the same type.
         :return: Boolean
         """
-        for i in range(self._board_row):
-            for j in range(self._board_column):
-                tile = self._board[i][j]
-                # Check that the tile in question is non-empty
-                if tile.tile_type == TileType.EMPTY:
-                    continue
-                # Check the top row
-                if i == 0:
-                    if j == 0:
-                        moves_exist = (tile.tile_type == self._board[0][1].tile_type) \
-                                      or (tile.tile_type == self._board[1][0].tile_type)
-                    elif j == self._board_column - 1:
-                        moves_exist = (tile.tile_type == self._board[0][j - 1].tile_type) \
-                                      or (tile.tile_type == self._board[1][j].tile_type)
-                    else:
-                        moves_exist = (tile.tile_type == self._board[0][j - 1].tile_type) \
-                                      or (tile.tile_type == self._board[0][j + 1].tile_type) \
-                                      or (tile.tile_type == self._board[1][j].tile_type)
-                # Check the bottom row
-                elif i == self._board_row - 1:
-                    if j == 0:
-                        moves_exist = (tile.tile_type == self._board[i][1].tile_type) \
-                                      or (tile.tile_type == self._board[i - 1][0].tile_type)
-                    elif j == self._board_column - 1:
-                        moves_exist = (tile.tile_type == self._board[i][j - 1].tile_type) \
-                                      or (tile.tile_type == self._board[i - 1][j].tile_type)
-                    else:
-                        moves_exist = (tile.tile_type == self._board[i][j - 1].tile_type) \
-                                      or (tile.tile_type == self._board[i][j + 1].tile_type) \
-                                      or (tile.tile_type == self._board[i - 1][j].tile_type)
-                # Check the rest of the rows
-                else:
-                    if j == 0:
-                        moves_exist = (tile.tile_type == self._board[i][j + 1].tile_type) \
-                                      or (tile.tile_type == self._board[i + 1][j].tile_type) \
-                                      or (tile.tile_type == self._board[i - 1][j].tile_type)
-                    elif j == self._board_column - 1:
-                        moves_exist = (tile.tile_type == self._board[i][j - 1].tile_type) \
-                                      or (tile.tile_type == self._board[i + 1][j].tile_type) \
-                                      or (tile.tile_type == self._board[i - 1][j].tile_type)
-                    else:
-                        moves_exist = (tile.tile_type == self._board[i][j - 1].tile_type) \
-                                      or (tile.tile_type == self._board[i][j + 1].tile_type) \
-                                      or (tile.tile_type == self._board[i - 1][j].tile_type) \
-                                      or (tile.tile_type == self._board[i + 1][j].tile_type)
-                if moves_exist:
-                    return True
-        return False
+        metrics.add('legality_checks', board=self._metrics_label)
+        return headless_board.any_legal_moves(self._types, self._row_offset, self._topology)
 
     def __str__(self):
         """
@@ -267,11 +369,15 @@ class Board(object):
         string = ""
         for i in range(self._board_row - 1, -1, -1):
             for j in range(self._board_column):
-                string += str(self._board[i][j]) + " " + str(self._board[i][j].coordinates) + "\t"
+                tile = self._get_tile_sprite(i, j)
+                string += str(tile) + " " + str(tile.coordinates) + "\t"
             string += "\n"
         return string
 
 
+profiler.register(Board, 'find_group_and_perimeter', 'any_legal_moves', 'highlight_group')
+
+
 if __name__ == "__main__":
     board = Board(5, 5)
     print(board)
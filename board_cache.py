@@ -0,0 +1,77 @@
+import arcade
+from arcade.gl import geometry
+from pyglet import gl
+
+
+class BoardCache(object):
+    """
+    BoardCache class. Keeps the board's sprites rendered in an offscreen framebuffer, so that a frame in which the
+    board has not changed costs a single textured quad instead of drawing every sprite. When tiles do change, only the
+    rectangle around them is cleared and redrawn into the cache.
+    """
+
+    def __init__(self, window, background_color):
+        """
+        BoardCache construct.
+        :param window: arcade.Window the board is drawn in
+        :param background_color: RGB colour the window is cleared with
+        """
+        self._window = window
+        self._background_color = tuple(background_color[:3]) + (255,)
+        self._texture = None
+        self._framebuffer = None
+        # Copies the cache onto the window
+        self._program = window.ctx.load_program(
+            vertex_shader=':resources:shaders/texture_default_projection_vs.glsl',
+            fragment_shader=':resources:shaders/texture_fs.glsl')
+        self._quad = geometry.quad_2d_fs()
+        # Does the whole board have to be drawn again, e.g. because the view scrolled?
+        self._invalid = True
+
+    def invalidate(self):
+        """
+        Redraw the whole board into the cache on the next draw, e.g. after every sprite has moved on screen.
+        :return:
+        """
+        self._invalid = True
+
+    def draw(self, sprite_list, dirty_tiles, scroll_y=0):
+        """
+        Bring the cache up to date and draw it onto the window.
+        :param sprite_list: SpriteList of every tile of the board
+        :param dirty_tiles: sprites that changed since the last draw, e.g. from Board.take_dirty_tiles()
+        :param scroll_y: how far the view has scrolled up the world, in pixels
+        :return:
+        """
+        ctx = self._window.ctx
+        size = self._window.get_framebuffer_size()
+        if self._texture is None or self._texture.size != size:
+            self._texture = ctx.texture(size, filter=(gl.GL_NEAREST, gl.GL_NEAREST))
+            self._framebuffer = ctx.framebuffer(color_attachments=[self._texture])
+            self._invalid = True
+
+        if self._invalid or dirty_tiles:
+            scale = size[0] / self._window.width
+            # Not "with self._framebuffer": clear() enters it again, which loses track of the framebuffer to go back to
+            window_framebuffer = ctx.active_framebuffer
+            self._framebuffer.use()
+            arcade.set_viewport(0, self._window.width, scroll_y, scroll_y + self._window.height)
+            if not self._invalid:
+                # Pixel rectangle around the changed tiles; the scissor test keeps the clear and the draw inside it
+                left = int(min(tile.left for tile in dirty_tiles) * scale) - 1
+                bottom = int((min(tile.bottom for tile in dirty_tiles) - scroll_y) * scale) - 1
+                right = int(max(tile.right for tile in dirty_tiles) * scale) + 2
+                top = int((max(tile.top for tile in dirty_tiles) - scroll_y) * scale) + 2
+                gl.glScissor(max(left, 0), max(bottom, 0), max(right - left, 0), max(top - bottom, 0))
+            self._framebuffer.clear(self._background_color)
+            sprite_list.draw()
+            gl.glScissor(*self._framebuffer.viewport)
+            window_framebuffer.use()
+            arcade.set_viewport(0, self._window.width, 0, self._window.height)
+            self._invalid = False
+
+        # The cache is opaque, so it replaces the window's contents rather than being blended onto them
+        ctx.disable(ctx.BLEND)
+        self._texture.use(0)
+        self._quad.render(self._program)
+        ctx.enable(ctx.BLEND)
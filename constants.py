@@ -22,3 +22,41 @@ TILE_SCALED_HEIGHT = int(TILE_PIXEL_HEIGHT * SCALE_FACTOR)
 
 # "speed" of the tile highlighting process
 HIGHLIGHT_SPEED = 7
+
+# Instrumentation mode: time the views, board and dashboard, with an F3 frame-time graph and an F4 Chrome trace dump.
+# Can also be switched on with the TILE_MINER_PROFILE=1 environment variable.
+PROFILING = False
+
+# If set to a file path, the engine counters are written there in the Prometheus text format every METRICS_INTERVAL
+# seconds (e.g. for node_exporter's textfile collector)
+METRICS_FILE = None
+METRICS_INTERVAL = 15
+
+# Idle throttling: the game updates and redraws UPDATE_RATE times a second while the player is active or something is
+# animating. After IDLE_TIMEOUT seconds without input it only does so when the view next changes (e.g. the game timer
+# showing a new second), and at least every IDLE_UPDATE_INTERVAL seconds. Any input brings back the full rate.
+IDLE_THROTTLING = True
+UPDATE_RATE = 60
+IDLE_TIMEOUT = 5
+IDLE_UPDATE_INTERVAL = 1
+
+# Points awarded for each removed tile
+BASE_TILE_SCORE = 100
+
+# Additional points per tile when a group larger than BONUS_GROUP_SIZE is removed at the same time
+BONUS_POINTS = 50
+BONUS_GROUP_SIZE = 4
+
+# Game modes. In gravity mode, tiles fall down into the gaps left by a removed group and new tiles drop in from the top.
+# In endless mode, cleared rows scroll off the bottom of the board and new rows arrive at the top.
+CLASSIC_MODE = "classic"
+GRAVITY_MODE = "gravity"
+ENDLESS_MODE = "endless"
+GAME_MODES = (CLASSIC_MODE, GRAVITY_MODE, ENDLESS_MODE)
+
+# Board topologies. On a torus the edges of the board wrap around; on a hex board odd rows are shifted by half a tile
+# and every tile has up to six neighbours.
+SQUARE_TOPOLOGY = "square"
+TORUS_TOPOLOGY = "torus"
+HEX_TOPOLOGY = "hex"
+TOPOLOGIES = (SQUARE_TOPOLOGY, TORUS_TOPOLOGY, HEX_TOPOLOGY)
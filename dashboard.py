@@ -1,5 +1,6 @@
 import arcade
 from constants import *
+from profiler import profiler
 
 
 class Dashboard(object):
@@ -9,10 +10,13 @@ class Dashboard(object):
     """
 
     # One removed tiles equals a pre-defined number of points
-    base_tile_score = 100
+    base_tile_score = BASE_TILE_SCORE
 
     # Player gets additional points if >4 tiles get removed at the same time
-    bonus_points = 50
+    bonus_points = BONUS_POINTS
+
+    # Validation happens in the property setters; per-frame updates go through tick() and write the slots directly
+    __slots__ = ('_dashboard_data', '_initial_msg_timer', '_timer', '_score', '_message', '_msg_timer')
 
     def __init__(self, dashboard_data, timer=60, score=0, message="", msg_timer=2):
         """
@@ -121,6 +125,15 @@ class Dashboard(object):
                          font_name='Verdana',
                          bold=True)
 
+    def tick(self, delta_time):
+        """
+        Count the timer down by one frame. Called every frame, so it skips the type check done by the timer setter.
+        :param delta_time: delta time for the frame.
+        :return:
+        """
+
+        self._timer -= delta_time
+
     def reset_message(self):
         """
         Set dashboard message as an empty string.
@@ -146,7 +159,10 @@ class Dashboard(object):
 
         group_size = len(group)
         self._score += self.base_tile_score * group_size
-        if group_size > 4:
-            bonus = self.bonus_points * (group_size - 4)
+        if group_size > BONUS_GROUP_SIZE:
+            bonus = self.bonus_points * (group_size - BONUS_GROUP_SIZE)
             self._score += bonus
             self.message = f"Bonus {bonus} points!"
+
+
+profiler.register(Dashboard, 'setup_dashboard')
@@ -1,6 +1,7 @@
 import xmltodict
 from collections import OrderedDict
 import os
+from metrics import metrics
 
 
 class DataHandler(object):
@@ -38,6 +39,7 @@ class DataHandler(object):
     def parse_xml_data(cls):
         with open(cls.data_file, 'r') as f:
             data = xmltodict.parse(f.read())
+        metrics.add('xml_parses')
         return data
 
     @classmethod
@@ -157,6 +159,8 @@ class DataHandler(object):
         xml_format = xmltodict.unparse(data, pretty=True)
         with open(cls.data_file, 'w') as f:
             f.write(xml_format)
+        metrics.add('xml_writes')
+        metrics.add('xml_bytes_written', len(xml_format.encode()))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,242 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import numpy as np
+
+from constants import CLASSIC_MODE, GAME_MODES, SQUARE_TOPOLOGY, TOPOLOGIES
+from headless_board import HeadlessBoard, label_groups
+
+# Name of the manifest written next to the shards
+MANIFEST_FILE = "manifest.json"
+
+# Records held in memory by each worker before they are written out as a chunk
+DEFAULT_CHUNK_SIZE = 65536
+
+# Move policies for the simulated player
+POLICIES = ('random', 'greedy')
+
+# Games in gravity and endless mode rarely run out of moves, so simulated games are cut off after this many moves
+DEFAULT_MAX_MOVES = 1000
+
+
+def _column_specs(rows, columns):
+    """
+    Name, dtype and per-record shape of every column in the dataset.
+    """
+    return [
+        ('board', np.uint8, (rows, columns)),
+        ('move', np.int16, (2,)),
+        ('group_size', np.uint16, ()),
+        ('score_delta', np.int32, ()),
+        ('final_score', np.int32, ()),
+        ('game', np.int64, ()),
+    ]
+
+
+def play_game(rows, columns, rng, policy='random', mode=CLASSIC_MODE, max_moves=DEFAULT_MAX_MOVES,
+              topology=SQUARE_TOPOLOGY):
+    """
+    Play one game headlessly until no moves are left, or max_moves have been played.
+    :param rows: # of rows in the board
+    :param columns: # of columns in the board
+    :param rng: random.Random instance
+    :param policy: 'random' picks any removable group, 'greedy' picks the largest one (ties broken at random)
+    :param mode: game mode, one of GAME_MODES
+    :param max_moves: most moves to play
+    :param topology: board topology, one of TOPOLOGIES
+    :return: list of (board before the move, (row, column), group size, score delta) and the final score
+    """
+    board = HeadlessBoard(rows, columns, seed=rng.randrange(2 ** 63), mode=mode, topology=topology)
+    moves = []
+    score = 0
+    while len(moves) < max_moves:
+        grid = board.grid
+        labels = label_groups(grid, board.topology)
+        counts = np.bincount(labels.ravel(), minlength=grid.size + 1)[:grid.size]
+        candidates = np.flatnonzero(counts > 1)
+        if len(candidates) == 0:
+            return moves, score
+        if policy == 'greedy':
+            candidates = candidates[counts[candidates] == counts[candidates].max()]
+        label = int(candidates[rng.randrange(len(candidates))])
+        row_pos, col_pos = divmod(label, columns)
+        before = grid.copy()
+        points = board.apply_move(row_pos, col_pos).points
+        score += points
+        moves.append((before, (row_pos, col_pos), int(counts[label]), points))
+    return moves, score
+
+
+class ChunkWriter(object):
+    """
+    Buffers records in fixed-size column arrays and writes each full buffer out as one .npy file per column, so
+    memory stays bounded however many games are played. Plain .npy files are used (rather than a compressed .npz) so
+    that readers can memory-map them.
+    """
+
+    def __init__(self, out_dir, prefix, rows, columns, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        ChunkWriter construct.
+        :param out_dir: directory to write to
+        :param prefix: file name prefix identifying the shard
+        :param rows: # of rows in the board
+        :param columns: # of columns in the board
+        :param chunk_size: records per chunk
+        """
+        self._out_dir = out_dir
+        self._prefix = prefix
+        self._specs = _column_specs(rows, columns)
+        self._buffers = {name: np.empty((chunk_size,) + shape, dtype=dtype) for name, dtype, shape in self._specs}
+        self._size = 0
+        self.chunks = []
+
+    def add_game(self, game_id, moves, final_score):
+        for board, move, group_size, score_delta in moves:
+            self._buffers['board'][self._size] = board
+            self._buffers['move'][self._size] = move
+            self._buffers['group_size'][self._size] = group_size
+            self._buffers['score_delta'][self._size] = score_delta
+            self._buffers['final_score'][self._size] = final_score
+            self._buffers['game'][self._size] = game_id
+            self._size += 1
+            if self._size == len(self._buffers['game']):
+                self.flush()
+
+    def flush(self):
+        """
+        Write out the buffered records, if any.
+        :return:
+        """
+        if self._size == 0:
+            return
+        files = {}
+        for name, _, _ in self._specs:
+            file_name = f"{self._prefix}-{len(self.chunks):05d}-{name}.npy"
+            np.save(os.path.join(self._out_dir, file_name), self._buffers[name][:self._size])
+            files[name] = file_name
+        self.chunks.append({'records': self._size, 'files': files})
+        self._size = 0
+
+
+def export_shard(out_dir, worker, games, rows, columns, seed, policy='random', chunk_size=DEFAULT_CHUNK_SIZE,
+                 mode=CLASSIC_MODE, topology=SQUARE_TOPOLOGY):
+    """
+    Play games and write their records as one shard. Each worker writes its own files, so shards can be produced in
+    parallel without any coordination.
+    :param out_dir: directory to write to
+    :param worker: worker number, used in the file names and to make game ids unique
+    :param games: number of games to play
+    :param rows: # of rows in the board
+    :param columns: # of columns in the board
+    :param seed: base seed; the worker's games are seeded from (seed, worker)
+    :param policy: move policy, one of POLICIES
+    :param chunk_size: records per chunk
+    :param mode: game mode, one of GAME_MODES
+    :param topology: board topology, one of TOPOLOGIES
+    :return: manifest entry for the shard
+    """
+    rng = random.Random(f"{seed}-{worker}")
+    writer = ChunkWriter(out_dir, f"shard{worker:03d}", rows, columns, chunk_size)
+    records = 0
+    for game in range(games):
+        moves, final_score = play_game(rows, columns, rng, policy, mode, topology=topology)
+        writer.add_game((worker << 32) + game, moves, final_score)
+        records += len(moves)
+    writer.flush()
+    return {'worker': worker, 'games': games, 'records': records, 'chunks': writer.chunks}
+
+
+def _export_shard(args):
+    return export_shard(*args)
+
+
+def export_dataset(out_dir, games, rows, columns, workers=None, seed=0, policy='random',
+                   chunk_size=DEFAULT_CHUNK_SIZE, mode=CLASSIC_MODE, topology=SQUARE_TOPOLOGY):
+    """
+    Play games across several processes and write the records, one shard per worker, plus a manifest describing
+    every chunk.
+    :param out_dir: directory to write to (created if missing)
+    :param games: total number of games to play
+    :param rows: # of rows in the board
+    :param columns: # of columns in the board
+    :param workers: number of worker processes. Default is one per CPU.
+    :param seed: base seed for the games
+    :param policy: move policy, one of POLICIES
+    :param chunk_size: records per chunk
+    :param mode: game mode, one of GAME_MODES
+    :param topology: board topology, one of TOPOLOGIES
+    :return: path of the manifest
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown policy: {policy}")
+    if mode not in GAME_MODES:
+        raise ValueError(f"Unknown game mode: {mode}")
+    if topology not in TOPOLOGIES:
+        raise ValueError(f"Unknown topology: {topology}")
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    per_worker = [games // workers + (1 if w < games % workers else 0) for w in range(workers)]
+    jobs = [(out_dir, w, n, rows, columns, seed, policy, chunk_size, mode, topology)
+            for w, n in enumerate(per_worker) if n > 0]
+    if len(jobs) == 1:
+        shards = [_export_shard(jobs[0])]
+    else:
+        with multiprocessing.Pool(len(jobs)) as pool:
+            shards = pool.map(_export_shard, jobs)
+
+    manifest = {
+        'rows': rows,
+        'columns': columns,
+        'policy': policy,
+        'mode': mode,
+        'topology': topology,
+        'seed': seed,
+        'records': sum(s['records'] for s in shards),
+        'schema': {name: {'dtype': np.dtype(dtype).str, 'shape': list(shape)}
+                   for name, dtype, shape in _column_specs(rows, columns)},
+        'shards': shards,
+    }
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return path
+
+
+def iter_chunks(manifest_path, columns=None):
+    """
+    Memory-map the dataset chunk by chunk. Nothing is read into memory until the arrays are accessed.
+    :param manifest_path: path of the manifest written by export_dataset
+    :param columns: names of the columns to open. Default is every column.
+    :return: generator of dictionaries of column name to memory-mapped array
+    """
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    directory = os.path.dirname(manifest_path)
+    for shard in manifest['shards']:
+        for chunk in shard['chunks']:
+            names = columns or list(chunk['files'])
+            yield {name: np.load(os.path.join(directory, chunk['files'][name]), mmap_mode='r') for name in names}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export simulated Tile Miner games as a sharded NumPy dataset.")
+    parser.add_argument('out_dir')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--rows', type=int, default=6)
+    parser.add_argument('--columns', type=int, default=6)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--policy', choices=POLICIES, default='random')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--mode', choices=GAME_MODES, default=CLASSIC_MODE)
+    parser.add_argument('--topology', choices=TOPOLOGIES, default=SQUARE_TOPOLOGY)
+    args = parser.parse_args()
+    path = export_dataset(args.out_dir, args.games, args.rows, args.columns, args.workers, args.seed, args.policy,
+                          args.chunk_size, args.mode, args.topology)
+    print(f"Manifest written to: {path}")
+
+
+if __name__ == "__main__":
+    main()
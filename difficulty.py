@@ -0,0 +1,466 @@
+import argparse
+from collections import namedtuple
+from functools import lru_cache
+import json
+import os
+import threading
+import time
+import numpy as np
+
+from constants import SQUARE_TOPOLOGY, TOPOLOGIES
+from headless_board import EMPTY, NONEMPTY_TYPES, apply_move, label_groups
+from solver import beam_search
+from topology import get_topology
+
+# Calibrated models are kept in difficulty_models/ next to the game, one file per board size and topology
+dirname = os.path.dirname(__file__)
+MODEL_DIR = os.path.join(dirname, "difficulty_models")
+MODEL_EXTENSION = ".json"
+MODEL_VERSION = 1
+
+# Names of the features worked out for each board, in the order of the model's weights: share of the tiles in groups
+# of one to four tiles and of more, legal moves and neighbouring pairs of the same type per tile, share of the tiles
+# in the largest group, the spread and largest share of the tile type counts, and the share of the tiles cleared by
+# always taking the largest group
+FEATURES = ('singles', 'pairs', 'triples', 'quads', 'larger', 'moves', 'same_pairs', 'largest_group', 'type_spread',
+            'top_type', 'greedy_cleared')
+
+# Boards played out to calibrate a model, and the width of the beam search that plays them
+CALIBRATION_BOARDS = 400
+CALIBRATION_BEAM_WIDTH = 8
+
+# Small ridge penalty on the weights, which keeps features that move together (e.g. pairs and moves) from cancelling
+# out with large weights of opposite signs
+RIDGE_PENALTY = 1e-3
+
+# Candidate boards drawn and scored together by the generator
+GENERATOR_BATCH_SIZE = 1024
+
+# Default distance in difficulty a generated board may be from the one asked for, and the most batches drawn looking
+# for one that close
+DIFFICULTY_TOLERANCE = 0.02
+GENERATOR_MAX_BATCHES = 50
+
+# Difficulties of ready-made settings
+DIFFICULTY_LEVELS = {'easy': 0.1, 'medium': 0.5, 'hard': 0.9}
+
+# How well a model matched the play-outs it was calibrated on: mean absolute error and R^2 of the predicted clearable
+# fraction
+Calibration = namedtuple('Calibration', ['boards', 'mean_error', 'r_squared'])
+
+# Models being calibrated in the background, as (rows, columns, topology, directory) -> Thread
+_calibrating = {}
+_calibrating_lock = threading.Lock()
+
+
+class ModelNotCalibratedError(Exception):
+    pass
+
+
+def _group_sizes(flat, labels):
+    """
+    Size of the group of each tile of a batch of boards, from one bincount over every board's labels shifted apart.
+    :param flat: tile types of shape (n, cells)
+    :param labels: group labels of shape (n, cells), as given by label_groups
+    :return: int array of shape (n, cells), zero for empty tiles
+    """
+    count, cells = flat.shape
+    shifted = labels + (cells + 1) * np.arange(count)[:, np.newaxis]
+    sizes = np.bincount(shifted.ravel(), minlength=count * (cells + 1))[shifted]
+    sizes[flat == EMPTY] = 0
+    return sizes
+
+
+def greedy_playout(grids, topology=None):
+    """
+    Play a batch of boards out together, always taking the largest group, with every board's move applied in the same
+    vectorized step. Boards drop out of the batch as they run out of moves.
+    :param grids: numpy array of tile type values of shape (n, rows, columns)
+    :param topology: Topology of the boards. Default is a square board of the grids' shape.
+    :return: share of the tiles of each board cleared, array of shape (n,)
+    """
+    count, rows, columns = grids.shape
+    if topology is None:
+        topology = get_topology(rows, columns)
+    cells = rows * columns
+    flat = grids.reshape(count, cells).copy()
+    tiles = np.maximum(np.count_nonzero(flat, axis=1), 1)
+    playing = np.arange(count)
+    while len(playing):
+        boards = flat[playing]
+        labels = label_groups(boards.reshape(-1, rows, columns), topology).reshape(len(playing), cells)
+        sizes = _group_sizes(boards, labels)
+        largest = sizes.argmax(axis=1)
+        moving = sizes[np.arange(len(playing)), largest] > 1
+        playing, boards, labels, largest = playing[moving], boards[moving], labels[moving], largest[moving]
+        group = labels == labels[np.arange(len(playing)), largest][:, np.newaxis]
+        # Perimeter: non-empty tiles next to the group (the padding of the neighbour table reads as outside it)
+        padded_group = np.concatenate([group, np.zeros((len(playing), 1), dtype=bool)], axis=1)
+        perimeter = padded_group[:, topology.padded].any(axis=-1) & ~group & (boards != EMPTY)
+        boards = np.where(perimeter, boards % len(NONEMPTY_TYPES) + 1, boards)
+        boards[group] = EMPTY
+        flat[playing] = boards
+    return 1 - np.count_nonzero(flat, axis=1) / tiles
+
+
+def board_features(grids, topology=None):
+    """
+    Features of a batch of boards, worked out together in vectorized passes (group labelling, mostly during the greedy
+    play-out, is the bulk of the cost).
+    :param grids: numpy array of tile type values of shape (n, rows, columns), or a single 2D grid
+    :param topology: Topology of the boards. Default is a square board of the grids' shape.
+    :return: float array of shape (n, len(FEATURES)), or (len(FEATURES),) for a single grid
+    """
+    grids = np.asarray(grids, dtype=np.uint8)
+    single = grids.ndim == 2
+    if single:
+        grids = grids[np.newaxis]
+    count, rows, columns = grids.shape
+    if topology is None:
+        topology = get_topology(rows, columns)
+    cells = rows * columns
+    flat = grids.reshape(count, cells)
+    nonempty = flat != EMPTY
+    tiles = np.maximum(nonempty.sum(axis=1), 1)
+
+    sizes = _group_sizes(flat, label_groups(grids, topology).reshape(count, cells))
+
+    features = np.empty((count, len(FEATURES)))
+    for i, size in enumerate((1, 2, 3, 4)):
+        features[:, i] = (sizes == size).sum(axis=1) / tiles
+    features[:, 4] = (sizes > 4).sum(axis=1) / tiles
+    # Each group of two or more tiles is one legal move, and each of its tiles counts for 1 / size of it
+    features[:, 5] = np.where(sizes > 1, 1 / np.maximum(sizes, 1), 0).sum(axis=1) / tiles
+    first, second = topology.edges
+    features[:, 6] = ((flat[:, first] == flat[:, second]) & nonempty[:, first]).sum(axis=1) / tiles
+    features[:, 7] = sizes.max(axis=1) / tiles
+    type_shares = (flat[:, :, np.newaxis] == np.array(NONEMPTY_TYPES)).sum(axis=1) / tiles[:, np.newaxis]
+    features[:, 8] = type_shares.std(axis=1)
+    features[:, 9] = type_shares.max(axis=1)
+    features[:, 10] = greedy_playout(grids, topology)
+    return features[0] if single else features
+
+
+def clearable_fraction(grid, topology=None, beam_width=CALIBRATION_BEAM_WIDTH):
+    """
+    Share of the tiles of a board a strong player clears, found by playing the board out with a beam search for the
+    best score.
+    :param grid: 2D numpy array of tile type values
+    :param topology: Topology of the board. Default is a square board of the grid's shape.
+    :param beam_width: positions kept per move by the beam search
+    :return: float
+    """
+    grid = np.array(grid, dtype=np.uint8)
+    if topology is None:
+        topology = get_topology(*grid.shape)
+    tiles = np.count_nonzero(grid)
+    _, line = beam_search(grid, beam_width, tiles // 2, topology)
+    for row_pos, col_pos in line:
+        apply_move(grid, row_pos, col_pos, topology=topology)
+    return 1 - np.count_nonzero(grid) / tiles
+
+
+def random_boards(rng, count, rows, columns, topology=None):
+    """
+    Random boards drawn the way new games are set up, keeping only those with at least one legal move.
+    :param rng: numpy Generator
+    :param count: # of boards to draw (fewer are returned if some have no legal moves)
+    :param rows: # of rows in the board
+    :param columns: # of columns in the board
+    :param topology: Topology of the boards. Default is a square board.
+    :return: uint8 array of shape (<= count, rows, columns)
+    """
+    if topology is None:
+        topology = get_topology(rows, columns)
+    grids = rng.integers(NONEMPTY_TYPES[0], NONEMPTY_TYPES[-1] + 1, size=(count, rows, columns), dtype=np.uint8)
+    flat = grids.reshape(count, -1)
+    first, second = topology.edges
+    return grids[(flat[:, first] == flat[:, second]).any(axis=1)]
+
+
+class DifficultyModel(object):
+    """
+    DifficultyModel class. A linear model, calibrated on play-outs of random boards of one size and topology, from
+    board features to the share of the tiles a strong player clears. The difficulty of a board is where its
+    predicted clearable fraction falls among random boards of the same size: 0 is the easiest board and 1 the hardest.
+    """
+
+    def __init__(self, rows, columns, topology, weights, quantiles, calibration):
+        """
+        DifficultyModel construct. Use calibrate() or load_model() to make one.
+        :param rows: # of rows of the boards
+        :param columns: # of columns of the boards
+        :param topology: one of TOPOLOGIES
+        :param weights: intercept followed by one weight per feature
+        :param quantiles: predicted clearable fractions of the calibration boards at evenly spaced quantiles, from
+        the lowest to the highest
+        :param calibration: Calibration
+        """
+        if len(weights) != len(FEATURES) + 1:
+            raise ValueError(f"Expected {len(FEATURES) + 1} weights, got {len(weights)}")
+        self.rows = rows
+        self.columns = columns
+        self.topology = topology
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.quantiles = np.asarray(quantiles, dtype=np.float64)
+        self.calibration = calibration
+
+    def predict(self, features):
+        """
+        Clearable fraction of boards from their features.
+        :param features: array of shape (n, len(FEATURES)) or (len(FEATURES),)
+        :return: array of shape (n,), or a float
+        """
+        return np.clip(features @ self.weights[1:] + self.weights[0], 0, 1)
+
+    def difficulty(self, predicted):
+        """
+        Difficulty of boards from their predicted clearable fractions.
+        :param predicted: array of predicted clearable fractions, or a float
+        :return: array of difficulties between 0 and 1, or a float
+        """
+        # Harder boards clear less, so they sit lower among the quantiles
+        positions = np.linspace(0, 1, len(self.quantiles))
+        return 1 - np.interp(predicted, self.quantiles, positions)
+
+    def estimate(self, grids):
+        """
+        Predicted clearable fraction and difficulty of boards.
+        :param grids: numpy array of tile type values of shape (n, rows, columns), or a single 2D grid
+        :return: (clearable fractions, difficulties)
+        """
+        predicted = self.predict(board_features(grids, get_topology(self.rows, self.columns, self.topology)))
+        return predicted, self.difficulty(predicted)
+
+    def to_dict(self):
+        return {
+            'version': MODEL_VERSION,
+            'rows': self.rows,
+            'columns': self.columns,
+            'topology': self.topology,
+            'features': list(FEATURES),
+            'weights': self.weights.tolist(),
+            'quantiles': self.quantiles.tolist(),
+            'calibration': self.calibration._asdict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != MODEL_VERSION or data.get('features') != list(FEATURES):
+            raise ValueError("Difficulty model was calibrated for a different set of features")
+        return cls(data['rows'], data['columns'], data['topology'], data['weights'], data['quantiles'],
+                   Calibration(**data['calibration']))
+
+
+def calibrate(rows, columns, topology=SQUARE_TOPOLOGY, boards=CALIBRATION_BOARDS, beam_width=CALIBRATION_BEAM_WIDTH,
+              seed=0):
+    """
+    Calibrate a difficulty model: play out random boards with a beam search and fit the clearable fractions reached
+    to the boards' features by least squares.
+    :param rows: # of rows in the board
+    :param columns: # of columns in the board
+    :param topology: one of TOPOLOGIES. Default is square.
+    :param boards: # of boards to play out
+    :param beam_width: positions kept per move by the beam search
+    :param seed: seed for drawing the boards
+    :return: DifficultyModel
+    """
+    if topology not in TOPOLOGIES:
+        raise ValueError(f"Unknown topology: {topology}")
+    board_topology = get_topology(rows, columns, topology)
+    rng = np.random.default_rng(seed)
+    grids = random_boards(rng, boards, rows, columns, board_topology)
+    while len(grids) < boards:
+        grids = np.concatenate([grids, random_boards(rng, boards, rows, columns, board_topology)])[:boards]
+    targets = np.array([clearable_fraction(grid, board_topology, beam_width) for grid in grids])
+
+    design = np.hstack([np.ones((len(grids), 1)), board_features(grids, board_topology)])
+    # Ridge regression, leaving the intercept unpenalised
+    penalty = RIDGE_PENALTY * len(grids) * np.eye(design.shape[1])
+    penalty[0, 0] = 0
+    weights = np.linalg.solve(design.T @ design + penalty, design.T @ targets)
+
+    predicted = np.clip(design @ weights, 0, 1)
+    residual = ((targets - predicted) ** 2).sum()
+    spread = ((targets - targets.mean()) ** 2).sum()
+    calibration = Calibration(len(grids), float(np.abs(targets - predicted).mean()),
+                              float(1 - residual / spread) if spread else 0.0)
+    quantiles = np.quantile(predicted, np.linspace(0, 1, 101))
+    return DifficultyModel(rows, columns, topology, weights, quantiles, calibration)
+
+
+def model_path(rows, columns, topology=SQUARE_TOPOLOGY, directory=MODEL_DIR):
+    return os.path.join(directory, f"{rows}x{columns}_{topology}{MODEL_EXTENSION}")
+
+
+def save_model(model, directory=MODEL_DIR):
+    """
+    Save a difficulty model under the name load_model() looks for.
+    :param model: DifficultyModel
+    :param directory: directory to save it in
+    :return: path of the model file
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = model_path(model.rows, model.columns, model.topology, directory)
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(model.to_dict(), f, indent=1)
+    os.replace(temp_path, path)
+    return path
+
+
+@lru_cache(maxsize=None)
+def load_model(rows, columns, topology=SQUARE_TOPOLOGY, directory=MODEL_DIR):
+    """
+    Calibrated difficulty model for a board size and topology.
+    :param rows: # of rows in the board
+    :param columns: # of columns in the board
+    :param topology: one of TOPOLOGIES. Default is square.
+    :param directory: directory the models are kept in
+    :return: DifficultyModel
+    :raises ModelNotCalibratedError: if no usable model has been saved yet (see calibrate_model)
+    """
+    path = model_path(rows, columns, topology, directory)
+    try:
+        with open(path) as f:
+            return DifficultyModel.from_dict(json.load(f))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise ModelNotCalibratedError(f"No difficulty model for {rows}x{columns} {topology} boards; calibrate one with "
+                                      f"python difficulty.py calibrate --rows {rows} --columns {columns} "
+                                      f"--topology {topology}") from e
+
+
+def calibrate_model(rows, columns, topology=SQUARE_TOPOLOGY, directory=MODEL_DIR):
+    """
+    Calibrate and save the model for a board size and topology, so that load_model() finds it from then on. Takes a
+    few seconds.
+    :param rows: # of rows in the board
+    :param columns: # of columns in the board
+    :param topology: one of TOPOLOGIES. Default is square.
+    :param directory: directory the models are kept in
+    :return: DifficultyModel
+    """
+    model = calibrate(rows, columns, topology)
+    save_model(model, directory)
+    load_model.cache_clear()
+    return model
+
+
+def calibrate_in_background(rows, columns, topology=SQUARE_TOPOLOGY, directory=MODEL_DIR):
+    """
+    Calibrate the model for a board size and topology on a background thread, e.g. so that a game can start straight
+    away and the next game of that size gets its difficulty. Does nothing if that model is already being calibrated.
+    :param rows: # of rows in the board
+    :param columns: # of columns in the board
+    :param topology: one of TOPOLOGIES. Default is square.
+    :param directory: directory the models are kept in
+    :return: Thread calibrating the model
+    """
+    key = (rows, columns, topology, directory)
+    with _calibrating_lock:
+        thread = _calibrating.get(key)
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(target=calibrate_model, args=key, daemon=True)
+            _calibrating[key] = thread
+            thread.start()
+    return thread
+
+
+def generate_board(rows, columns, difficulty, topology=SQUARE_TOPOLOGY, seed=None, tolerance=DIFFICULTY_TOLERANCE,
+                   batch_size=GENERATOR_BATCH_SIZE, max_batches=GENERATOR_MAX_BATCHES):
+    """
+    Random board with at least one legal move, as close as can be found to a difficulty. Candidates are drawn and
+    estimated a batch at a time until one is within the tolerance.
+    :param rows: # of rows in the board
+    :param columns: # of columns in the board
+    :param difficulty: difficulty between 0 (easiest) and 1 (hardest), or one of DIFFICULTY_LEVELS
+    :param topology: one of TOPOLOGIES. Default is square.
+    :param seed: seed for drawing the boards. Default is None.
+    :param tolerance: distance in difficulty that is close enough
+    :param batch_size: # of candidates drawn at a time
+    :param max_batches: most batches to draw; the closest board found is returned if none is within the tolerance
+    :return: 2D uint8 numpy array of tile type values
+    :raises ModelNotCalibratedError: if the model for this board size has not been calibrated yet
+    """
+    difficulty = DIFFICULTY_LEVELS.get(difficulty, difficulty)
+    if not 0 <= difficulty <= 1:
+        raise ValueError(f"Difficulty must be between 0 and 1: {difficulty}")
+    model = load_model(rows, columns, topology)
+    board_topology = get_topology(rows, columns, topology)
+    rng = np.random.default_rng(seed)
+    best, best_distance = None, np.inf
+    for _ in range(max_batches):
+        grids = random_boards(rng, batch_size, rows, columns, board_topology)
+        if not len(grids):
+            continue
+        _, difficulties = model.estimate(grids)
+        distances = np.abs(difficulties - difficulty)
+        closest = int(distances.argmin())
+        if distances[closest] < best_distance:
+            best, best_distance = grids[closest], distances[closest]
+        if best_distance <= tolerance:
+            break
+    if best is None:
+        raise ValueError(f"No board with a legal move found for a {rows}x{columns} {topology} board")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate board difficulty models and generate boards of a given "
+                                                 "difficulty.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    calibrate_parser = subparsers.add_parser('calibrate', help="play out random boards and save a fitted model")
+    calibrate_parser.add_argument('--boards', type=int, default=CALIBRATION_BOARDS)
+    calibrate_parser.add_argument('--beam', type=int, default=CALIBRATION_BEAM_WIDTH)
+    generate_parser = subparsers.add_parser('generate', help="generate boards of a difficulty")
+    generate_parser.add_argument('--difficulty', default='medium',
+                                 help=f"between 0 and 1, or one of {', '.join(DIFFICULTY_LEVELS)}")
+    generate_parser.add_argument('--count', type=int, default=1)
+    generate_parser.add_argument('--seed', type=int, default=None)
+    for subparser in (calibrate_parser, generate_parser):
+        subparser.add_argument('--rows', type=int, default=6)
+        subparser.add_argument('--columns', type=int, default=6)
+        subparser.add_argument('--topology', choices=TOPOLOGIES, default=SQUARE_TOPOLOGY)
+    args = parser.parse_args()
+
+    if args.command == 'calibrate':
+        start = time.perf_counter()
+        model = calibrate(args.rows, args.columns, args.topology, args.boards, args.beam)
+        path = save_model(model)
+        calibration = model.calibration
+        print(f"Calibrated on {calibration.boards} boards in {time.perf_counter() - start:.1f} s: mean error "
+              f"{calibration.mean_error:.3f}, R^2 {calibration.r_squared:.2f}. Saved to {path}")
+        print(f"Predicted clearable fraction from {model.quantiles[0]:.2f} (hardest) to {model.quantiles[-1]:.2f} "
+              f"(easiest), median {model.quantiles[len(model.quantiles) // 2]:.2f}")
+        return
+
+    difficulty = DIFFICULTY_LEVELS.get(args.difficulty)
+    difficulty = float(args.difficulty) if difficulty is None else difficulty
+    try:
+        model = load_model(args.rows, args.columns, args.topology)
+    except ModelNotCalibratedError:
+        print(f"Calibrating the model for {args.rows}x{args.columns} {args.topology} boards first...")
+        model = calibrate_model(args.rows, args.columns, args.topology)
+    board_topology = get_topology(args.rows, args.columns, args.topology)
+    seed = args.seed
+    start = time.perf_counter()
+    for i in range(args.count):
+        grid = generate_board(args.rows, args.columns, difficulty, args.topology,
+                              seed=None if seed is None else seed + i)
+        predicted, estimated = model.estimate(grid)
+        played = clearable_fraction(grid, board_topology)
+        # Row 0 is the bottom of the board
+        print("\n".join(" ".join(str(t) for t in row) for row in grid[::-1]))
+        print(f"difficulty {estimated:.2f}, predicted clearable {predicted:.2f}, cleared in play-out {played:.2f}\n")
+    print(f"{args.count} boards in {time.perf_counter() - start:.2f} s")
+
+    # Candidate throughput of the estimator alone
+    grids = random_boards(np.random.default_rng(0), GENERATOR_BATCH_SIZE, args.rows, args.columns, board_topology)
+    start = time.perf_counter()
+    model.estimate(grids)
+    elapsed = time.perf_counter() - start
+    print(f"Estimator: {1e6 * elapsed / len(grids):.1f} us per board, {len(grids) / elapsed:,.0f} boards per second")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+import argparse
+import datetime
+from functools import lru_cache
+import json
+import os
+
+import numpy as np
+
+from constants import CLASSIC_MODE, GAME_MODES, SQUARE_TOPOLOGY, TOPOLOGIES
+
+# Every finished game is kept here, one file per column
+dirname = os.path.dirname(__file__)
+HISTORY_DIR = os.path.join(dirname, "game_history")
+
+# Fixed-width columns: name and little-endian dtype. Each column file holds the raw values, one per game, in the order
+# the games finished. date is in days since 1970-01-01; mode, topology and end_reason index GAME_MODES, TOPOLOGIES and
+# END_REASONS; name indexes the names dictionary.
+COLUMNS = (
+    ('date', '<i4'),
+    ('rows', '<u2'),
+    ('columns', '<u2'),
+    ('total_time', '<u4'),
+    ('score', '<u4'),
+    ('moves', '<u4'),
+    ('end_reason', 'u1'),
+    ('mode', 'u1'),
+    ('topology', 'u1'),
+    ('name', '<u4'),
+)
+COLUMN_EXTENSION = ".col"
+
+# Player names, one JSON string per line; a name's index in the file is its value in the name column
+NAMES_FILE = "names.jsonl"
+
+# Why a game finished
+END_TIME_UP = "time_up"
+END_NO_MOVES = "no_moves"
+END_REASONS = (END_TIME_UP, END_NO_MOVES)
+
+# Columns are scanned this many games at a time, so that the temporary arrays of a query stay small
+SCAN_CHUNK_SIZE = 1 << 22
+
+# Periods trend() can group games by, as numpy datetime units
+TREND_PERIODS = {'day': 'D', 'month': 'M', 'year': 'Y'}
+
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def _add_counts(total, counts):
+    """
+    Sum of two bincount results of possibly different lengths.
+    """
+    if len(counts) > len(total):
+        total, counts = counts, total
+    total = total.copy()
+    total[:len(counts)] += counts
+    return total
+
+
+class GameHistory(object):
+    """
+    GameHistory class. Column store of every finished game. Games are appended one value per column file; queries
+    memory-map the columns and aggregate them with vectorized scans, so they read only the columns they need.
+    """
+
+    def __init__(self, path=HISTORY_DIR):
+        """
+        GameHistory construct. A game whose columns were only partly written, e.g. when the game was killed while
+        appending it, is dropped so that the columns line up again.
+        :param path: directory of the column files. It is created if it does not exist.
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._dtypes = {name: np.dtype(dtype) for name, dtype in COLUMNS}
+        sizes = {name: self._size(name) for name in self._dtypes}
+        self._length = min(sizes[name] // dtype.itemsize for name, dtype in self._dtypes.items())
+        for name, dtype in self._dtypes.items():
+            if sizes[name] != self._length * dtype.itemsize:
+                os.truncate(self._column_path(name), self._length * dtype.itemsize)
+
+        self._names = []
+        names_path = os.path.join(path, NAMES_FILE)
+        if os.path.exists(names_path):
+            with open(names_path) as f:
+                self._names = [json.loads(line) for line in f if line.endswith('\n')]
+        self._name_ids = {name: i for i, name in enumerate(self._names)}
+        # Memory-mapped columns, mapped again after games are appended
+        self._mapped = {}
+
+    def _column_path(self, name):
+        return os.path.join(self.path, name + COLUMN_EXTENSION)
+
+    def _size(self, name):
+        path = self._column_path(name)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, name):
+        """
+        A whole column, memory-mapped.
+        :param name: column name, one of COLUMNS
+        :return: read-only array of the column's values
+        """
+        if name not in self._dtypes:
+            raise KeyError(f"Unknown column: {name}")
+        if name not in self._mapped:
+            if self._length == 0:
+                self._mapped[name] = np.zeros(0, dtype=self._dtypes[name])
+            else:
+                self._mapped[name] = np.memmap(self._column_path(name), dtype=self._dtypes[name], mode='r',
+                                               shape=(self._length,))
+        return self._mapped[name]
+
+    @property
+    def names(self):
+        return list(self._names)
+
+    def _name_id(self, name):
+        if name not in self._name_ids:
+            with open(os.path.join(self.path, NAMES_FILE), 'a') as f:
+                f.write(json.dumps(name) + '\n')
+            self._name_ids[name] = len(self._names)
+            self._names.append(name)
+        return self._name_ids[name]
+
+    def append(self, player_data, moves, end_reason, mode=CLASSIC_MODE, topology=SQUARE_TOPOLOGY):
+        """
+        Add a finished game.
+        :param player_data: dictionary of the game's data, as given by TileMiner.player_data
+        :param moves: # of moves played
+        :param end_reason: why the game finished, one of END_REASONS
+        :param mode: game mode, one of GAME_MODES. Default is classic.
+        :param topology: board topology, one of TOPOLOGIES. Default is square.
+        :return: row of the game, e.g. for set_name()
+        """
+        if end_reason not in END_REASONS:
+            raise ValueError(f"Unknown end reason: {end_reason}")
+        date = datetime.date(int(player_data['date_year']), int(player_data['date_month']),
+                             int(player_data['date_day']))
+        values = {
+            'date': (date - EPOCH).days,
+            'rows': int(player_data['row']),
+            'columns': int(player_data['column']),
+            'total_time': int(player_data['time_minutes']) * 60 + int(player_data['time_seconds']),
+            'score': int(player_data['score']),
+            'moves': moves,
+            'end_reason': END_REASONS.index(end_reason),
+            'mode': GAME_MODES.index(mode),
+            'topology': TOPOLOGIES.index(topology),
+            'name': self._name_id(player_data['name']),
+        }
+        for name, dtype in self._dtypes.items():
+            with open(self._column_path(name), 'ab') as f:
+                f.write(np.array(values[name], dtype=dtype).tobytes())
+        self._mapped.clear()
+        self._length += 1
+        return self._length - 1
+
+    def set_name(self, row, name):
+        """
+        Name the player of a game, e.g. once the score has been submitted to the leaderboard.
+        :param row: row of the game, as returned by append()
+        :param name: player name
+        :return:
+        """
+        if not 0 <= row < self._length:
+            raise IndexError(f"No game at row {row}")
+        dtype = self._dtypes['name']
+        with open(self._column_path('name'), 'r+b') as f:
+            f.seek(row * dtype.itemsize)
+            f.write(np.array(self._name_id(name), dtype=dtype).tobytes())
+        self._mapped.pop('name', None)
+
+    def _scan(self, names, rows=None, columns=None, total_time=None, mode=None, topology=None):
+        """
+        Chunks of the named columns, restricted to the games matching every filter that is not None.
+        :return: generator of dictionaries of column name to array
+        """
+        filters = [(name, value) for name, value in (('rows', rows), ('columns', columns),
+                                                      ('total_time', total_time), ('mode', mode),
+                                                      ('topology', topology)) if value is not None]
+        for start in range(0, self._length, SCAN_CHUNK_SIZE):
+            stop = min(start + SCAN_CHUNK_SIZE, self._length)
+            chunk = {name: self[name][start:stop] for name in names}
+            if filters:
+                keep = np.ones(stop - start, dtype=bool)
+                for name, value in filters:
+                    keep &= self[name][start:stop] == value
+                chunk = {name: values[keep] for name, values in chunk.items()}
+            yield chunk
+
+    @staticmethod
+    def _filter_values(mode, topology):
+        return (GAME_MODES.index(mode) if mode is not None else None,
+                TOPOLOGIES.index(topology) if topology is not None else None)
+
+    def averages_by_dimensions(self, column='score', total_time=None, mode=None, topology=None):
+        """
+        Average of a column for each board size.
+        :param column: numeric column to average, e.g. 'score' or 'moves'
+        :param total_time: only count games with this time limit in seconds. Default is None (all).
+        :param mode: only count games of this mode. Default is None (all).
+        :param topology: only count games of this topology. Default is None (all).
+        :return: dictionary of (rows, columns) to (# of games, average)
+        """
+        mode, topology = self._filter_values(mode, topology)
+        width = int(self['columns'].max()) + 1 if self._length else 1
+        games, totals = np.zeros(0, dtype=np.int64), np.zeros(0)
+        for chunk in self._scan(('rows', 'columns', column), total_time=total_time, mode=mode, topology=topology):
+            key = chunk['rows'].astype(np.int64) * width + chunk['columns']
+            games = _add_counts(games, np.bincount(key))
+            totals = _add_counts(totals, np.bincount(key, weights=chunk[column]))
+        return {divmod(int(key), width): (int(games[key]), totals[key] / games[key]) for key in np.flatnonzero(games)}
+
+    def histogram(self, column='score', bin_width=1000, rows=None, columns=None, total_time=None, mode=None,
+                  topology=None):
+        """
+        Histogram of a column.
+        :param column: numeric column, e.g. 'score' or 'moves'
+        :param bin_width: width of each bin. Default is 1000.
+        :param rows: only count games with this # of rows. Default is None (all). The other filters work the same way.
+        :return: (array of the lower edge of each bin, array of # of games in each bin)
+        """
+        mode, topology = self._filter_values(mode, topology)
+        counts = np.zeros(0, dtype=np.int64)
+        for chunk in self._scan((column,), rows, columns, total_time, mode, topology):
+            counts = _add_counts(counts, np.bincount(chunk[column].astype(np.int64) // bin_width))
+        return np.arange(len(counts)) * bin_width, counts
+
+    def trend(self, period='month', column='score', rows=None, columns=None, total_time=None, mode=None,
+              topology=None):
+        """
+        Number of games and average of a column over time.
+        :param period: 'day', 'month' or 'year'
+        :param column: numeric column to average, e.g. 'score' or 'moves'
+        :param rows: only count games with this # of rows. Default is None (all). The other filters work the same way.
+        :return: (array of datetime64 periods that have games, array of # of games, array of averages)
+        """
+        if period not in TREND_PERIODS:
+            raise ValueError(f"Unknown period: {period}")
+        unit = TREND_PERIODS[period]
+        mode, topology = self._filter_values(mode, topology)
+        # Counted by day first: converting each distinct day to its period is much cheaper than converting every game
+        first_day = int(self['date'].min()) if self._length else 0
+        games, totals = np.zeros(0, dtype=np.int64), np.zeros(0)
+        for chunk in self._scan(('date', column), rows, columns, total_time, mode, topology):
+            day = chunk['date'] - first_day
+            games = _add_counts(games, np.bincount(day))
+            totals = _add_counts(totals, np.bincount(day, weights=chunk[column]))
+        periods = (np.arange(len(games)) + first_day).astype('datetime64[D]').astype(f'datetime64[{unit}]')
+        period_index = (periods - periods[0]).astype(np.int64) if len(periods) else np.zeros(0, dtype=np.int64)
+        games = np.bincount(period_index, weights=games).astype(np.int64)
+        totals = np.bincount(period_index, weights=totals)
+        present = np.flatnonzero(games)
+        return periods[0] + present if len(periods) else periods, games[present], totals[present] / games[present]
+
+
+@lru_cache(maxsize=None)
+def load_game_history(path=HISTORY_DIR):
+    """
+    The game history, opened once and shared.
+    :param path: directory of the column files
+    :return: GameHistory
+    """
+    return GameHistory(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise the history of finished Tile Miner games.")
+    parser.add_argument('query', choices=('dimensions', 'histogram', 'trend'))
+    parser.add_argument('--column', default='score', help="column to aggregate")
+    parser.add_argument('--bin-width', type=int, default=1000, help="histogram bin width")
+    parser.add_argument('--period', choices=TREND_PERIODS, default='month', help="trend period")
+    parser.add_argument('--rows', type=int, default=None)
+    parser.add_argument('--columns', type=int, default=None)
+    parser.add_argument('--time', type=int, default=None, help="time limit in seconds")
+    parser.add_argument('--mode', choices=GAME_MODES, default=None)
+    parser.add_argument('--topology', choices=TOPOLOGIES, default=None)
+    parser.add_argument('--path', default=HISTORY_DIR, help="game history directory")
+    args = parser.parse_args()
+
+    history = GameHistory(args.path)
+    print(f"{len(history)} games")
+    if args.query == 'dimensions':
+        averages = history.averages_by_dimensions(args.column, args.time, args.mode, args.topology)
+        for (rows, columns), (games, average) in sorted(averages.items()):
+            print(f"{rows}x{columns}: {games} games, average {args.column} {average:.1f}")
+    elif args.query == 'histogram':
+        edges, counts = history.histogram(args.column, args.bin_width, args.rows, args.columns, args.time, args.mode,
+                                          args.topology)
+        for edge, count in zip(edges, counts):
+            if count:
+                print(f"{edge:>8}-{edge + args.bin_width - 1:<8} {count}")
+    else:
+        periods, games, averages = history.trend(args.period, args.column, args.rows, args.columns, args.time,
+                                                 args.mode, args.topology)
+        for period, count, average in zip(periods, games, averages):
+            print(f"{period}: {count} games, average {args.column} {average:.1f}")
+
+
+if __name__ == "__main__":
+    main()
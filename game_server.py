@@ -0,0 +1,230 @@
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import time
+
+from constants import CLASSIC_MODE, SQUARE_TOPOLOGY
+from headless_board import HeadlessBoard
+
+# Default game settings for sessions that do not specify their own
+DEFAULT_ROWS = 6
+DEFAULT_COLUMNS = 6
+DEFAULT_TIME = 60
+
+# Largest board a client may ask for, matching the limits of the main menu
+MIN_DIMENSION = 4
+MAX_DIMENSION = 20
+
+
+class GameSession(object):
+    """
+    A single headless game: the board, the score and the time at which the session runs out. Sessions use slots so
+    that thousands of them fit comfortably in one server process.
+    """
+
+    __slots__ = ('board', 'score', 'deadline', 'moves', 'no_moves')
+
+    def __init__(self, rows, columns, total_time, seed=None, mode=CLASSIC_MODE, topology=SQUARE_TOPOLOGY):
+        """
+        GameSession construct.
+        :param rows: # of rows in the board
+        :param columns: # of columns in the board
+        :param total_time: seconds the player has before the session ends
+        :param seed: seed used to generate the board. Default is None.
+        :param mode: game mode, one of GAME_MODES. Default is classic.
+        :param topology: board topology, one of TOPOLOGIES. Default is square.
+        """
+        self.board = HeadlessBoard(rows, columns, seed=seed, mode=mode, topology=topology)
+        self.score = 0
+        self.deadline = time.monotonic() + total_time
+        self.moves = 0
+        self.no_moves = False
+
+    @property
+    def time_left(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    @property
+    def game_over(self):
+        return self.no_moves or self.time_left <= 0
+
+    def click(self, row_pos, col_pos):
+        """
+        Play a click on the board, following the same rules as TileMiner.on_mouse_press.
+        :param row_pos: row position clicked
+        :param col_pos: column position clicked
+        :return: list of changed cells (row_pos, col_pos, new_tile_type) and the points scored
+        """
+        if self.game_over:
+            return [], 0
+        if not (0 <= row_pos < self.board.board_row and 0 <= col_pos < self.board.board_column):
+            return [], 0
+        move = self.board.apply_move(row_pos, col_pos)
+        if move is None:
+            return [], 0
+        self.moves += 1
+        self.score += move.points
+        self.no_moves = not self.board.any_legal_moves()
+        return move.changed, move.points
+
+
+async def _skip_line(reader, consumed):
+    """
+    Discard the rest of a line longer than the reader's limit, a chunk at a time.
+    :param reader: asyncio.StreamReader
+    :param consumed: # of bytes known to come before the end of the line, as given by LimitOverrunError
+    :return:
+    """
+    while True:
+        await reader.readexactly(consumed)
+        try:
+            await reader.readuntil(b'\n')
+            return
+        except asyncio.LimitOverrunError as e:
+            consumed = e.consumed
+
+
+class GameServer(object):
+    """
+    asyncio server hosting headless game sessions. Clients talk to it with newline-delimited JSON messages, each
+    with an "op" field:
+
+    * {"op": "new", "rows": 6, "columns": 6, "time": 60, "seed": 0, "mode": "classic", "topology": "square"} starts a
+      session and returns its id and grid.
+    * {"op": "click", "session": 1, "row": 0, "column": 2} plays a move and returns the changed cells and score.
+    * {"op": "close", "session": 1} ends a session.
+
+    Any "id" field in a request is echoed back so that clients can match responses to requests. Sessions belong to
+    the connection that created them and are discarded when it closes.
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        self._session_ids = itertools.count(1)
+        self._server = None
+
+    async def start_tcp(self, host='127.0.0.1', port=0):
+        """
+        Start listening on a TCP socket. Use port 0 to pick a free port.
+        :param host: interface to bind to
+        :param port: port to listen on
+        :return: the (host, port) actually bound
+        """
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def start_unix(self, path):
+        """
+        Start listening on a Unix domain socket.
+        :param path: file system path of the socket
+        :return:
+        """
+        self._server = await asyncio.start_unix_server(self._handle_connection, path)
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+
+    async def _handle_connection(self, reader, writer):
+        owned = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readuntil(b'\n')
+                except asyncio.IncompleteReadError as e:
+                    # End of the stream, possibly after a last request with no newline
+                    line = e.partial
+                except asyncio.LimitOverrunError as e:
+                    # Skip to the end of the over-long line, so that the next request is read from its start
+                    await _skip_line(reader, e.consumed)
+                    writer.write(json.dumps({'ok': False, 'error': "Request line too long"},
+                                            separators=(',', ':')).encode() + b'\n')
+                    await writer.drain()
+                    continue
+                if not line:
+                    break
+                request = {}
+                try:
+                    request = json.loads(line)
+                    response = self.handle_request(request, owned)
+                except (ValueError, TypeError, KeyError, OverflowError) as e:
+                    response = {'ok': False, 'error': str(e)}
+                if isinstance(request, dict) and 'id' in request:
+                    response['id'] = request['id']
+                writer.write(json.dumps(response, separators=(',', ':')).encode() + b'\n')
+                await writer.drain()
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for session_id in owned:
+                self.sessions.pop(session_id, None)
+            writer.close()
+
+    def handle_request(self, request, owned):
+        """
+        Handle a single decoded request.
+        :param request: dictionary decoded from the client message
+        :param owned: set of session ids created by the connection
+        :return: response dictionary
+        """
+        op = request['op']
+        if op == 'new':
+            rows = int(request.get('rows', DEFAULT_ROWS))
+            columns = int(request.get('columns', DEFAULT_COLUMNS))
+            if not (MIN_DIMENSION <= rows <= MAX_DIMENSION and MIN_DIMENSION <= columns <= MAX_DIMENSION):
+                raise ValueError(f"Board dimensions must be between {MIN_DIMENSION} and {MAX_DIMENSION}")
+            total_time = float(request.get('time', DEFAULT_TIME))
+            if not math.isfinite(total_time) or total_time < 0:
+                raise ValueError(f"Time must be a finite, non-negative number of seconds: {total_time}")
+            session = GameSession(rows, columns, total_time, request.get('seed'), request.get('mode', CLASSIC_MODE),
+                                  request.get('topology', SQUARE_TOPOLOGY))
+            session_id = next(self._session_ids)
+            self.sessions[session_id] = session
+            owned.add(session_id)
+            return {'ok': True, 'session': session_id, 'grid': session.board.grid.tolist(), 'score': 0,
+                    'time_left': session.time_left}
+        if op == 'click':
+            session_id = request['session']
+            if session_id not in owned:
+                raise KeyError(f"Unknown session: {session_id}")
+            session = self.sessions[session_id]
+            changed, points = session.click(int(request['row']), int(request['column']))
+            return {'ok': True, 'changed': changed, 'score': session.score, 'delta': points,
+                    'no_moves': session.no_moves, 'time_left': session.time_left}
+        if op == 'close':
+            session_id = request['session']
+            if session_id not in owned:
+                raise KeyError(f"Unknown session: {session_id}")
+            owned.discard(session_id)
+            session = self.sessions.pop(session_id)
+            return {'ok': True, 'score': session.score}
+        raise ValueError(f"Unknown op: {op}")
+
+
+async def _run(args):
+    server = GameServer()
+    if args.unix is not None:
+        await server.start_unix(args.unix)
+        print(f"Serving on {args.unix}")
+    else:
+        host, port = await server.start_tcp(args.host, args.port)
+        print(f"Serving on {host}:{port}")
+    await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host headless Tile Miner sessions.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', default=None, help="serve on this Unix socket path instead of TCP")
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
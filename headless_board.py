@@ -0,0 +1,364 @@
+from collections import namedtuple
+from random import Random
+import numpy as np
+
+from constants import BASE_TILE_SCORE, BONUS_POINTS, BONUS_GROUP_SIZE, CLASSIC_MODE, GRAVITY_MODE, ENDLESS_MODE, \
+    GAME_MODES, SQUARE_TOPOLOGY, HEX_TOPOLOGY
+from topology import get_topology
+
+# Tile type values stored in a headless grid. These mirror the values of the TileType enum in tile.py, which is not
+# imported here so that headless sessions never have to load any sprites or textures.
+EMPTY = 0
+NONEMPTY_TYPES = (1, 2, 3, 4)
+
+# Outcome of a move: the removed group, the non-empty perimeter tiles that were incremented, the tile type of the
+# removed group, every changed cell as (row_pos, col_pos, new_tile_type) and the points scored
+MoveResult = namedtuple('MoveResult', ['group', 'incremented', 'tile_type', 'changed', 'points'])
+
+
+def group_points(group_size):
+    """
+    Points awarded for removing a group of tiles. Uses the same rules as Dashboard.calculate_new_score.
+    :param group_size: number of tiles removed at the same time
+    :return: int
+    """
+    points = BASE_TILE_SCORE * group_size
+    if group_size > BONUS_GROUP_SIZE:
+        points += BONUS_POINTS * (group_size - BONUS_GROUP_SIZE)
+    return points
+
+
+def find_group_and_perimeter(grid, row_pos, col_pos, row_offset=0, topology=None):
+    """
+    Given a row and column position on a type grid, find the group of contiguous tiles of the same type and the set
+    of tiles that surround them having a different tile type. Uses breadth-first search over the precomputed
+    neighbour table, visiting neighbours in the same order as Board.find_group_and_perimeter.
+    :param grid: 2D numpy array of tile type values
+    :param row_pos: row position selected
+    :param col_pos: column position selected
+    :param row_offset: for a ring buffer of rows (endless mode), the index in grid of the bottom row. Positions are
+    given and returned relative to the bottom row, so groups are found across the point where the buffer wraps.
+    :param topology: Topology of the board. Default is a square board of the grid's shape.
+    :return: List, List
+    """
+    rows, columns = grid.shape
+    if topology is None:
+        topology = get_topology(rows, columns)
+    neighbours = topology.neighbours
+    cells = rows * columns
+    # item reads a single value without creating a numpy scalar, and avoids converting the whole grid per search
+    flat = grid.reshape(cells)
+    if row_offset:
+        shift = row_offset * columns
+
+        def read(cell):
+            return flat.item((cell + shift) % cells)
+    else:
+        read = flat.item
+    start = row_pos * columns + col_pos
+    target_type = read(start)
+    group = [start]
+    perimeter = []
+    seen = bytearray(cells)
+    seen[start] = 1
+    head = 0
+
+    while head < len(group):
+        cell = group[head]
+        head += 1
+        for adjacent in neighbours[cell]:
+            if seen[adjacent]:
+                continue
+            seen[adjacent] = 1
+            if read(adjacent) == target_type:
+                group.append(adjacent)
+            else:
+                perimeter.append(adjacent)
+
+    return [divmod(cell, columns) for cell in group], [divmod(cell, columns) for cell in perimeter]
+
+
+def any_legal_moves(grid, row_offset=0, topology=None):
+    """
+    Check if there any available moves in a type grid, i.e. at least two non-empty contiguous tiles of the same type.
+    Compares both ends of every edge of the neighbour table at once.
+    :param grid: 2D numpy array of tile type values
+    :param row_offset: for a ring buffer of rows (endless mode), the index in grid of the bottom row
+    :param topology: Topology of the board. Default is a square board of the grid's shape.
+    :return: Boolean
+    """
+    rows, columns = grid.shape
+    if topology is None:
+        topology = get_topology(rows, columns)
+    first, second = topology.edges
+    if row_offset:
+        first = (first + row_offset * columns) % grid.size
+        second = (second + row_offset * columns) % grid.size
+    flat = grid.reshape(grid.size)
+    first_types = flat[first]
+    return bool(((first_types == flat[second]) & (first_types != EMPTY)).any())
+
+
+def increment_tiles(grid, tile_coordinates, row_offset=0):
+    """
+    Increment the non-empty tiles among the given co-ordinates in one vectorized step, cycling four back to one, i.e.
+    t -> (t % 4) + 1. Empty tiles are left alone.
+    :param grid: 2D numpy array of tile type values, changed in place
+    :param tile_coordinates: list of tile co-ordinates, each of the form (row_pos, col_pos), without repeats
+    :param row_offset: for a ring buffer of rows (endless mode), the index in grid of the bottom row
+    :return: row indices, column indices and new tile types of the incremented tiles, as lists
+    """
+    if not tile_coordinates:
+        return [], [], []
+    rows, cols = np.array(tile_coordinates, dtype=np.intp).T
+    buffer_rows = (rows + row_offset) % grid.shape[0] if row_offset else rows
+    old_types = grid[buffer_rows, cols]
+    nonempty = old_types != EMPTY
+    rows, buffer_rows, cols = rows[nonempty], buffer_rows[nonempty], cols[nonempty]
+    new_types = old_types[nonempty] % len(NONEMPTY_TYPES) + 1
+    grid[buffer_rows, cols] = new_types
+    return rows.tolist(), cols.tolist(), new_types.tolist()
+
+
+def apply_move(grid, row_pos, col_pos, row_offset=0, topology=None):
+    """
+    Play a move on a type grid, in place: find the group containing (row_pos, col_pos), remove it, increment its
+    non-empty perimeter tiles and score it, in a single pass.
+    :param grid: 2D numpy array of tile type values
+    :param row_pos: row position selected
+    :param col_pos: column position selected
+    :param row_offset: for a ring buffer of rows (endless mode), the index in grid of the bottom row. Positions are
+    given and returned relative to the bottom row.
+    :param topology: Topology of the board. Default is a square board of the grid's shape.
+    :return: MoveResult, or None if the selected tile is empty or on its own (nothing changes)
+    """
+    tile_type = grid.item((row_pos + row_offset) % grid.shape[0], col_pos)
+    if tile_type == EMPTY:
+        return None
+    group, perimeter = find_group_and_perimeter(grid, row_pos, col_pos, row_offset, topology)
+    if len(group) < 2:
+        return None
+    group_rows, group_cols = np.array(group, dtype=np.intp).T
+    grid[(group_rows + row_offset) % grid.shape[0], group_cols] = EMPTY
+    rows, cols, new_types = increment_tiles(grid, perimeter, row_offset)
+    changed = [(row, col, EMPTY) for row, col in group]
+    changed.extend(zip(rows, cols, new_types))
+    return MoveResult(group, list(zip(rows, cols)), tile_type, changed, group_points(len(group)))
+
+
+def apply_gravity(grid, rng):
+    """
+    Let tiles fall down into empty cells and fill the cells left at the top of each column with new random tiles, in
+    place. Each column is compacted with one stable sort of the whole grid (row 0 is the bottom row), so the tiles keep
+    their order.
+    :param grid: 2D numpy array of tile type values
+    :param rng: random.Random instance the new tiles are drawn from
+    :return: 2D array giving, for each cell, the row its content came from, and a 2D boolean array of the refilled
+    cells. Cells whose source row differs from their own row have moved.
+    """
+    empty = grid == EMPTY
+    sources = np.argsort(empty, axis=0, kind='stable')
+    grid[...] = np.take_along_axis(grid, sources, axis=0)
+    refilled = np.take_along_axis(empty, sources, axis=0)
+    # Draw new tiles column by column, bottom to top, so that a seeded game always refills the same way
+    refilled_t = refilled.T
+    grid.T[refilled_t] = [rng.choice(NONEMPTY_TYPES) for _ in range(int(refilled_t.sum()))]
+    return sources, refilled
+
+
+def scroll_rows(grid, row_offset, rng, topology=None):
+    """
+    Endless mode: scroll cleared rows off the bottom of a ring buffer of rows, then keep scrolling while there are no
+    legal moves. Each scroll overwrites the bottom row with a new random row, which becomes the top row, so the cost
+    of a scroll does not depend on the board's height or on how long the game has been going.
+    :param grid: 2D numpy array of tile type values, used as a ring buffer of rows and changed in place
+    :param row_offset: index in grid of the bottom row
+    :param rng: random.Random instance the new tiles are drawn from
+    :param topology: Topology of the board. Default is a square board of the grid's shape.
+    :return: new row offset and the number of rows scrolled
+    """
+    rows, columns = grid.shape
+    scrolled = 0
+    while not grid[row_offset].any() or not any_legal_moves(grid, row_offset, topology):
+        grid[row_offset] = [rng.choice(NONEMPTY_TYPES) for _ in range(columns)]
+        row_offset = (row_offset + 1) % rows
+        scrolled += 1
+    return row_offset, scrolled
+
+
+def label_groups(grid, topology=None):
+    """
+    Label every group of contiguous same-type tiles in one vectorized pass, by repeatedly giving each tile the
+    smallest label among its same-type neighbours (read off the padded neighbour table). Works on a single grid of
+    shape (rows, columns) or a batch of grids of shape (n, rows, columns).
+    :param grid: numpy array of tile type values
+    :param topology: Topology of the board. Default is a square board of the grid's shape.
+    :return: array of the same shape holding, for each non-empty tile, the flat index of the first tile of its group
+    (empty tiles get rows * columns)
+    """
+    rows, columns = grid.shape[-2:]
+    if topology is None:
+        topology = get_topology(rows, columns)
+    cells = rows * columns
+    flat_grid = grid.reshape(grid.shape[:-2] + (cells,))
+    # Tile types of every neighbour, with the padding of the table pointing at an always-empty extra tile
+    padded_grid = np.concatenate([flat_grid, np.zeros(flat_grid.shape[:-1] + (1,), dtype=grid.dtype)], axis=-1)
+    same = (padded_grid[..., topology.padded] == flat_grid[..., np.newaxis]) & (flat_grid != EMPTY)[..., np.newaxis]
+    labels = np.where(flat_grid != EMPTY, np.arange(cells), cells)
+    sentinel = np.full(labels.shape[:-1] + (1,), cells)
+    while True:
+        padded = np.concatenate([labels, sentinel], axis=-1)
+        new = np.minimum(labels, np.where(same, padded[..., topology.padded], cells).min(axis=-1))
+        # Jump straight to the label of the tile each label points at, which shortens long chains
+        new = np.take_along_axis(np.concatenate([new, sentinel], axis=-1), new, axis=-1)
+        if (new == labels).all():
+            return labels.reshape(grid.shape)
+        labels = new
+
+
+def group_sizes(grid, topology=None):
+    """
+    Size of the group each tile belongs to (zero for empty tiles).
+    :param grid: 2D numpy array of tile type values
+    :param topology: Topology of the board. Default is a square board of the grid's shape.
+    :return: 2D numpy array of group sizes
+    """
+    labels = label_groups(grid, topology)
+    counts = np.bincount(labels.ravel(), minlength=grid.size + 1)
+    counts[grid.size] = 0
+    return counts[labels]
+
+
+class HeadlessBoard(object):
+    """
+    Board rules without any sprites attached. The state of the board is a single 2D uint8 array of tile type values,
+    which keeps each instance small enough to host thousands of them in one process.
+    """
+
+    __slots__ = ('_grid', '_rng', '_mode', '_row_offset', '_topology')
+
+    def __init__(self, row, column, grid=None, seed=None, mode=CLASSIC_MODE, topology=SQUARE_TOPOLOGY):
+        """
+        HeadlessBoard construct.
+
+        :param row: # of rows in the board
+        :param column: # of columns in the board
+        :param grid: initial 2D array of non-empty tile type values. If None, a random board with at least one legal
+        move is generated.
+        :param seed: seed for the random number generator used to generate the board (and, in gravity mode, the new
+        tiles). Default is None.
+        :param mode: game mode, one of GAME_MODES. Default is classic.
+        :param topology: board topology, one of TOPOLOGIES. Default is square.
+        """
+        if mode not in GAME_MODES:
+            raise ValueError(f"Unknown game mode: {mode}")
+        if mode == ENDLESS_MODE and topology == HEX_TOPOLOGY:
+            raise ValueError("Endless mode does not support the hex topology")
+        self._mode = mode
+        self._topology = get_topology(row, column, topology)
+        rng = Random(seed)
+        # Only gravity and endless mode draw new tiles once the board is set up. The generator's state takes up most of
+        # the memory of a board, so classic boards do not keep it.
+        self._rng = rng if mode != CLASSIC_MODE else None
+        # Endless mode: index in _grid of the bottom row, as the rows are used as a ring buffer
+        self._row_offset = 0
+        if grid is None:
+            self._grid = self._random_grid(row, column, rng)
+        else:
+            grid = np.array(grid, dtype=np.uint8)
+            if grid.shape != (row, column):
+                raise ValueError(f"INITIALISATION ERROR: grid shape {grid.shape} does not match ({row}, {column})")
+            if not np.isin(grid, NONEMPTY_TYPES).all():
+                raise ValueError("INITIALISATION ERROR: every grid value must be a non-empty tile type")
+            self._grid = grid
+
+    def _random_grid(self, row, column, rng):
+        """
+        Generate random grids until one has at least one legal move, the same way TileMiner sets up its board.
+        :param row: # of rows in the board
+        :param column: # of columns in the board
+        :param rng: random.Random instance the tiles are drawn from
+        :return: 2D numpy array
+        """
+        while True:
+            grid = np.array([[rng.choice(NONEMPTY_TYPES) for _ in range(column)] for _ in range(row)],
+                            dtype=np.uint8)
+            if any_legal_moves(grid, topology=self._topology):
+                return grid
+
+    @property
+    def grid(self):
+        """
+        Tile type values, bottom row first. This is the board's own array, except in endless mode once rows have
+        scrolled, when it is a copy put back in order.
+        :return: 2D numpy array
+        """
+        if self._row_offset:
+            return np.roll(self._grid, -self._row_offset, axis=0)
+        return self._grid
+
+    @property
+    def board_row(self):
+        return self._grid.shape[0]
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @property
+    def board_column(self):
+        return self._grid.shape[1]
+
+    @property
+    def topology(self):
+        return self._topology
+
+    def get_tile_type(self, row_pos, col_pos):
+        return self._grid.item((row_pos + self._row_offset) % self._grid.shape[0], col_pos)
+
+    def find_group_and_perimeter(self, row_pos, col_pos):
+        return find_group_and_perimeter(self._grid, row_pos, col_pos, self._row_offset, self._topology)
+
+    def any_legal_moves(self):
+        return any_legal_moves(self._grid, self._row_offset, self._topology)
+
+    def apply_move(self, row_pos, col_pos):
+        """
+        Remove the group containing (row_pos, col_pos) and increment its non-empty perimeter tiles. In gravity mode the
+        tiles then fall and the board is refilled; in endless mode, cleared rows scroll off. In both cases the changed
+        cells of the result cover the whole move. Nothing changes if the selected tile is empty or on its own.
+        :param row_pos: row position selected
+        :param col_pos: column position selected
+        :return: MoveResult, or None if nothing changes
+        """
+        if self._mode == CLASSIC_MODE:
+            return apply_move(self._grid, row_pos, col_pos, topology=self._topology)
+        before = self.grid.copy()
+        move = apply_move(self._grid, row_pos, col_pos, self._row_offset, self._topology)
+        if move is None:
+            return None
+        if self._mode == GRAVITY_MODE:
+            apply_gravity(self._grid, self._rng)
+        else:
+            self._row_offset, _ = scroll_rows(self._grid, self._row_offset, self._rng, self._topology)
+        after = self.grid
+        rows, cols = np.nonzero(after != before)
+        return move._replace(changed=list(zip(rows.tolist(), cols.tolist(), after[rows, cols].tolist())))
+
+    def __str__(self):
+        """
+        Print out current state of the board, mirrored to match the grid displayed in the game window.
+        :return: string
+        """
+        return "\n".join(" ".join(str(t) for t in row) for row in self.grid[::-1].tolist())
+
+
+if __name__ == "__main__":
+    board = HeadlessBoard(5, 5, seed=0)
+    print(board)
+    print(board.apply_move(0, 0))
+    print(board)
+    print(board.any_legal_moves())
+    board = HeadlessBoard(5, 5, seed=0, mode=GRAVITY_MODE)
+    board.apply_move(0, 0)
+    print(board)
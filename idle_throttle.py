@@ -0,0 +1,94 @@
+import time
+import pyglet
+
+from constants import IDLE_THROTTLING, UPDATE_RATE, IDLE_TIMEOUT, IDLE_UPDATE_INTERVAL
+
+# Window events that count as input and bring the game back to the full update rate
+INPUT_EVENTS = ('on_mouse_motion', 'on_mouse_press', 'on_mouse_release', 'on_mouse_drag', 'on_mouse_scroll',
+                'on_key_press', 'on_key_release', 'on_text')
+
+
+class IdleThrottle(object):
+    """
+    IdleThrottle class. Takes over the window's update schedule so that an idle game stops burning CPU: updates (and
+    the redraws that follow them) run at the full rate while the player is active, and once the player has been idle
+    for a while only when the view next changes. Every update is passed the time really elapsed since the previous one,
+    so the game timer keeps counting accurately whatever the rate.
+
+    Views can define time_to_next_change(), returning 0 while they are animating, the # of seconds until they next
+    change on their own, or None if nothing changes until the next input. Views without it are treated as static.
+    """
+
+    def __init__(self, enabled=True, update_rate=UPDATE_RATE, idle_timeout=IDLE_TIMEOUT,
+                 idle_interval=IDLE_UPDATE_INTERVAL):
+        """
+        IdleThrottle construct.
+        :param enabled: whether attach() takes over the window's updates
+        :param update_rate: full update rate, in updates per second
+        :param idle_timeout: seconds without input after which the game counts as idle
+        :param idle_interval: longest time between two updates while idle, in seconds
+        """
+        self._enabled = enabled
+        self._interval = 1 / update_rate
+        self._idle_timeout = idle_timeout
+        self._idle_interval = idle_interval
+        self._window = None
+        self._last_input = time.perf_counter()
+        self._last_update = self._last_input
+        self._idle = False
+
+    @property
+    def idle(self):
+        return self._idle
+
+    def attach(self, window):
+        """
+        Replace the window's fixed-rate updates with throttled ones, and listen for input on it. Does nothing while
+        throttling is disabled.
+        :param window: arcade.Window
+        :return:
+        """
+        if not self._enabled:
+            return
+        self._window = window
+        # arcade schedules its updates with set_update_rate(); they are dispatched from here instead
+        pyglet.clock.unschedule(window._dispatch_updates)
+        self._last_update = time.perf_counter()
+        pyglet.clock.schedule_interval(self._update, self._interval)
+        window.push_handlers(**{event: self._on_input for event in INPUT_EVENTS})
+
+    def _on_input(self, *args):
+        self._last_input = time.perf_counter()
+        if self._idle:
+            self._wake()
+
+    def _wake(self):
+        self._idle = False
+        pyglet.clock.unschedule(self._update)
+        pyglet.clock.schedule_interval(self._update, self._interval)
+
+    def _update(self, _):
+        """
+        Update the window with the time elapsed since the last update, then decide when the next update is due.
+        :return:
+        """
+        now = time.perf_counter()
+        delta_time, self._last_update = now - self._last_update, now
+        self._window._dispatch_updates(delta_time)
+
+        if now - self._last_input < self._idle_timeout:
+            return
+        view = self._window.current_view
+        delay = view.time_to_next_change() if hasattr(view, 'time_to_next_change') else None
+        if delay == 0:
+            if self._idle:
+                self._wake()
+            return
+        self._idle = True
+        pyglet.clock.unschedule(self._update)
+        pyglet.clock.schedule_once(self._update, self._idle_interval if delay is None else
+                                   min(delay, self._idle_interval))
+
+
+# Shared throttle for the game window
+idle_throttle = IdleThrottle(enabled=IDLE_THROTTLING)
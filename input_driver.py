@@ -0,0 +1,298 @@
+import argparse
+from collections import namedtuple
+import json
+import os
+import random
+import sys
+import time
+
+import pyglet
+from pyglet.event import EventDispatcher
+
+# Environment variable that forces pyglet's headless (EGL) window, e.g. on a machine with a display. Without a display
+# the headless window is always used. This has to be decided before arcade creates its window class.
+HEADLESS_ENV_VAR = "TILE_MINER_HEADLESS"
+if HEADLESS_ENV_VAR in os.environ or (sys.platform.startswith('linux') and 'DISPLAY' not in os.environ):
+    pyglet.options['headless'] = True
+
+import arcade
+
+from constants import *
+from load_test import percentile
+from tile_miner import TileMiner
+
+# Synthetic input event. time is the arrival time in seconds from the start of the run; button is None for motions.
+InputEvent = namedtuple('InputEvent', ['time', 'kind', 'x', 'y', 'button'])
+
+MOTION = 'motion'
+PRESS = 'press'
+
+
+def random_trace(rng, duration, motion_rate, press_rate, width, height):
+    """
+    Random input: mouse motions and left clicks arriving at the given average rates (as Poisson processes) at random
+    points of the board.
+    :param rng: random.Random instance
+    :param duration: length of the trace in seconds
+    :param motion_rate: average # of mouse motions per second
+    :param press_rate: average # of mouse presses per second
+    :param width: width of the area the events fall in
+    :param height: height of the area the events fall in
+    :return: list of InputEvent in time order
+    """
+    events = []
+    for kind, rate in ((MOTION, motion_rate), (PRESS, press_rate)):
+        if rate <= 0:
+            continue
+        arrival = rng.expovariate(rate)
+        while arrival < duration:
+            events.append(InputEvent(arrival, kind, rng.uniform(0, width), rng.uniform(0, height),
+                                     arcade.MOUSE_BUTTON_LEFT if kind == PRESS else None))
+            arrival += rng.expovariate(rate)
+    events.sort()
+    return events
+
+
+def save_trace(path, events, game):
+    """
+    Write a trace as JSON lines: the game settings it was recorded with, then one event per line.
+    :param path: file to write
+    :param events: list of InputEvent
+    :param game: dictionary of TileMiner settings (row_count, column_count, seed, mode, topology)
+    :return:
+    """
+    with open(path, 'w') as f:
+        f.write(json.dumps(game) + '\n')
+        for event in events:
+            f.write(json.dumps(event._asdict()) + '\n')
+
+
+def load_trace(path):
+    """
+    Read a trace written by save_trace.
+    :param path: trace file
+    :return: (list of InputEvent in time order, dictionary of TileMiner settings)
+    """
+    with open(path) as f:
+        game = json.loads(f.readline())
+        events = [InputEvent(**json.loads(line)) for line in f if line.strip()]
+    events.sort()
+    return events, game
+
+
+class LatencyRecorder(object):
+    """
+    LatencyRecorder class. Collects, for each kind of input event, the time from its arrival until its handler has
+    returned and until the first frame drawn after it has been finished by the GPU. The game view only records mouse
+    motions and works out the hover highlight on the next update, so for motions the frame latency is the one that
+    includes the game state change.
+    """
+
+    def __init__(self):
+        self.to_state = {MOTION: [], PRESS: []}
+        self.to_frame = {MOTION: [], PRESS: []}
+        # Events handled since the last frame: (kind, arrival time)
+        self._pending = []
+
+    def handled(self, kind, arrival, now):
+        self.to_state[kind].append(now - arrival)
+        self._pending.append((kind, arrival))
+
+    def frame_finished(self, now):
+        for kind, arrival in self._pending:
+            self.to_frame[kind].append(now - arrival)
+        del self._pending[:]
+
+    def summary(self):
+        """
+        Latency percentiles in milliseconds.
+        :return: dictionary of {'<kind>_<to_state|to_frame>': {'count', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms'}}
+        """
+        results = {}
+        for name, latencies in (('to_state', self.to_state), ('to_frame', self.to_frame)):
+            for kind, values in latencies.items():
+                values = sorted(values)
+                results[f"{kind}_{name}"] = {
+                    'count': len(values),
+                    'p50_ms': 1000 * percentile(values, 0.50),
+                    'p90_ms': 1000 * percentile(values, 0.90),
+                    'p99_ms': 1000 * percentile(values, 0.99),
+                    'max_ms': 1000 * (values[-1] if values else 0.0),
+                }
+        return results
+
+
+class InputDriver(object):
+    """
+    InputDriver class. Plays a trace of input events into a TileMiner view shown in an invisible window, stepping the
+    window's update, draw and flip itself so that every event can be timed through the whole UI path: the view's
+    handlers, the board, the dashboard and the sprites. A game that ends is replaced by a new one with the next seed,
+    without the pause and return screen of a normal game over.
+    """
+
+    def __init__(self, events, game, fps=60, total_time=3600):
+        """
+        InputDriver construct.
+        :param events: list of InputEvent in time order
+        :param game: dictionary of TileMiner settings (row_count, column_count, seed, mode, topology)
+        :param fps: frames drawn per second. If 0, frames are drawn back to back.
+        :param total_time: game time of each game in seconds
+        """
+        self.events = events
+        self.game = dict(game)
+        self.fps = fps
+        self.total_time = total_time
+        self.frames = 0
+        self.games = 0
+        self.latency = LatencyRecorder()
+        self.window = arcade.Window(WIDTH, HEIGHT, "Tile Miner", visible=False)
+        self._view = self._new_game()
+
+    def _new_game(self):
+        self.games += 1
+        view = TileMiner(total_time=self.total_time, **self.game)
+        self.game['seed'] = (view.seed + 1) % 2 ** 32
+        self.window.width = view.screen_width
+        self.window.height = view.screen_height
+        self.window.show_view(view)
+        return view
+
+    def _send(self, *event):
+        # pyglet windows queue events dispatched outside dispatch_events(); the dispatcher's own method runs the
+        # handlers straight away, so that they can be timed
+        EventDispatcher.dispatch_event(self.window, *event)
+
+    def _dispatch(self, event):
+        if event.kind == MOTION:
+            self._send('on_mouse_motion', event.x, event.y, 0, 0)
+        else:
+            self._send('on_mouse_press', event.x, event.y, event.button, 0)
+
+    def _draw_frame(self, delta_time):
+        if self._view.no_moves or self._view.dashboard.timer < 0:
+            self._view = self._new_game()
+        self.window.switch_to()
+        self.window.dispatch_events()
+        self._send('on_update', delta_time)
+        self._send('on_draw')
+        self.window.flip()
+        self.window.ctx.finish()
+        self.frames += 1
+
+    def run(self):
+        """
+        Play the whole trace. Events are dispatched at the start of the first frame after their arrival time, as a
+        real event loop would, so time spent waiting for a frame counts towards their latency.
+        :return: dictionary of results
+        """
+        frame_time = 1 / self.fps if self.fps > 0 else 0
+        start = time.perf_counter()
+        last_frame = start
+        next_event = 0
+        while next_event < len(self.events):
+            now = time.perf_counter()
+            while next_event < len(self.events) and start + self.events[next_event].time <= now:
+                event = self.events[next_event]
+                self._dispatch(event)
+                self.latency.handled(event.kind, start + event.time, time.perf_counter())
+                next_event += 1
+            self._draw_frame(now - last_frame)
+            last_frame = now
+            self.latency.frame_finished(time.perf_counter())
+            wait = last_frame + frame_time - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        elapsed = time.perf_counter() - start
+        self._view.on_hide_view()
+        self.window.close()
+
+        results = {'events': len(self.events), 'frames': self.frames, 'games': self.games, 'seconds': elapsed,
+                   'fps': self.frames / elapsed if elapsed > 0 else 0.0}
+        results.update(self.latency.summary())
+        return results
+
+
+def record_trace(path, game, total_time=60):
+    """
+    Play a game in a normal window and record the mouse motions and presses as a trace that the driver can replay.
+    The trace is written when the window is closed.
+    :param path: trace file to write
+    :param game: dictionary of TileMiner settings (row_count, column_count, seed, mode, topology)
+    :param total_time: game time in seconds
+    :return: # of events recorded
+    """
+    window = arcade.Window(WIDTH, HEIGHT, "Tile Miner (recording)")
+    view = TileMiner(total_time=total_time, **game)
+    window.width = view.screen_width
+    window.height = view.screen_height
+    events = []
+    start = time.perf_counter()
+
+    def on_mouse_motion(x, y, dx, dy):
+        events.append(InputEvent(time.perf_counter() - start, MOTION, x, y, None))
+
+    def on_mouse_press(x, y, button, modifiers):
+        events.append(InputEvent(time.perf_counter() - start, PRESS, x, y, button))
+
+    # Pushed on the window rather than the view, so recording carries on through the return screen
+    window.push_handlers(on_mouse_motion=on_mouse_motion, on_mouse_press=on_mouse_press)
+    window.show_view(view)
+    arcade.run()
+    game = dict(game, seed=view.seed)
+    save_trace(path, events, game)
+    return len(events)
+
+
+def print_results(results):
+    print(f"{results['events']} events, {results['frames']} frames ({results['fps']:.1f} fps), "
+          f"{results['games']} games in {results['seconds']:.2f}s")
+    for kind in (MOTION, PRESS):
+        for name in ('to_state', 'to_frame'):
+            stats = results[f"{kind}_{name}"]
+            print(f"{kind:6} input-{name.replace('_', '-'):9} n={stats['count']:<7} p50: {stats['p50_ms']:.3f} ms, "
+                  f"p90: {stats['p90_ms']:.3f} ms, p99: {stats['p99_ms']:.3f} ms, max: {stats['max_ms']:.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive Tile Miner with synthetic mouse input in an invisible window "
+                                                 "and measure input-to-state and input-to-frame latency.")
+    parser.add_argument('--trace', default=None, help="replay this recorded trace instead of random input")
+    parser.add_argument('--record', default=None, help="play a game in a normal window and record it to this file")
+    parser.add_argument('--save-trace', default=None, help="also write the random trace to this file")
+    parser.add_argument('--duration', type=float, default=10, help="length of the random trace in seconds")
+    parser.add_argument('--motion-rate', type=float, default=120, help="mouse motions per second")
+    parser.add_argument('--press-rate', type=float, default=5, help="mouse presses per second")
+    parser.add_argument('--fps', type=float, default=60, help="frames per second (0: as fast as possible)")
+    parser.add_argument('--rows', type=int, default=6)
+    parser.add_argument('--columns', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mode', choices=GAME_MODES, default=CLASSIC_MODE)
+    parser.add_argument('--topology', choices=TOPOLOGIES, default=SQUARE_TOPOLOGY)
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args()
+
+    game = {'row_count': args.rows, 'column_count': args.columns, 'seed': args.seed, 'mode': args.mode,
+            'topology': args.topology}
+    if args.record is not None:
+        recorded = record_trace(args.record, game)
+        print(f"{recorded} events recorded to {args.record}")
+        return
+    if args.trace is not None:
+        events, game = load_trace(args.trace)
+    else:
+        # Events fall on the board and a little around it, to exercise the off-board checks too
+        width = (TILE_SCALED_WIDTH + MARGIN) * (args.columns + 1) + 2 * VERTICAL_BORDER_MARGIN
+        height = (TILE_SCALED_HEIGHT + MARGIN) * (args.rows + 0.5)
+        events = random_trace(random.Random(args.seed), args.duration, args.motion_rate, args.press_rate, width,
+                              height)
+        if args.save_trace is not None:
+            save_trace(args.save_trace, events, game)
+    results = InputDriver(events, game, fps=args.fps).run()
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import argparse
+from collections import OrderedDict
+import heapq
+import os
+from xml.parsers import expat
+from xml.sax.saxutils import escape
+
+from data_handler import DataHandler
+
+# Fields of a leaderboard entry, in the order they are written. Nested fields are (element, children).
+ENTRY_FIELDS = ('name', ('date', ('year', 'month', 'day')), ('dimensions', ('row', 'column')),
+                ('time', ('minutes', 'seconds')), 'score')
+
+# Bytes handed to the XML parser at a time
+READ_CHUNK_SIZE = 1 << 16
+
+# One entry as xmltodict.unparse(pretty=True) writes it, so merged files match the ones DataHandler writes
+PLAYER_TEMPLATE = ('\t<player rank="{rank}">\n\t\t<name>{name}</name>\n'
+                   '\t\t<date>\n\t\t\t<year>{year}</year>\n\t\t\t<month>{month}</month>\n'
+                   '\t\t\t<day>{day}</day>\n\t\t</date>\n'
+                   '\t\t<dimensions>\n\t\t\t<row>{row}</row>\n\t\t\t<column>{column}</column>\n\t\t</dimensions>\n'
+                   '\t\t<time>\n\t\t\t<minutes>{minutes}</minutes>\n\t\t\t<seconds>{seconds}</seconds>\n\t\t</time>\n'
+                   '\t\t<score>{score}</score>\n\t</player>\n')
+XML_DECLARATION = '<?xml version="1.0" encoding="utf-8"?>\n'
+
+
+def _new_entry(rank):
+    """
+    An empty entry of the same kind of dictionary that xmltodict gives DataHandler.
+    :param rank: rank attribute of the <player> element
+    :return: OrderedDict
+    """
+    entry = OrderedDict()
+    entry['@rank'] = rank
+    for field in ENTRY_FIELDS:
+        if isinstance(field, tuple):
+            element, children = field
+            entry[element] = OrderedDict.fromkeys(children)
+        else:
+            entry[field] = None
+    return entry
+
+
+def _read_entries(path):
+    """
+    Parse a leaderboard file with expat, a chunk at a time, so that only the entries of the current chunk are held.
+    :param path: leaderboard XML file
+    :return: generator of entries (dictionaries in xmltodict's form)
+    """
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    entries = []
+    text = []
+    # (element, dictionary) of the current entry and of its nested field being read, if any
+    open_elements = []
+
+    def start_element(name, attributes):
+        if name == 'player':
+            open_elements[:] = [(name, _new_entry(attributes.get('rank')))]
+        elif open_elements and isinstance(open_elements[-1][1].get(name), OrderedDict):
+            open_elements.append((name, open_elements[-1][1][name]))
+        del text[:]
+
+    def end_element(name):
+        if open_elements:
+            element, fields = open_elements[-1]
+            if name == element:
+                open_elements.pop()
+                if name == 'player':
+                    entries.append(fields)
+            elif name in fields:
+                fields[name] = ''.join(text) or None
+        del text[:]
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = text.append
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            parser.Parse(chunk, not chunk)
+            yield from entries
+            del entries[:]
+            if not chunk:
+                break
+
+
+def iter_leaderboard(path, file_index=0):
+    """
+    Stream the entries of a leaderboard file, best first, without loading the whole file.
+    :param path: leaderboard XML file
+    :param file_index: position of the file among the files being merged, used to break ties between files
+    :return: generator of ((-score, file_index, rank), entry) tuples
+    """
+    previous = None
+    for entry in _read_entries(path):
+        try:
+            key = (-int(entry['score']), file_index, int(entry['@rank']))
+        except (TypeError, ValueError):
+            raise ValueError(f"Leaderboard entry without a valid score and rank in {path}: {entry}")
+        if previous is not None and key < previous:
+            raise ValueError(f"Leaderboard entries are not in rank order in {path} (rank {entry['@rank']})")
+        previous = key
+        yield key, entry
+
+
+def _identity(entry):
+    """
+    What makes two entries the same game, e.g. when a file is imported twice: everything except the rank.
+    """
+    return (entry['name'], tuple(entry['date'].values()), tuple(entry['dimensions'].values()),
+            tuple(entry['time'].values()), entry['score'])
+
+
+def merge_entries(paths, top=DataHandler.max_data):
+    """
+    K-way merge of leaderboard files by score. As in DataHandler.add_new_player_data, a tie does not move an entry
+    above one that was already ranked: ties keep their rank order within a file, and entries from earlier files come
+    first. Duplicate entries are kept once.
+
+    Every file is already sorted, so the merge is lazy: it stops after the top entries, having read each file only as
+    far as its part of them. Memory grows with top, not with the size of the files.
+    :param paths: leaderboard XML files
+    :param top: # of entries to keep
+    :return: list of entries (dictionaries in xmltodict's form), re-ranked from 1
+    """
+    merged = heapq.merge(*(iter_leaderboard(path, i) for i, path in enumerate(paths)), key=lambda item: item[0])
+    entries = []
+    seen = set()
+    for _, entry in merged:
+        identity = _identity(entry)
+        if identity in seen:
+            continue
+        seen.add(identity)
+        entry['@rank'] = str(len(entries) + 1)
+        entries.append(entry)
+        if len(entries) == top:
+            break
+    return entries
+
+
+def write_leaderboard(path, entries):
+    """
+    Write entries in the same format as DataHandler.add_new_player_data. The file is replaced in one step, so it may be
+    one of the files the entries were read from.
+    :param path: file to write
+    :param entries: list of entries (dictionaries in xmltodict's form) in rank order
+    :return:
+    """
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w', encoding='utf-8') as f:
+        f.write(XML_DECLARATION)
+        if not entries:
+            f.write('<leaderboard></leaderboard>')
+        else:
+            f.write('<leaderboard>\n')
+            for entry in entries:
+                fields = {'rank': escape(entry['@rank'], {'"': '&quot;'})}
+                for field in ENTRY_FIELDS:
+                    if isinstance(field, tuple):
+                        element, children = field
+                        fields.update((child, escape(entry[element][child] or '')) for child in children)
+                    else:
+                        fields[field] = escape(entry[field] or '')
+                f.write(PLAYER_TEMPLATE.format(**fields))
+            f.write('</leaderboard>')
+    os.replace(temporary_path, path)
+
+
+def merge_leaderboards(paths, out_path, top=DataHandler.max_data):
+    """
+    Merge leaderboard files into one.
+    :param paths: leaderboard XML files
+    :param out_path: file to write the merged leaderboard to (may be one of paths)
+    :param top: # of entries to keep
+    :return: # of entries written
+    """
+    entries = merge_entries(paths, top)
+    write_leaderboard(out_path, entries)
+    return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge Tile Miner leaderboards from several machines into one.")
+    parser.add_argument('out_path')
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--top', type=int, default=DataHandler.max_data, help="# of entries to keep")
+    args = parser.parse_args()
+    written = merge_leaderboards(args.paths, args.out_path, args.top)
+    print(f"{written} entries written to {args.out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,13 +4,12 @@ import menu_view
 from data_handler import DataHandler
 from arcade.gui import UIManager
 from constants import *
+from profiler import profiler
+from asset_atlas import load_atlas
 
-
-import os
-dirname = os.path.dirname(__file__)
-button_normal = arcade.load_texture(os.path.join(dirname, 'images/red_button_normal.png'))
-hovered_texture = arcade.load_texture(os.path.join(dirname, 'images/red_button_hover.png'))
-pressed_texture = arcade.load_texture(os.path.join(dirname, 'images/red_button_press.png'))
+button_normal = load_atlas().texture('red_button_normal')
+hovered_texture = load_atlas().texture('red_button_hover')
+pressed_texture = load_atlas().texture('red_button_press')
 
 
 class BackButton(arcade.gui.UIImageButton):
@@ -122,8 +121,12 @@ class LeaderboardView(arcade.View):
             self.window.show_view(next_view)
 
 
+profiler.register(LeaderboardView, 'on_draw', 'update', frame='on_draw')
+
+
 def main():
     window = arcade.Window(WIDTH, HEIGHT, "Tile Miner")
+    profiler.attach(window)
     leaderboard_view = LeaderboardView()
     window.show_view(leaderboard_view)
     arcade.run()
@@ -0,0 +1,144 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import numpy as np
+
+from constants import SQUARE_TOPOLOGY, TOPOLOGIES
+from game_server import GameServer
+from topology import get_topology
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+    :param sorted_values: sorted list of numbers
+    :param fraction: percentile as a fraction between 0 and 1
+    :return: float
+    """
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def choose_click(grid, rng, topology=SQUARE_TOPOLOGY):
+    """
+    Pick a cell to click. Prefers cells that belong to a group so that most clicks are real moves.
+    :param grid: client-side copy of the board as a list of rows
+    :param rng: random.Random instance
+    :param topology: board topology, one of TOPOLOGIES. Default is square.
+    :return: (row, column) or None if the board is empty
+    """
+    flat = np.array(grid, dtype=np.uint8).ravel()
+    columns = len(grid[0])
+    # Both tiles of every neighbouring pair of the same type are in a group
+    first, second = get_topology(len(grid), columns, topology).edges
+    same = (flat[first] == flat[second]) & (flat[first] != 0)
+    candidates = np.union1d(first[same], second[same])
+    if len(candidates):
+        return divmod(int(candidates[rng.randrange(len(candidates))]), columns)
+    return None
+
+
+async def play_session(reader, writer, args, latencies, rng):
+    """
+    Play one session over an open connection, recording the latency of each click.
+    :return: number of clicks played
+    """
+    async def call(message):
+        writer.write(json.dumps(message).encode() + b'\n')
+        await writer.drain()
+        return json.loads(await reader.readline())
+
+    response = await call({'op': 'new', 'rows': args.rows, 'columns': args.columns, 'time': args.time,
+                           'seed': rng.randrange(2 ** 32), 'topology': args.topology})
+    session_id = response['session']
+    grid = response['grid']
+    moves = 0
+    while moves < args.moves:
+        click = choose_click(grid, rng, args.topology)
+        if click is None:
+            break
+        start = time.perf_counter()
+        response = await call({'op': 'click', 'session': session_id, 'row': click[0], 'column': click[1]})
+        latencies.append(time.perf_counter() - start)
+        moves += 1
+        for row, column, tile_type in response['changed']:
+            grid[row][column] = tile_type
+        if response['no_moves'] or response['time_left'] <= 0:
+            break
+    await call({'op': 'close', 'session': session_id})
+    return moves
+
+
+async def client(connect, args, latencies, seed):
+    reader, writer = await connect()
+    rng = random.Random(seed)
+    moves = 0
+    for _ in range(args.games):
+        moves += await play_session(reader, writer, args, latencies, rng)
+    writer.close()
+    return moves
+
+
+async def run_load_test(args):
+    """
+    Run the load test and print latency percentiles and throughput. If neither --port nor --unix is given, a server
+    is started in this process on a free port.
+    :param args: parsed command line arguments
+    :return: dictionary of results
+    """
+    server = None
+    if args.unix is not None:
+        def connect():
+            return asyncio.open_unix_connection(args.unix)
+    else:
+        host, port = args.host, args.port
+        if port is None:
+            server = GameServer()
+            host, port = await server.start_tcp(host, 0)
+
+        def connect():
+            return asyncio.open_connection(host, port)
+
+    latencies = []
+    start = time.perf_counter()
+    moves = await asyncio.gather(*(client(connect, args, latencies, seed) for seed in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    if server is not None:
+        server.close()
+
+    latencies.sort()
+    results = {
+        'clients': args.clients,
+        'moves': sum(moves),
+        'seconds': elapsed,
+        'moves_per_second': sum(moves) / elapsed if elapsed > 0 else 0.0,
+        'p50_ms': 1000 * percentile(latencies, 0.50),
+        'p99_ms': 1000 * percentile(latencies, 0.99),
+    }
+    print(f"{results['clients']} clients, {results['moves']} moves in {results['seconds']:.2f}s "
+          f"({results['moves_per_second']:.0f} moves/s)")
+    print(f"move latency p50: {results['p50_ms']:.3f} ms, p99: {results['p99_ms']:.3f} ms")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a Tile Miner game server.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=None, help="port of a running server (default: start one)")
+    parser.add_argument('--unix', default=None, help="connect to a server on this Unix socket path")
+    parser.add_argument('--clients', type=int, default=1000, help="concurrent connections")
+    parser.add_argument('--games', type=int, default=1, help="games played by each client")
+    parser.add_argument('--moves', type=int, default=50, help="maximum moves per game")
+    parser.add_argument('--rows', type=int, default=10)
+    parser.add_argument('--columns', type=int, default=10)
+    parser.add_argument('--time', type=float, default=600)
+    parser.add_argument('--topology', choices=TOPOLOGIES, default=SQUARE_TOPOLOGY)
+    asyncio.run(run_load_test(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
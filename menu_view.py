@@ -2,12 +2,15 @@ import arcade
 import arcade.gui
 from arcade.gui import UIManager
 from constants import *
-
 import os
-dirname = os.path.dirname(__file__)
-button_normal = arcade.load_texture(os.path.join(dirname, 'images/red_button_normal.png'))
-hovered_texture = arcade.load_texture(os.path.join(dirname, 'images/red_button_hover.png'))
-pressed_texture = arcade.load_texture(os.path.join(dirname, 'images/red_button_press.png'))
+import session_file
+import session_journal
+from profiler import profiler
+from asset_atlas import load_atlas
+
+button_normal = load_atlas().texture('red_button_normal')
+hovered_texture = load_atlas().texture('red_button_hover')
+pressed_texture = load_atlas().texture('red_button_press')
 
 
 class BoundaryError(Exception):
@@ -46,6 +49,42 @@ class LeaderboardButton(arcade.gui.UIImageButton):
         self.go_to_leaderboard = True
 
 
+class ResumeButton(arcade.gui.UIImageButton):
+    """
+    Resume button class - click the button to carry on from a game that was cut short, or else from the most recently
+    saved game.
+    """
+
+    resume_game = False
+
+    def on_click(self):
+        self.resume_game = True
+
+
+class ModeButton(arcade.gui.UIImageButton):
+    """
+    Mode button class - click the button to cycle through the game modes.
+    """
+
+    mode = GAME_MODES[0]
+
+    def on_click(self):
+        self.mode = GAME_MODES[(GAME_MODES.index(self.mode) + 1) % len(GAME_MODES)]
+        self.text = self.mode.capitalize()
+
+
+class TopologyButton(arcade.gui.UIImageButton):
+    """
+    Topology button class - click the button to cycle through the board topologies.
+    """
+
+    topology = TOPOLOGIES[0]
+
+    def on_click(self):
+        self.topology = TOPOLOGIES[(TOPOLOGIES.index(self.topology) + 1) % len(TOPOLOGIES)]
+        self.text = self.topology.capitalize()
+
+
 class MainMenu(arcade.View):
     """
     Class for main menu screen (the first view the player sees when booting up the game).
@@ -55,7 +94,8 @@ class MainMenu(arcade.View):
     MIN = 4
     MAX = 20
 
-    def __init__(self, row_count=5, column_count=5, minutes=1, seconds=0):
+    def __init__(self, row_count=5, column_count=5, minutes=1, seconds=0, mode=CLASSIC_MODE,
+                 topology=SQUARE_TOPOLOGY):
         """
         MainMenu construct.
         """
@@ -67,6 +107,8 @@ class MainMenu(arcade.View):
         self.column_count = column_count
         self.minutes = minutes
         self.seconds = seconds
+        self.mode = mode
+        self.topology = topology
 
         # GUI elements which will get constructed in setup()
         self.ui_row_input_box = None
@@ -75,6 +117,12 @@ class MainMenu(arcade.View):
         self.ui_second_input_box = None
         self.play_button = None
         self.leaderboard_button = None
+        self.resume_button = None
+        self.mode_button = None
+        self.topology_button = None
+
+        # Why the last press of Play did not start a game, shown under the title until the next press
+        self.message = ""
 
     @property
     def timer(self):
@@ -180,6 +228,28 @@ class MainMenu(arcade.View):
                                                     press_texture=pressed_texture, text='Leaderboard')
         self.ui_manager.add_ui_element(self.leaderboard_button)
 
+        # mode button - press to switch between the game modes
+        self.mode_button = ModeButton(center_x=WIDTH * 2 / 10, center_y=HEIGHT * 2.1 / 10, normal_texture=button_normal,
+                                      hover_texture=hovered_texture, press_texture=pressed_texture,
+                                      text=self.mode.capitalize())
+        self.mode_button.mode = self.mode
+        self.ui_manager.add_ui_element(self.mode_button)
+
+        # topology button - press to switch between the board topologies
+        self.topology_button = TopologyButton(center_x=WIDTH * 8.5 / 10, center_y=HEIGHT * 2.1 / 10,
+                                              normal_texture=button_normal, hover_texture=hovered_texture,
+                                              press_texture=pressed_texture, text=self.topology.capitalize())
+        self.topology_button.topology = self.topology
+        self.ui_manager.add_ui_element(self.topology_button)
+
+        # resume button - press to recover a game that was cut short, or else carry on from the most recently saved
+        # game (only shown if there is one)
+        if os.path.exists(session_journal.JOURNAL_FILE) or session_file.list_sessions():
+            self.resume_button = ResumeButton(center_x=WIDTH / 2, center_y=HEIGHT * 0.5 / 10,
+                                              normal_texture=button_normal, hover_texture=hovered_texture,
+                                              press_texture=pressed_texture, text='Resume')
+            self.ui_manager.add_ui_element(self.resume_button)
+
     def on_draw(self):
         """
         Render the screen.
@@ -212,6 +282,10 @@ class MainMenu(arcade.View):
         arcade.draw_text("(0-59)", WIDTH * 6.9 / 10, HEIGHT * 2.4 / 10,
                          arcade.color.BLACK, font_size=15, anchor_x="center", anchor_y="center")
 
+        if self.message:
+            arcade.draw_text(self.message, WIDTH / 2, HEIGHT * 6.9 / 10,
+                             arcade.color.RED, font_size=15, anchor_x="center", anchor_y="center")
+
     def on_show_view(self):
         """
         Show this view.
@@ -235,6 +309,7 @@ class MainMenu(arcade.View):
         """
 
         if self.play_button.start_game:
+            self.message = ""
             try:
                 self.row_count = int(self.ui_row_input_box.text)
                 self.column_count = int(self.ui_column_input_box.text)
@@ -248,20 +323,60 @@ class MainMenu(arcade.View):
                 self.play_button.start_game = False
                 return
             import tile_miner
+            self.mode = self.mode_button.mode
+            self.topology = self.topology_button.topology
+            if self.mode == ENDLESS_MODE and self.topology == HEX_TOPOLOGY:
+                self.message = "Endless mode cannot be played on a hex board"
+                self.play_button.start_game = False
+                return
             game_view = tile_miner.TileMiner(row_count=self._row_count, column_count=self._column_count,
-                                             total_time=self.timer)
+                                             total_time=self.timer, mode=self.mode, topology=self.topology,
+                                             journal=session_journal.JOURNAL_FILE)
             self.window.width = game_view.screen_width
             self.window.height = game_view.screen_height
             self.window.show_view(game_view)
 
+        if self.resume_button is not None and self.resume_button.resume_game:
+            self.resume_button.resume_game = False
+            import tile_miner
+            if os.path.exists(session_journal.JOURNAL_FILE):
+                try:
+                    game_view = tile_miner.TileMiner.from_journal(session_journal.JOURNAL_FILE)
+                except (OSError, session_journal.JournalError):
+                    # Nothing to recover from this journal; fall back to the saved games
+                    os.remove(session_journal.JOURNAL_FILE)
+                else:
+                    self.window.width = game_view.screen_width
+                    self.window.height = game_view.screen_height
+                    self.window.show_view(game_view)
+                    return
+            for path, _ in session_file.list_sessions():
+                try:
+                    game_view = tile_miner.TileMiner.from_save(path, journal=session_journal.JOURNAL_FILE)
+                except (OSError, ValueError, session_file.SessionFileError):
+                    # A damaged save can never be resumed; drop it and try the next most recent one
+                    os.remove(path)
+                    continue
+                # The save is used up once the game carries on from it, so that a later Resume does not go back to
+                # the same position after this game has moved on or ended
+                os.remove(path)
+                self.window.width = game_view.screen_width
+                self.window.height = game_view.screen_height
+                self.window.show_view(game_view)
+                return
+
         if self.leaderboard_button.go_to_leaderboard:
             import leaderboard_view
             lb_view = leaderboard_view.LeaderboardView()
             self.window.show_view(lb_view)
 
 
+profiler.register(MainMenu, 'on_draw', 'update', frame='on_draw')
+
+
 def main():
     window = arcade.Window(WIDTH, HEIGHT, "Tile Miner")
+    profiler.attach(window)
     menu_view = MainMenu(6, 6, 3, 0)
     window.show_view(menu_view)
     arcade.run()
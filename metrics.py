@@ -0,0 +1,142 @@
+import os
+import threading
+
+# Every counter the engine keeps, with the help text used in the Prometheus export
+COUNTERS = {
+    'bfs_nodes_visited': "Tiles dequeued by the group breadth-first search",
+    'groups_found': "Calls to find_group_and_perimeter",
+    'tiles_removed': "Tiles set to empty by remove_tiles",
+    'tiles_incremented': "Non-empty perimeter tiles incremented by increment_board_tiles",
+    'legality_checks': "Calls to any_legal_moves",
+    'texture_swaps': "Tile textures reloaded after a tile type change",
+    'tiles_moved': "Tile sprites moved to another cell by gravity",
+    'rows_scrolled': "Rows scrolled off the board in endless mode",
+    'motion_events': "Mouse motion events received by the game view",
+    'motion_events_coalesced': "Mouse motion events dropped because a later one arrived before the next update",
+    'xml_parses': "Leaderboard XML files parsed",
+    'xml_writes': "Leaderboard XML files written",
+    'xml_bytes_written': "Bytes of leaderboard XML written",
+    'journal_records': "Actions appended to the session journal",
+    'journal_commits': "fsyncs committing session journal records to disk",
+}
+
+# Prefix for the metric names in the Prometheus export
+METRIC_PREFIX = "tile_miner_"
+
+
+class EngineMetrics(object):
+    """
+    Cumulative counters for the board and data handler hot paths. Board counters are labelled with the board size
+    (e.g. "6x6") so that their growth can be compared across board sizes; data handler counters have no label.
+    """
+
+    def __init__(self):
+        self._values = {}
+
+    def add(self, name, amount=1, board=""):
+        """
+        Increase a counter.
+        :param name: one of the names in COUNTERS
+        :param amount: amount to add
+        :param board: board size label, e.g. "6x6". Default is no label.
+        :return:
+        """
+        key = (name, board)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        """
+        Totals of every counter across all board sizes.
+        :return: dictionary of counter name to value
+        """
+        totals = dict.fromkeys(COUNTERS, 0)
+        for (name, _), value in dict(self._values).items():
+            totals[name] += value
+        return totals
+
+    def snapshot_by_board(self):
+        """
+        Counters broken down by board size label. Counters without a label are listed under "".
+        :return: dictionary of board size label to dictionary of counter name to value
+        """
+        result = {}
+        for (name, board), value in dict(self._values).items():
+            result.setdefault(board, {})[name] = value
+        return result
+
+    def reset(self):
+        self._values = {}
+
+    def prometheus_text(self):
+        """
+        Format the counters in the Prometheus text exposition format.
+        :return: string
+        """
+        values = dict(self._values)
+        lines = []
+        for name, help_text in COUNTERS.items():
+            metric = f"{METRIC_PREFIX}{name}_total"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            series = sorted((board, value) for (counter, board), value in values.items() if counter == name)
+            if not series:
+                lines.append(f"{metric} 0")
+            for board, value in series:
+                label = f'{{board="{board}"}}' if board else ""
+                lines.append(f"{metric}{label} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """
+        Write the counters to a Prometheus text file (e.g. for node_exporter's textfile collector). The file is
+        replaced atomically so a scraper never reads half of it.
+        :param path: file to write
+        :return:
+        """
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(temp_path, path)
+
+
+class PrometheusFileWriter(threading.Thread):
+    """
+    Background thread that rewrites a Prometheus text file at a fixed interval.
+    """
+
+    def __init__(self, engine_metrics, path, interval=15.0):
+        """
+        PrometheusFileWriter construct.
+        :param engine_metrics: EngineMetrics instance to export
+        :param path: file to write
+        :param interval: seconds between writes
+        """
+        super().__init__(daemon=True)
+        self._metrics = engine_metrics
+        self._path = path
+        self._interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            self._metrics.write_prometheus(self._path)
+
+    def stop(self):
+        """
+        Stop the thread and write the counters one last time.
+        :return:
+        """
+        self._stopped.set()
+        self._metrics.write_prometheus(self._path)
+
+
+# Shared counters used by every module of the game
+metrics = EngineMetrics()
+
+
+if __name__ == "__main__":
+    metrics.add('groups_found', board="6x6")
+    metrics.add('bfs_nodes_visited', 12, board="6x6")
+    metrics.add('xml_parses')
+    print(metrics.snapshot())
+    print(metrics.prometheus_text())
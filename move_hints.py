@@ -0,0 +1,103 @@
+import threading
+import numpy as np
+
+from headless_board import apply_move, find_group_and_perimeter, group_points, label_groups
+from tablebase import tablebase_score
+
+
+def rank_groups(grid, topology=None):
+    """
+    Rank every removable group on a type grid by the points it scores now plus the best points available on the next
+    move (one-ply lookahead), breaking ties on the immediate points. If a tablebase covers the board, groups are ranked
+    by the exact best score they lead to instead.
+    :param grid: 2D numpy array of tile type values
+    :param topology: Topology of the board. Default is a square board of the grid's shape.
+    :return: list of (lookahead points, immediate points, group) tuples, best first
+    """
+    labels = label_groups(grid, topology)
+    counts = np.bincount(labels.ravel(), minlength=grid.size + 1)[:grid.size]
+    # Moves lead to positions with fewer tiles, so if the board is covered, so are they
+    exact = tablebase_score(grid, topology) is not None
+    ranked = []
+    for label in np.flatnonzero(counts > 1):
+        row_pos, col_pos = divmod(int(label), grid.shape[1])
+        immediate = group_points(int(counts[label]))
+        next_grid = grid.copy()
+        apply_move(next_grid, row_pos, col_pos, topology=topology)
+        if exact:
+            lookahead = immediate + tablebase_score(next_grid, topology)
+        else:
+            next_counts = np.bincount(label_groups(next_grid, topology).ravel(), minlength=grid.size + 1)[:grid.size]
+            best_next = int(next_counts.max())
+            lookahead = immediate + (group_points(best_next) if best_next > 1 else 0)
+        group, _ = find_group_and_perimeter(grid, row_pos, col_pos, topology=topology)
+        ranked.append((lookahead, immediate, group))
+    ranked.sort(key=lambda x: (x[0], x[1]), reverse=True)
+    return ranked
+
+
+class HintWorker(threading.Thread):
+    """
+    Background thread that ranks the groups of the latest board it was given, so that a hint is ready the moment the
+    player asks for one. Each board is tagged with a version; a result is only handed out for the version it was
+    computed from, so hints for a board that has since changed are discarded.
+    """
+
+    def __init__(self, topology=None):
+        """
+        HintWorker construct.
+        :param topology: Topology of the boards to rank. Default is a square board of each grid's shape.
+        """
+        super().__init__(daemon=True)
+        self._topology = topology
+        self._condition = threading.Condition()
+        self._pending = None
+        self._result = None
+        self._stopped = False
+
+    def submit(self, version, grid):
+        """
+        Ask for the groups of a board to be ranked. Replaces any board still waiting to be ranked.
+        :param version: board version the grid belongs to
+        :param grid: 2D numpy array of tile type values. A copy is taken.
+        :return:
+        """
+        with self._condition:
+            self._pending = (version, np.array(grid, dtype=np.uint8))
+            self._condition.notify()
+
+    def best_group(self, version):
+        """
+        Best group for a given board version.
+        :param version: current board version
+        :return: list of tile co-ordinates, or None if the hint for this version is not ready (or there are no moves)
+        """
+        result = self._result
+        if result is None or result[0] != version:
+            return None
+        return result[1]
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                version, grid = self._pending
+                self._pending = None
+            ranked = rank_groups(grid, self._topology)
+            self._result = (version, ranked[0][2] if ranked else None)
+
+
+if __name__ == "__main__":
+    from headless_board import HeadlessBoard
+    board = HeadlessBoard(6, 6, seed=0)
+    print(board)
+    for lookahead, immediate, group in rank_groups(board.grid)[:3]:
+        print(lookahead, immediate, sorted(group))
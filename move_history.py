@@ -0,0 +1,104 @@
+from array import array
+from collections import namedtuple
+
+# A single move as stored in the history: the removed group, the non-empty perimeter tiles that were incremented, the
+# tile type the removed group had and the points the move scored.
+MoveDiff = namedtuple('MoveDiff', ['removed', 'incremented', 'tile_type', 'score_delta'])
+
+# Entries per move in the move table: cell offset, # removed, # incremented, removed tile type, score delta
+_FIELDS = 5
+
+
+class MoveHistory(object):
+    """
+    Undo/redo history for a game. Moves are stored as diffs rather than board snapshots, packed into two flat arrays:
+    one of cell indices (two bytes per changed tile) and a table with one fixed-size row per move. Memory therefore
+    grows with the number of tiles changed, not with the size of the board.
+
+    Moves after the current position stay in the arrays so they can be redone, until a new move is recorded.
+    """
+
+    __slots__ = ('_columns', '_cells', '_moves', '_position')
+
+    def __init__(self, columns):
+        """
+        MoveHistory construct.
+        :param columns: # of columns in the board, used to pack co-ordinates into single cell indices
+        """
+        self._columns = columns
+        self._cells = array('H')
+        self._moves = array('i')
+        self._position = 0
+
+    @property
+    def can_undo(self):
+        return self._position > 0
+
+    @property
+    def can_redo(self):
+        return self._position * _FIELDS < len(self._moves)
+
+    @property
+    def nbytes(self):
+        """
+        Bytes used by the packed arrays.
+        :return: int
+        """
+        return self._cells.itemsize * len(self._cells) + self._moves.itemsize * len(self._moves)
+
+    def __len__(self):
+        return self._position
+
+    def record(self, removed, incremented, tile_type, score_delta):
+        """
+        Record a move that has just been played. Any undone moves can no longer be redone.
+        :param removed: co-ordinates of the removed tiles, each of the form (row_pos, col_pos)
+        :param incremented: co-ordinates of the non-empty perimeter tiles that were incremented
+        :param tile_type: value of the tile type of the removed group
+        :param score_delta: points scored by the move
+        :return:
+        """
+        del self._moves[self._position * _FIELDS:]
+        offset = self._moves[-_FIELDS] + self._moves[-_FIELDS + 1] + self._moves[-_FIELDS + 2] if self._moves else 0
+        del self._cells[offset:]
+        self._cells.extend(row * self._columns + col for row, col in removed)
+        self._cells.extend(row * self._columns + col for row, col in incremented)
+        self._moves.extend((offset, len(removed), len(incremented), tile_type, score_delta))
+        self._position += 1
+
+    def _diff(self, position):
+        offset, n_removed, n_incremented, tile_type, score_delta = \
+            self._moves[position * _FIELDS:(position + 1) * _FIELDS]
+        removed = [divmod(cell, self._columns) for cell in self._cells[offset:offset + n_removed]]
+        incremented = [divmod(cell, self._columns)
+                       for cell in self._cells[offset + n_removed:offset + n_removed + n_incremented]]
+        return MoveDiff(removed, incremented, tile_type, score_delta)
+
+    def undo(self):
+        """
+        Step back one move.
+        :return: MoveDiff of the move to revert, or None if there is nothing to undo
+        """
+        if not self.can_undo:
+            return None
+        self._position -= 1
+        return self._diff(self._position)
+
+    def redo(self):
+        """
+        Step forward one move.
+        :return: MoveDiff of the move to play again, or None if there is nothing to redo
+        """
+        if not self.can_redo:
+            return None
+        self._position += 1
+        return self._diff(self._position - 1)
+
+
+if __name__ == "__main__":
+    history = MoveHistory(20)
+    for i in range(5000):
+        history.record([(i % 20, 0), (i % 20, 1), (i % 20, 2)], [(i % 20, 3), ((i + 1) % 20, 0)], 1, 300)
+    print(f"{len(history)} moves in {history.nbytes} bytes")
+    print(history.undo())
+    print(history.redo())
@@ -0,0 +1,172 @@
+import arcade
+from collections import deque
+import functools
+import json
+import os
+import threading
+import time
+
+from constants import PROFILING
+
+# Environment variable that switches on the instrumentation mode without editing constants.py
+PROFILING_ENV_VAR = "TILE_MINER_PROFILE"
+
+# Where F4 writes the Chrome trace (open it with chrome://tracing or https://ui.perfetto.dev)
+TRACE_FILE = "tile_miner_trace.json"
+
+# Number of frames shown in the frame-time graph and maximum number of spans kept for the trace
+GRAPH_FRAMES = 240
+MAX_TRACE_EVENTS = 200000
+
+# Frame time budget drawn as a reference line on the graph (60 fps)
+FRAME_BUDGET = 1 / 60
+
+
+class Profiler(object):
+    """
+    Profiler class. Times registered methods of the game views, the board and the dashboard, keeps a short history
+    of frame times for the on-screen graph and records every timed span so it can be written out as a Chrome
+    trace-event file.
+
+    Methods are only wrapped with timing code while the profiler is enabled. When it is disabled the original
+    methods are left untouched, so the instrumentation costs nothing.
+    """
+
+    def __init__(self, enabled=False):
+        """
+        Profiler construct.
+        :param enabled: whether registered methods should be timed
+        """
+        self._enabled = False
+        self._registered = []
+        self._originals = {}
+        self.events = deque(maxlen=MAX_TRACE_EVENTS)
+        self.frame_times = deque(maxlen=GRAPH_FRAMES)
+        self.overlay_visible = False
+        self._last_frame = None
+        self._epoch = time.perf_counter()
+        if enabled:
+            self.enable()
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    def register(self, owner, *method_names, frame=None):
+        """
+        Register methods of a class to be timed. If the profiler is already enabled they are wrapped straight away.
+        :param owner: class that defines the methods
+        :param method_names: names of the methods to time
+        :param frame: name of the method marking the start of a new frame (normally on_draw). Default is None.
+        :return:
+        """
+        for name in method_names:
+            target = (owner, name, name == frame)
+            self._registered.append(target)
+            if self._enabled:
+                self._wrap(*target)
+
+    def enable(self):
+        """
+        Wrap every registered method with timing code. Views that are already being shown keep the handlers they were
+        shown with, so enable the profiler before showing the first view.
+        :return:
+        """
+        if self._enabled:
+            return
+        self._enabled = True
+        for target in self._registered:
+            self._wrap(*target)
+
+    def disable(self):
+        """
+        Restore every registered method to its original, untimed version.
+        :return:
+        """
+        for (owner, name), original in self._originals.items():
+            setattr(owner, name, original)
+        self._originals.clear()
+        self._enabled = False
+
+    def _wrap(self, owner, name, marks_frame):
+        if (owner, name) in self._originals:
+            return
+        original = owner.__dict__[name]
+        span_name = f"{owner.__name__}.{name}"
+        events = self.events
+        epoch = self._epoch
+        profiler = self
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            if marks_frame:
+                profiler._mark_frame(start)
+            try:
+                return original(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                events.append((span_name, start - epoch, end - start, threading.get_ident()))
+                if marks_frame and profiler.overlay_visible:
+                    profiler.draw_overlay()
+
+        self._originals[(owner, name)] = original
+        setattr(owner, name, timed)
+
+    def _mark_frame(self, now):
+        if self._last_frame is not None:
+            self.frame_times.append(now - self._last_frame)
+        self._last_frame = now
+
+    def attach(self, window):
+        """
+        Listen for the profiler's keys on a window: F3 toggles the frame-time graph and F4 writes the Chrome trace.
+        Does nothing while the profiler is disabled.
+        :param window: arcade.Window
+        :return:
+        """
+        if self._enabled:
+            window.push_handlers(on_key_press=self.on_key_press)
+
+    def on_key_press(self, symbol, modifiers):
+        if symbol == arcade.key.F3:
+            self.overlay_visible = not self.overlay_visible
+        elif symbol == arcade.key.F4:
+            print(f"Chrome trace written to: {self.dump_chrome_trace()}")
+
+    def draw_overlay(self, left=10, bottom=10, width=GRAPH_FRAMES, height=80):
+        """
+        Draw the frame-time graph in the bottom-left corner of the window. The graph's full height is two frame
+        budgets and the red line marks one budget.
+        :return:
+        """
+        arcade.draw_xywh_rectangle_filled(left, bottom, width, height, (0, 0, 0, 160))
+        budget_y = bottom + height / 2
+        arcade.draw_line(left, budget_y, left + width, budget_y, arcade.color.RED, 1)
+        if len(self.frame_times) > 1:
+            step = width / (GRAPH_FRAMES - 1)
+            points = [(left + i * step, bottom + min(height, height * frame_time / (2 * FRAME_BUDGET)))
+                      for i, frame_time in enumerate(self.frame_times)]
+            arcade.draw_line_strip(points, arcade.color.GREEN, 1)
+            average = 1000 * sum(self.frame_times) / len(self.frame_times)
+            worst = 1000 * max(self.frame_times)
+            arcade.draw_text(f"frame {average:.1f} ms avg, {worst:.1f} ms max", left + 4, bottom + height - 14,
+                             arcade.color.WHITE, 10)
+
+    def dump_chrome_trace(self, path=TRACE_FILE):
+        """
+        Write every recorded span as a Chrome trace-event JSON file.
+        :param path: file to write
+        :return: path of the written file
+        """
+        pid = os.getpid()
+        trace_events = [{'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'ts': start * 1e6, 'dur': duration * 1e6,
+                         'pid': pid, 'tid': tid}
+                        for name, start, duration, tid in list(self.events)]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+        return os.path.abspath(path)
+
+
+# Shared profiler used by every module of the game
+profiler = Profiler(enabled=PROFILING or os.environ.get(PROFILING_ENV_VAR) == "1")
@@ -3,12 +3,14 @@ from arcade.gui import UIManager
 import menu_view
 from data_handler import DataHandler
 from constants import *
-import os
+from profiler import profiler
+from asset_atlas import load_atlas
+from game_history import load_game_history
+from score_index import load_score_index
 
-dirname = os.path.dirname(__file__)
-button_normal = arcade.load_texture(os.path.join(dirname, 'images/red_button_normal.png'))
-hovered_texture = arcade.load_texture(os.path.join(dirname, 'images/red_button_hover.png'))
-pressed_texture = arcade.load_texture(os.path.join(dirname, 'images/red_button_press.png'))
+button_normal = load_atlas().texture('red_button_normal')
+hovered_texture = load_atlas().texture('red_button_hover')
+pressed_texture = load_atlas().texture('red_button_press')
 
 
 class RestartButton(arcade.gui.UIImageButton):
@@ -39,10 +41,12 @@ class ReturnView(arcade.View):
     score. Otherwise, can either restart by going back to the menu or quitting.
     """
 
-    def __init__(self, player_data: dict):
+    def __init__(self, player_data: dict, game=None):
         """
         ReturnView construct.
         :param player_data: dictionary containing data from the previous game session.
+        :param game: dictionary of the rest of the game's details (moves, end_reason, mode, topology), as taken by
+        GameHistory.append. If given, the game is added to the game history. Default is None.
         """
 
         super().__init__()
@@ -51,6 +55,25 @@ class ReturnView(arcade.View):
         self.player_data = player_data
         self.txt_timer = 1.0
         self.submitted = False
+        # Checked once: the leaderboard only changes when this score is submitted
+        self._new_high_score = DataHandler.new_high_score(self._player_data['score'])
+
+        # Rank among every game played before, overall and with the same board size and time limit
+        score_index = load_score_index()
+        score = int(player_data['score'])
+        rows, columns = int(player_data['row']), int(player_data['column'])
+        total_time = int(player_data['time_minutes']) * 60 + int(player_data['time_seconds'])
+        self.overall_standing = score_index.standing(score)
+        self.board_standing = score_index.standing(score, rows, columns, total_time)
+        # Row of this game in the game history, named when the score is submitted
+        self.history_row = None
+        if game is not None:
+            score_index.record(score, rows, columns, total_time)
+            self.history_row = load_game_history().append(player_data, **game)
+        self._standing_text = (
+            self._standing_line(self.overall_standing, "overall"),
+            self._standing_line(self.board_standing, f"on {rows}x{columns} in {player_data['time_minutes']}:"
+                                                     f"{player_data['time_seconds']}"))
 
         # GUI elements which will get constructed in setup()
         self.ui_name_input_box = None
@@ -59,9 +82,15 @@ class ReturnView(arcade.View):
         self.restart_button = None
         self.quit_button = None
 
+    @staticmethod
+    def _standing_line(standing, where):
+        if standing.games == 0:
+            return f"First game {where}"
+        return f"Rank {standing.rank} of {standing.games + 1} {where}, better than {standing.percentile:.0f}% of games"
+
     @property
     def new_high_score(self):
-        return DataHandler.new_high_score(self._player_data['score'])
+        return self._new_high_score
 
     @property
     def player_data(self):
@@ -82,6 +111,9 @@ class ReturnView(arcade.View):
         arcade.start_render()
         arcade.draw_text("GAME OVER", WIDTH / 2, HEIGHT * 3 / 4,
                          arcade.color.BLACK, font_size=75, anchor_x="center")
+        for i, line in enumerate(self._standing_text):
+            arcade.draw_text(line, WIDTH / 2, HEIGHT * 3 / 4 - 80 - 25 * i,
+                             arcade.color.BLACK, font_size=16, anchor_x="center")
         if self.new_high_score or self.submitted:
             arcade.draw_text(f"NEW HIGH SCORE: {self.player_data['score']}", WIDTH / 2, HEIGHT * 3/4 - 50,
                              arcade.color.BLACK, font_size=30, anchor_x="center")
@@ -153,6 +185,8 @@ class ReturnView(arcade.View):
         if self.submit_button is not None and self.submit_button.submit and not self.submitted:
             self._player_data['name'] = self.ui_name_input_box.text
             DataHandler.add_new_player_data(**self._player_data)
+            if self.history_row is not None:
+                load_game_history().set_name(self.history_row, self._player_data['name'])
             self.submitted_text = "Submitted!"
             self.submit_button.color = arcade.color.GRAY
             self.submit_button.hover_texture = self.submit_button.normal_texture
@@ -165,8 +199,12 @@ class ReturnView(arcade.View):
                 self.txt_timer = 1.0
 
 
+profiler.register(ReturnView, 'on_draw', 'update', frame='on_draw')
+
+
 def main():
     window = arcade.Window(WIDTH, HEIGHT, "Tile Miner")
+    profiler.attach(window)
     return_view = ReturnView({'name': "",
                               'date_year': '2008', 'date_month': '05', 'date_day': '22',
                               'row': '4', 'column': '3',
@@ -0,0 +1,158 @@
+from collections import namedtuple
+from functools import lru_cache
+import math
+
+import numpy as np
+
+from constants import BASE_TILE_SCORE, BONUS_POINTS
+from game_history import HISTORY_DIR, load_game_history
+
+# Every score is a sum of tile and bonus points, so it is a multiple of this: buckets of this width hold one score each
+SCORE_BUCKET_WIDTH = math.gcd(BASE_TILE_SCORE, BONUS_POINTS)
+
+# Where a score stands among the games played: rank it would get (ties rank below the games already played, as on the
+# leaderboard), # of games it is ranked against and percentage of those games with a lower score
+Standing = namedtuple('Standing', ['rank', 'games', 'percentile'])
+
+
+class FenwickTree(object):
+    """
+    FenwickTree class. Counts per bucket with O(log n) updates and prefix sums. Grows as buckets are added.
+    """
+
+    __slots__ = ('_counts', '_tree')
+
+    def __init__(self, counts=()):
+        """
+        FenwickTree construct. Built in O(n) from the initial counts.
+        :param counts: initial count of each bucket
+        """
+        self._counts = [int(count) for count in counts]
+        self._build()
+
+    def _build(self):
+        tree = [0] + self._counts
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def __len__(self):
+        return len(self._counts)
+
+    def add(self, bucket, amount=1):
+        """
+        Add to the count of a bucket.
+        :param bucket: bucket index
+        :param amount: amount to add
+        :return:
+        """
+        if bucket >= len(self._counts):
+            # Doubling keeps the cost of rebuilding constant per added bucket on average
+            self._counts.extend([0] * (max(bucket + 1, 2 * len(self._counts)) - len(self._counts)))
+            self._build()
+        self._counts[bucket] += amount
+        tree = self._tree
+        i = bucket + 1
+        while i < len(tree):
+            tree[i] += amount
+            i += i & -i
+
+    def prefix_sum(self, bucket):
+        """
+        Sum of the counts of the buckets before a bucket.
+        :param bucket: bucket index (any bucket past the last one gives the total)
+        :return: int
+        """
+        tree = self._tree
+        i = min(bucket, len(tree) - 1)
+        total = 0
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    @property
+    def total(self):
+        return self.prefix_sum(len(self._counts))
+
+
+class ScoreIndex(object):
+    """
+    ScoreIndex class. Score counts of every recorded game, overall and per board size and time limit, held in Fenwick
+    trees over score buckets so that the rank and percentile of any score are found in O(log n).
+    """
+
+    def __init__(self, history=None):
+        """
+        ScoreIndex construct.
+        :param history: games to start from: a GameHistory, or anything else with 'score', 'rows', 'columns' and
+        'total_time' arrays. Default is None (no games).
+        """
+        self._overall = FenwickTree()
+        # (rows, columns, total_time) -> FenwickTree
+        self._by_game = {}
+        if history is not None and len(history):
+            buckets = history['score'].astype(np.int64) // SCORE_BUCKET_WIDTH
+            overall = np.bincount(buckets)
+            self._overall = FenwickTree(overall)
+            # Board size and time limit packed into one integer, which sorts much faster than the separate columns
+            settings = (history['rows'].astype(np.int64) << 48 | history['columns'].astype(np.int64) << 32
+                        | history['total_time'])
+            unique_settings, group = np.unique(settings, return_inverse=True)
+            # Each settings' counts only run up to its own highest score, so the counts take no more room than the
+            # Fenwick trees built from them, however many settings there are and however high the top score is
+            lengths = np.zeros(len(unique_settings), dtype=np.int64)
+            np.maximum.at(lengths, group, buckets + 1)
+            offsets = np.concatenate([[0], np.cumsum(lengths)])
+            # Counts of every (settings, bucket) pair in a single pass
+            counts = np.bincount(offsets[group] + buckets, minlength=offsets[-1])
+            for packed, start, end in zip(unique_settings.tolist(), offsets[:-1].tolist(), offsets[1:].tolist()):
+                key = (packed >> 48, packed >> 32 & 0xffff, packed & 0xffffffff)
+                self._by_game[key] = FenwickTree(counts[start:end])
+
+    def record(self, score, rows, columns, total_time):
+        """
+        Add a finished game to the index. The game history is not changed.
+        :param score: final score
+        :param rows: # of rows of the board
+        :param columns: # of columns of the board
+        :param total_time: time limit of the game in whole seconds
+        :return:
+        """
+        bucket = int(score) // SCORE_BUCKET_WIDTH
+        self._overall.add(bucket)
+        key = (int(rows), int(columns), int(total_time))
+        if key not in self._by_game:
+            self._by_game[key] = FenwickTree()
+        self._by_game[key].add(bucket)
+
+    def standing(self, score, rows=None, columns=None, total_time=None):
+        """
+        Rank and percentile a score would get among the recorded games.
+        :param score: score to rank
+        :param rows: # of rows of the board. If rows, columns and total_time are given, only games with the same
+        board size and time limit count.
+        :param columns: # of columns of the board
+        :param total_time: time limit in seconds
+        :return: Standing
+        """
+        if rows is None:
+            tree = self._overall
+        else:
+            tree = self._by_game.get((int(rows), int(columns), int(total_time)), FenwickTree())
+        games = tree.total
+        # Games with a score below this one fill the buckets before its own
+        lower = tree.prefix_sum(-(-int(score) // SCORE_BUCKET_WIDTH))
+        return Standing(games - lower + 1, games, 100 * lower / games if games else 100.0)
+
+
+@lru_cache(maxsize=None)
+def load_score_index(path=HISTORY_DIR):
+    """
+    Index of the game history, built once and then kept up to date by record().
+    :param path: game history directory
+    :return: ScoreIndex
+    """
+    return ScoreIndex(load_game_history(path))
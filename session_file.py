@@ -0,0 +1,138 @@
+from collections import namedtuple
+import datetime
+import os
+import struct
+import time
+import numpy as np
+
+from constants import CLASSIC_MODE, GAME_MODES, SQUARE_TOPOLOGY, TOPOLOGIES
+
+# Saved sessions live in saves/ next to the game
+dirname = os.path.dirname(__file__)
+SAVE_DIR = os.path.join(dirname, "saves")
+SAVE_EXTENSION = ".tms"
+
+# Fixed 64-byte little-endian header followed by the raw uint8 tile type grid (row-major, rows * columns bytes):
+# magic, format version, rows, columns, flags, seed, total time, time left, score, time saved, game mode (index into
+# GAME_MODES), topology (index into TOPOLOGIES), padding. Files saved before modes and topologies existed have zeros,
+# i.e. classic and square, in their place.
+HEADER = struct.Struct('<4sHHHHqddIdBB14x')
+MAGIC = b'TMSV'
+FORMAT_VERSION = 1
+
+# Set in the header flags when the session has a seed
+FLAG_HAS_SEED = 1
+
+SessionHeader = namedtuple('SessionHeader', ['rows', 'columns', 'seed', 'total_time', 'timer', 'score', 'saved_at',
+                                             'mode', 'topology'])
+
+
+class SessionFileError(Exception):
+    pass
+
+
+def save_session(path, grid, timer, total_time, score, seed=None, mode=CLASSIC_MODE, topology=SQUARE_TOPOLOGY):
+    """
+    Write a game session to a file. The file is replaced atomically, so an interrupted save never leaves a corrupt
+    file behind.
+    :param path: file to write
+    :param grid: 2D array of tile type values
+    :param timer: time left in seconds
+    :param total_time: time the session started with in seconds
+    :param score: current score
+    :param seed: seed the board was generated with. Default is None.
+    :param mode: game mode, one of GAME_MODES. Default is classic.
+    :param topology: board topology, one of TOPOLOGIES. Default is square.
+    :return:
+    """
+    grid = np.ascontiguousarray(grid, dtype=np.uint8)
+    rows, columns = grid.shape
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, rows, columns, FLAG_HAS_SEED if seed is not None else 0,
+                         seed if seed is not None else 0, float(total_time), float(timer), score, time.time(),
+                         GAME_MODES.index(mode), TOPOLOGIES.index(topology))
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(header)
+        f.write(grid.tobytes())
+    os.replace(temp_path, path)
+
+
+def _unpack_header(data, path):
+    if len(data) < HEADER.size:
+        raise SessionFileError(f"File too short to be a saved session: {path}")
+    magic, version, rows, columns, flags, seed, total_time, timer, score, saved_at, mode, topology = \
+        HEADER.unpack(data)
+    if magic != MAGIC:
+        raise SessionFileError(f"Not a saved session: {path}")
+    if version != FORMAT_VERSION:
+        raise SessionFileError(f"Unsupported saved session version {version}: {path}")
+    if mode >= len(GAME_MODES):
+        raise SessionFileError(f"Unknown game mode {mode}: {path}")
+    if topology >= len(TOPOLOGIES):
+        raise SessionFileError(f"Unknown topology {topology}: {path}")
+    return SessionHeader(rows, columns, seed if flags & FLAG_HAS_SEED else None, total_time, timer, score, saved_at,
+                         GAME_MODES[mode], TOPOLOGIES[topology])
+
+
+def read_header(path):
+    """
+    Read only the header of a saved session.
+    :param path: saved session file
+    :return: SessionHeader
+    """
+    with open(path, 'rb') as f:
+        return _unpack_header(f.read(HEADER.size), path)
+
+
+def load_grid(path, header=None):
+    """
+    Memory-map the tile type grid of a saved session. Nothing is parsed: the grid is read straight from the file.
+    :param path: saved session file
+    :param header: SessionHeader of the file, if it has already been read
+    :return: read-only 2D numpy memmap of tile type values
+    """
+    if header is None:
+        header = read_header(path)
+    size = os.path.getsize(path)
+    if size != HEADER.size + header.rows * header.columns:
+        raise SessionFileError(f"Saved session is {size} bytes, expected {HEADER.size + header.rows * header.columns} "
+                               f"for a {header.rows}x{header.columns} board: {path}")
+    return np.memmap(path, dtype=np.uint8, mode='r', offset=HEADER.size, shape=(header.rows, header.columns))
+
+
+def list_sessions(directory=SAVE_DIR):
+    """
+    List the saved sessions in a directory, newest first, by reading their headers only. Files that are not valid
+    saved sessions are skipped.
+    :param directory: directory to look in
+    :return: list of (path, SessionHeader)
+    """
+    sessions = []
+    if not os.path.isdir(directory):
+        return sessions
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not (entry.name.endswith(SAVE_EXTENSION) and entry.is_file()):
+                continue
+            try:
+                sessions.append((entry.path, read_header(entry.path)))
+            except (OSError, SessionFileError):
+                continue
+    sessions.sort(key=lambda s: s[1].saved_at, reverse=True)
+    return sessions
+
+
+def new_save_path(directory=SAVE_DIR):
+    """
+    Path for a new saved session, named after the current date and time.
+    :param directory: directory to save in (created if missing)
+    :return: string
+    """
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    return os.path.join(directory, f"session-{stamp}{SAVE_EXTENSION}")
+
+
+if __name__ == "__main__":
+    for session_path, session_header in list_sessions():
+        print(session_path, session_header)
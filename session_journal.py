@@ -0,0 +1,240 @@
+import argparse
+from collections import namedtuple
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+import numpy as np
+
+from constants import CLASSIC_MODE, GAME_MODES, SQUARE_TOPOLOGY, TOPOLOGIES
+from metrics import metrics
+from session_file import SAVE_DIR
+
+# The game in progress is journalled here. The file is removed when the game ends, so if it exists at start-up the
+# game before was cut short and can be recovered.
+JOURNAL_FILE = os.path.join(SAVE_DIR, "live_session.tmj")
+
+# Fixed 48-byte little-endian header with the arguments the journalled game was started with: magic, format version,
+# rows, columns, flags, seed, total time, time left, score, game mode (index into GAME_MODES), topology (index into
+# TOPOLOGIES), padding. If FLAG_BOARD_SETUP is set, the raw uint8 tile type grid the game started from follows
+# (row-major, rows * columns bytes); otherwise the board is generated from the seed.
+HEADER = struct.Struct('<4sHHHHqddiBB6x')
+MAGIC = b'TMJL'
+FORMAT_VERSION = 1
+FLAG_BOARD_SETUP = 1
+
+# Then one 22-byte record per action: kind, padding, row, column, score and time left after the action, and a CRC-32
+# of the rest of the record, which tells a record cut short by a crash from a complete one
+RECORD = struct.Struct('<BxHHidI')
+MOVE = 1
+UNDO = 2
+REDO = 3
+KINDS = (MOVE, UNDO, REDO)
+
+# Records are written straight away, which is enough to survive the game process dying. Surviving the machine going
+# down takes an fsync: a background thread commits every record written within this many seconds with a single one.
+COMMIT_INTERVAL = 0.05
+
+# Time a move may spend on the journal before the click is handed back to the game, in seconds
+MOVE_BUDGET = 0.0002
+
+JournalHeader = namedtuple('JournalHeader', ['rows', 'columns', 'seed', 'total_time', 'timer', 'score', 'mode',
+                                             'topology'])
+JournalRecord = namedtuple('JournalRecord', ['kind', 'row', 'column', 'score', 'timer'])
+
+
+class JournalError(Exception):
+    pass
+
+
+def create_journal(path, header, grid=None, commit_interval=COMMIT_INTERVAL):
+    """
+    Start a new journal, replacing any journal at the same path. The header is on disk once this returns.
+    :param path: journal file
+    :param header: JournalHeader with the arguments the game is started with
+    :param grid: 2D array of tile type values the game starts from, if it is not generated from the seed. Default is
+    None.
+    :param commit_interval: most seconds a record waits for its fsync
+    :return: SessionJournal, started
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    data = HEADER.pack(MAGIC, FORMAT_VERSION, header.rows, header.columns,
+                       FLAG_BOARD_SETUP if grid is not None else 0, header.seed, float(header.total_time),
+                       float(header.timer), header.score, GAME_MODES.index(header.mode),
+                       TOPOLOGIES.index(header.topology))
+    if grid is not None:
+        data += np.ascontiguousarray(grid, dtype=np.uint8).tobytes()
+    # Written under a temporary name and moved into place, so that the journal of the previous game is only replaced
+    # by a complete header
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    journal = SessionJournal(path, len(data), commit_interval)
+    journal.start()
+    return journal
+
+
+def read_journal(path):
+    """
+    Read a journal. Reading stops at the first record that is incomplete or fails its checksum, e.g. the one being
+    written when the game died.
+    :param path: journal file
+    :return: (JournalHeader, 2D numpy array of the starting tile types or None, list of JournalRecord, # of bytes up to
+    the end of the last good record)
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise JournalError(f"File too short to be a session journal: {path}")
+    magic, version, rows, columns, flags, seed, total_time, timer, score, mode, topology = \
+        HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise JournalError(f"Not a session journal: {path}")
+    if version != FORMAT_VERSION:
+        raise JournalError(f"Unsupported session journal version {version}: {path}")
+    if mode >= len(GAME_MODES) or topology >= len(TOPOLOGIES):
+        raise JournalError(f"Unknown game mode or topology: {path}")
+    header = JournalHeader(rows, columns, seed, total_time, timer, score, GAME_MODES[mode], TOPOLOGIES[topology])
+
+    offset = HEADER.size
+    grid = None
+    if flags & FLAG_BOARD_SETUP:
+        if len(data) < offset + rows * columns:
+            raise JournalError(f"Session journal cut short in its board: {path}")
+        grid = np.frombuffer(data, dtype=np.uint8, count=rows * columns, offset=offset).reshape(rows, columns)
+        offset += rows * columns
+
+    records = []
+    while offset + RECORD.size <= len(data):
+        kind, row, column, record_score, record_timer, checksum = RECORD.unpack_from(data, offset)
+        if checksum != zlib.crc32(data[offset:offset + RECORD.size - 4]) or kind not in KINDS:
+            break
+        records.append(JournalRecord(kind, row, column, record_score, record_timer))
+        offset += RECORD.size
+    return header, grid, records, offset
+
+
+class SessionJournal(threading.Thread):
+    """
+    Append-only journal of the actions of the game in progress. append() writes each record to the file straight
+    away, so it is on disk as far as the game process is concerned; a background thread group-commits them with one
+    fsync per COMMIT_INTERVAL, so a click never waits for the disk.
+    """
+
+    def __init__(self, path, length=None, commit_interval=COMMIT_INTERVAL):
+        """
+        SessionJournal construct. Use create_journal() to start a new journal.
+        :param path: existing journal file
+        :param length: # of bytes of the file to keep; anything after it, e.g. a record cut short by a crash, is cut
+        off. Default is None (the whole file).
+        :param commit_interval: most seconds a record waits for its fsync
+        """
+        super().__init__(daemon=True)
+        self.path = path
+        self._commit_interval = commit_interval
+        self._fd = os.open(path, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+        if length is not None:
+            os.ftruncate(self._fd, length)
+        os.lseek(self._fd, 0, os.SEEK_END)
+        self._condition = threading.Condition()
+        self._unsynced = 0
+        self._stopped = False
+
+    def append(self, kind, row, column, score, timer):
+        """
+        Record an action, after it has been applied.
+        :param kind: MOVE, UNDO or REDO
+        :param row: row of the clicked tile (0 for undo and redo)
+        :param column: column of the clicked tile (0 for undo and redo)
+        :param score: score after the action
+        :param timer: time left after the action
+        :return:
+        """
+        body = RECORD.pack(kind, row, column, score, timer, 0)[:-4]
+        os.write(self._fd, body + struct.pack('<I', zlib.crc32(body)))
+        metrics.add('journal_records')
+        with self._condition:
+            self._unsynced += 1
+            self._condition.notify()
+
+    def close(self, remove=False):
+        """
+        Commit every record and close the journal.
+        :param remove: also delete the file, e.g. because the game has ended and there is nothing left to recover
+        :return:
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self.is_alive():
+            self.join()
+        os.fsync(self._fd)
+        os.close(self._fd)
+        if remove:
+            os.remove(self.path)
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._unsynced == 0 and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+            # Let the records of the next few clicks arrive, so that they share the fsync
+            time.sleep(self._commit_interval)
+            with self._condition:
+                self._unsynced = 0
+            os.fsync(self._fd)
+            metrics.add('journal_commits')
+
+
+def measure_overhead(moves=10000, commit_interval=COMMIT_INTERVAL, directory=None):
+    """
+    Time append() for a run of moves into a throwaway journal.
+    :param moves: # of moves to append
+    :param commit_interval: most seconds a record waits for its fsync
+    :param directory: directory for the throwaway journal. Default is None (the system's temporary directory).
+    :return: (sorted list of seconds per append, # of fsyncs)
+    """
+    with tempfile.TemporaryDirectory(dir=directory) as temp_dir:
+        journal = create_journal(os.path.join(temp_dir, "bench.tmj"),
+                                 JournalHeader(6, 6, 0, 60, 60, 0, CLASSIC_MODE, SQUARE_TOPOLOGY),
+                                 commit_interval=commit_interval)
+        commits = metrics.snapshot()['journal_commits']
+        durations = []
+        for i in range(moves):
+            start = time.perf_counter()
+            journal.append(MOVE, i % 6, i // 6 % 6, 100 * i, 60 - i / moves)
+            durations.append(time.perf_counter() - start)
+            # Clicks are never this fast; leave the commit thread some time as a player would
+            if i % 100 == 99:
+                time.sleep(0.001)
+        journal.close()
+        commits = metrics.snapshot()['journal_commits'] - commits
+    return sorted(durations), commits
+
+
+def main():
+    from load_test import percentile
+
+    parser = argparse.ArgumentParser(description="Measure the cost per move of the session journal.")
+    parser.add_argument('--moves', type=int, default=10000)
+    parser.add_argument('--commit-interval', type=float, default=COMMIT_INTERVAL)
+    parser.add_argument('--dir', default=None, help="directory to put the throwaway journal in, e.g. on the disk "
+                                                    "the game saves to")
+    args = parser.parse_args()
+    durations, commits = measure_overhead(args.moves, args.commit_interval, args.dir)
+    p50, p99 = percentile(durations, 0.50), percentile(durations, 0.99)
+    print(f"{args.moves} moves, {commits} fsyncs: p50 {1e6 * p50:.1f} us, p99 {1e6 * p99:.1f} us, "
+          f"max {1e6 * durations[-1]:.1f} us per move")
+    verdict = "within" if p99 <= MOVE_BUDGET else "OVER"
+    print(f"p99 is {verdict} the budget of {1e6 * MOVE_BUDGET:.0f} us per move")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+import argparse
+from collections import namedtuple
+from contextlib import nullcontext
+import hashlib
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import time
+import numpy as np
+
+from constants import SQUARE_TOPOLOGY, TOPOLOGIES
+from headless_board import HeadlessBoard, apply_move, group_points, label_groups
+from tablebase import tablebase_score
+from topology import get_topology
+
+# One transposition table slot: position key (zero while the slot is empty), best score still to come, first move of
+# the best line (flat tile index, -1 if there are no moves) and the number of moves the score was searched to
+TABLE_ENTRY = np.dtype([('key', np.uint64), ('score', np.int32), ('move', np.int16), ('depth', np.int16)])
+
+# The transposition table has 2 ** DEFAULT_TABLE_BITS slots (16 bytes each)
+DEFAULT_TABLE_BITS = 20
+
+# Slots are guarded by this many locks in parallel searches, slot i by lock i % LOCK_STRIPES
+LOCK_STRIPES = 64
+
+# Search depth standing for "until the game is over"
+UNLIMITED_DEPTH = 32767
+
+SolveResult = namedtuple('SolveResult', ['score', 'line', 'nodes', 'seconds'])
+
+
+def position_key(grid):
+    """
+    64-bit key of a type grid. Unlike hash(), which is salted per process, the key is the same in every worker.
+    :param grid: 2D numpy array of tile type values
+    :return: non-zero int
+    """
+    return int.from_bytes(hashlib.blake2b(grid.tobytes(), digest_size=8).digest(), 'little') or 1
+
+
+def legal_moves(grid, topology):
+    """
+    One move per removable group, largest group first, so that good lines are found early.
+    :param grid: 2D numpy array of tile type values
+    :param topology: Topology of the board
+    :return: list of (flat index of the first tile of the group, group size)
+    """
+    counts = np.bincount(label_groups(grid, topology).ravel(), minlength=grid.size + 1)[:grid.size]
+    groups = np.flatnonzero(counts > 1)
+    groups = groups[np.argsort(-counts[groups], kind='stable')]
+    return list(zip(groups.tolist(), counts[groups].tolist()))
+
+
+class TranspositionTable(object):
+    """
+    Fixed-size hash table of searched positions, kept in a numpy array so that it can live in shared memory and be
+    used by several processes at once. Each slot holds a single position; a slot is only given up to a position
+    searched at least as deep. Concurrent access is guarded by a striped set of locks, so workers seldom wait for each
+    other.
+    """
+
+    __slots__ = ('_entries', '_mask', '_locks')
+
+    def __init__(self, entries, locks=None):
+        """
+        TranspositionTable construct.
+        :param entries: numpy array of TABLE_ENTRY whose length is a power of two
+        :param locks: list of locks, one per stripe, or None if the table is only used by one process
+        """
+        self._entries = entries
+        self._mask = len(entries) - 1
+        self._locks = locks
+
+    def _lock(self, slot):
+        return self._locks[slot % len(self._locks)] if self._locks else nullcontext()
+
+    def lookup(self, key, depth):
+        """
+        Result stored for a position, if it was searched at least depth moves deep.
+        :param key: position key
+        :param depth: depth needed
+        :return: (score, move), or None
+        """
+        slot = key & self._mask
+        with self._lock(slot):
+            stored_key, score, move, stored_depth = self._entries[slot].item()
+        if stored_key != key or stored_depth < depth:
+            return None
+        return score, move
+
+    def store(self, key, depth, score, move):
+        """
+        Store the result of a search, unless its slot holds another position searched deeper.
+        :param key: position key
+        :param depth: depth searched
+        :param score: best score still to come
+        :param move: first move of the best line
+        :return:
+        """
+        slot = key & self._mask
+        with self._lock(slot):
+            entry = self._entries[slot]
+            if entry['key'] != key and entry['depth'] > depth:
+                return
+            self._entries[slot] = (key, score, move, depth)
+
+
+def _search(grid, depth, topology, table, nodes):
+    """
+    Depth-first search for the best score that can still be made from a position, memoised in the transposition table.
+    Positions covered by a tablebase are looked up instead.
+    :param grid: 2D numpy array of tile type values
+    :param depth: most moves to look ahead
+    :param topology: Topology of the board
+    :param table: TranspositionTable
+    :param nodes: one-element list counting the positions visited
+    :return: int
+    """
+    nodes[0] += 1
+    if depth == 0:
+        return 0
+    # Every move removes at least two tiles, so at this depth the game is played out and the exact score applies
+    if depth >= np.count_nonzero(grid) // 2:
+        exact = tablebase_score(grid, topology)
+        if exact is not None:
+            return exact
+    key = position_key(grid)
+    stored = table.lookup(key, depth)
+    if stored is not None:
+        return stored[0]
+    best_score, best_move = 0, -1
+    for cell, size in legal_moves(grid, topology):
+        child = grid.copy()
+        row_pos, col_pos = divmod(cell, grid.shape[1])
+        apply_move(child, row_pos, col_pos, topology=topology)
+        score = group_points(size) + _search(child, depth - 1, topology, table, nodes)
+        if score > best_score:
+            best_score, best_move = score, cell
+    table.store(key, depth, best_score, best_move)
+    return best_score
+
+
+def _principal_line(grid, depth, topology, table, nodes):
+    """
+    Follow the best moves stored in the transposition table from a position. Wherever an entry has since been
+    replaced, the best move is worked out again from the scores of the moves that follow it.
+    :return: list of moves (row_pos, col_pos)
+    """
+    grid = grid.copy()
+    line = []
+    while depth > 0:
+        stored = table.lookup(position_key(grid), depth)
+        if stored is not None:
+            move = stored[1]
+        else:
+            move, best_score = -1, 0
+            for cell, size in legal_moves(grid, topology):
+                child = grid.copy()
+                apply_move(child, *divmod(cell, grid.shape[1]), topology=topology)
+                score = group_points(size) + _search(child, depth - 1, topology, table, nodes)
+                if score > best_score:
+                    move, best_score = cell, score
+        if move < 0:
+            break
+        row_pos, col_pos = divmod(move, grid.shape[1])
+        apply_move(grid, row_pos, col_pos, topology=topology)
+        line.append((row_pos, col_pos))
+        depth -= 1
+    return line
+
+
+def beam_search(grid, width, depth, topology, nodes=None):
+    """
+    Beam search: keep only the width best-scoring distinct positions at each depth. The positions of a level are
+    labelled together as one batch.
+    :param grid: 2D numpy array of tile type values
+    :param width: positions kept per level
+    :param depth: most moves to look ahead
+    :param topology: Topology of the board
+    :param nodes: one-element list counting the positions visited. Default is None.
+    :return: best score found and its line of moves (row_pos, col_pos)
+    """
+    columns = grid.shape[1]
+    beam = [(0, [], grid)]
+    best = (0, [])
+    for _ in range(depth):
+        labels = label_groups(np.stack([state for _, _, state in beam]), topology).reshape(len(beam), -1)
+        candidates = []
+        for (score, line, state), state_labels in zip(beam, labels):
+            counts = np.bincount(state_labels, minlength=grid.size + 1)[:grid.size]
+            for cell in np.flatnonzero(counts > 1).tolist():
+                candidates.append((score + group_points(int(counts[cell])), line, state, cell))
+        if not candidates:
+            break
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        beam = []
+        seen = set()
+        for score, line, state, cell in candidates:
+            child = state.copy()
+            row_pos, col_pos = divmod(cell, columns)
+            apply_move(child, row_pos, col_pos, topology=topology)
+            key = position_key(child)
+            if key in seen:
+                continue
+            seen.add(key)
+            beam.append((score, line + [(row_pos, col_pos)], child))
+            if len(beam) == width:
+                break
+        if nodes is not None:
+            nodes[0] += len(beam)
+        if beam[0][0] > best[0]:
+            best = (beam[0][0], beam[0][1])
+    return best
+
+
+def _search_root_move(grid, cell, size, depth, beam_width, topology, table, nodes):
+    """
+    Search the line starting with one top-level move.
+    :return: score of the line, and the line itself for beam searches (None for exhaustive searches, whose lines are
+    read back from the transposition table)
+    """
+    child = grid.copy()
+    row_pos, col_pos = divmod(cell, grid.shape[1])
+    apply_move(child, row_pos, col_pos, topology=topology)
+    if beam_width:
+        score, line = beam_search(child, beam_width, depth - 1, topology, nodes)
+        return group_points(size) + score, [(row_pos, col_pos)] + line
+    return group_points(size) + _search(child, depth - 1, topology, table, nodes), None
+
+
+# State of a worker process, set up once by _init_worker
+_worker = {}
+
+
+def _init_worker(board_name, shape, table_name, table_size, locks, next_task, topology_kind, depth, beam_width):
+    board_memory = shared_memory.SharedMemory(name=board_name)
+    table_memory = shared_memory.SharedMemory(name=table_name)
+    _worker.update(
+        grid=np.array(np.ndarray(shape, dtype=np.uint8, buffer=board_memory.buf)),
+        table=TranspositionTable(np.ndarray(table_size, dtype=TABLE_ENTRY, buffer=table_memory.buf), locks),
+        memory=(board_memory, table_memory),
+        next_task=next_task,
+        topology=get_topology(shape[0], shape[1], topology_kind),
+        depth=depth,
+        beam_width=beam_width,
+    )
+
+
+def _run_worker(_):
+    """
+    Take top-level moves off the shared task counter until there are none left, so that workers which finish early
+    carry on with the moves the others have not started.
+    :return: list of (score, task index, line) and the # of positions visited
+    """
+    grid, topology, next_task = _worker['grid'], _worker['topology'], _worker['next_task']
+    moves = legal_moves(grid, topology)
+    results = []
+    nodes = [0]
+    while True:
+        with next_task.get_lock():
+            task = next_task.value
+            next_task.value += 1
+        if task >= len(moves):
+            return results, nodes[0]
+        cell, size = moves[task]
+        score, line = _search_root_move(grid, cell, size, _worker['depth'], _worker['beam_width'], topology,
+                                        _worker['table'], nodes)
+        results.append((score, task, line))
+
+
+def _position(board):
+    """
+    Type grid and topology of a Board, a HeadlessBoard or a plain 2D array (taken to be a square board).
+    """
+    if hasattr(board, 'type_grid'):
+        return board.type_grid, board.topology
+    if isinstance(board, HeadlessBoard):
+        return board.grid.copy(), board.topology
+    grid = np.array(board, dtype=np.uint8)
+    return grid, get_topology(grid.shape[0], grid.shape[1], SQUARE_TOPOLOGY)
+
+
+def solve(board, depth=None, beam_width=None, workers=1, table_bits=DEFAULT_TABLE_BITS):
+    """
+    Find the best line of moves from a position, following the classic rules. The search is exhaustive (with a
+    transposition table) unless a beam width is given.
+
+    With more than one worker, the top-level moves are shared out between processes. The root board and the
+    transposition table are placed in shared memory, so no board is ever pickled: workers attach to both by name, and
+    take top-level moves off a shared counter until none are left. Their results are reduced to the best line.
+    :param board: Board, HeadlessBoard or 2D array of tile type values
+    :param depth: most moves to look ahead. Default is None, i.e. until the game is over.
+    :param beam_width: positions kept per level for a beam search. Default is None (exhaustive search).
+    :param workers: # of processes to search with. Default is 1 (search in this process).
+    :param table_bits: the transposition table has 2 ** table_bits slots
+    :return: SolveResult
+    """
+    start = time.perf_counter()
+    grid, topology = _position(board)
+    depth = UNLIMITED_DEPTH if depth is None else depth
+    moves = legal_moves(grid, topology)
+    if not moves or depth == 0:
+        return SolveResult(0, [], 1, time.perf_counter() - start)
+
+    table_size = 1 << table_bits
+    if workers <= 1:
+        table = TranspositionTable(np.zeros(table_size, dtype=TABLE_ENTRY))
+        nodes = [1]
+        results = [_search_root_move(grid, cell, size, depth, beam_width, topology, table, nodes) + (task,)
+                   for task, (cell, size) in enumerate(moves)]
+        results = [(score, task, line) for score, line, task in results]
+        return _best_result(grid, results, nodes, depth, topology, table, start)
+
+    board_memory = shared_memory.SharedMemory(create=True, size=grid.nbytes)
+    table_memory = shared_memory.SharedMemory(create=True, size=table_size * TABLE_ENTRY.itemsize)
+    try:
+        np.ndarray(grid.shape, dtype=np.uint8, buffer=board_memory.buf)[...] = grid
+        entries = np.ndarray(table_size, dtype=TABLE_ENTRY, buffer=table_memory.buf)
+        entries[...] = 0
+        locks = [multiprocessing.Lock() for _ in range(LOCK_STRIPES)]
+        next_task = multiprocessing.Value('i', 0)
+        initargs = (board_memory.name, grid.shape, table_memory.name, table_size, locks, next_task, topology.kind,
+                    depth, beam_width)
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+            worker_results = pool.map(_run_worker, range(workers), chunksize=1)
+        results = [result for worker_result, _ in worker_results for result in worker_result]
+        nodes = [1 + sum(worker_nodes for _, worker_nodes in worker_results)]
+        best = _best_result(grid, results, nodes, depth, topology, TranspositionTable(entries), start)
+        del entries
+        return best
+    finally:
+        board_memory.close()
+        board_memory.unlink()
+        table_memory.close()
+        table_memory.unlink()
+
+
+def _best_result(grid, results, nodes, depth, topology, table, start):
+    """
+    Reduce the results of the top-level moves to the best line. Ties go to the move searched first, as in a serial
+    search.
+    """
+    score, task, line = max(results, key=lambda r: (r[0], -r[1]))
+    if line is None:
+        cell, _ = legal_moves(grid, topology)[task]
+        row_pos, col_pos = divmod(cell, grid.shape[1])
+        child = grid.copy()
+        apply_move(child, row_pos, col_pos, topology=topology)
+        line = [(row_pos, col_pos)] + _principal_line(child, depth - 1, topology, table, nodes)
+    return SolveResult(score, line, nodes[0], time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search for the best line of moves on a random Tile Miner board.")
+    parser.add_argument('--rows', type=int, default=5)
+    parser.add_argument('--columns', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--topology', choices=TOPOLOGIES, default=SQUARE_TOPOLOGY)
+    parser.add_argument('--depth', type=int, default=None)
+    parser.add_argument('--beam', type=int, default=None, help="beam width (default: exhaustive search)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--table-bits', type=int, default=DEFAULT_TABLE_BITS)
+    args = parser.parse_args()
+
+    board = HeadlessBoard(args.rows, args.columns, seed=args.seed, topology=args.topology)
+    print(board)
+    result = solve(board, args.depth, args.beam, args.workers, args.table_bits)
+    print(f"Best score: {result.score} in {len(result.line)} moves")
+    print(f"Line: {result.line}")
+    print(f"{result.nodes} positions in {result.seconds:.2f} s with {args.workers} worker(s)")
+
+
+if __name__ == "__main__":
+    main()
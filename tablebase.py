@@ -0,0 +1,296 @@
+import argparse
+from functools import lru_cache
+from itertools import combinations, product
+import os
+import struct
+import time
+import numpy as np
+
+from constants import BASE_TILE_SCORE, BONUS_POINTS, BONUS_GROUP_SIZE, SQUARE_TOPOLOGY, TOPOLOGIES
+from headless_board import EMPTY, NONEMPTY_TYPES, apply_move, label_groups
+from topology import get_topology
+
+# Built tablebases are kept here, one file per board shape, topology and tile limit
+dirname = os.path.dirname(__file__)
+TABLEBASE_DIR = os.path.join(dirname, "tablebases")
+TABLEBASE_EXTENSION = ".tmtb"
+
+# Fixed 24-byte little-endian header: magic, format version, rows, columns, most non-empty tiles covered, topology
+# (index into TOPOLOGIES), padding, # of entries. The header is followed by the entries' position keys (uint64, in
+# ascending order) and then by their best remaining scores (uint16) in the same order. Positions covered by the table
+# but missing from it have no moves left, i.e. a best remaining score of 0.
+HEADER = struct.Struct('<4sHHHBB4xQ')
+MAGIC = b'TMTB'
+FORMAT_VERSION = 1
+
+# Keys hold each tile's type as one base-5 digit, so a board can have at most this many tiles
+MAX_CELLS = 27
+
+# Positions evaluated at once while building, which bounds the memory used
+BUILD_BATCH_SIZE = 1 << 16
+
+
+def symmetries(topology):
+    """
+    Permutations of the tiles that map the board's neighbour table onto itself: rotations and reflections for square
+    boards, flips for rectangular ones, and whichever of those survive the wrap-around or the shifted rows of other
+    topologies. Groups, perimeters and scores are the same in every image of a position.
+    :param topology: Topology of the board
+    :return: 2D numpy array, one row per symmetry, mapping each tile to the tile whose type it takes
+    """
+    rows, columns = topology.rows, topology.columns
+    row, column = np.divmod(np.arange(rows * columns), columns)
+    candidates = [(row, column), (row, columns - 1 - column), (rows - 1 - row, column),
+                  (rows - 1 - row, columns - 1 - column)]
+    if rows == columns:
+        candidates += [(column, row), (columns - 1 - column, row), (column, rows - 1 - row),
+                       (columns - 1 - column, rows - 1 - row)]
+    edges = set(zip(*(a.tolist() for a in topology.edges)))
+    edges |= {(b, a) for a, b in edges}
+    result = []
+    for source_row, source_column in candidates:
+        permutation = source_row * columns + source_column
+        if all((permutation[a], permutation[b]) in edges for a, b in edges):
+            result.append(permutation)
+    return np.unique(np.array(result, dtype=np.intp), axis=0)
+
+
+def _keys(states, permutations):
+    """
+    Canonical keys of a batch of positions: the smallest base-5 packing among their symmetric images.
+    :param states: 2D numpy array, one flattened type grid per row
+    :param permutations: tile permutations from symmetries()
+    :return: numpy array of uint64
+    """
+    powers = np.uint64(5) ** np.arange(states.shape[1], dtype=np.uint64)
+    # Every image of every position in one gather: (positions, symmetries, tiles)
+    images = states[:, permutations].astype(np.uint64)
+    return (images * powers).sum(axis=2, dtype=np.uint64).min(axis=1)
+
+
+def _lookup(keys, table_keys, table_scores):
+    """
+    Best remaining scores of a batch of canonical keys, 0 for the keys that are not in the table.
+    """
+    if len(table_keys) == 0:
+        return np.zeros(len(keys), dtype=np.int64)
+    index = np.minimum(np.searchsorted(table_keys, keys), len(table_keys) - 1)
+    return np.where(table_keys[index] == keys, table_scores[index], 0).astype(np.int64)
+
+
+def _evaluate(states, topology, permutations, table_keys, table_scores):
+    """
+    Best remaining score of each position in a batch, from the scores of the positions its moves lead to (which have
+    fewer tiles, so are already in the table).
+    :return: numpy array of int64
+    """
+    count, cells = states.shape
+    labels = label_groups(states.reshape(count, topology.rows, topology.columns), topology).reshape(count, cells)
+    sizes = np.bincount((labels + (cells + 1) * np.arange(count)[:, np.newaxis]).ravel(),
+                        minlength=count * (cells + 1)).reshape(count, cells + 1)[:, :cells]
+    # One move per removable group of each position: its position and the label of the group
+    position, group_label = np.nonzero(sizes > 1)
+    before = states[position]
+    group = labels[position] == group_label[:, np.newaxis]
+    # Tiles next to the group, read off the padded neighbour table with the padding pointing outside the group
+    next_to_group = np.concatenate([group, np.zeros((len(group), 1), dtype=bool)], axis=1)[:, topology.padded].any(2)
+    perimeter = next_to_group & ~group & (before != EMPTY)
+    after = np.where(group, EMPTY, np.where(perimeter, before % len(NONEMPTY_TYPES) + 1, before)).astype(np.uint8)
+    size = sizes[position, group_label]
+    points = BASE_TILE_SCORE * size + BONUS_POINTS * np.maximum(size - BONUS_GROUP_SIZE, 0)
+    totals = points + _lookup(_keys(after, permutations), table_keys, table_scores)
+    best = np.zeros(count, dtype=np.int64)
+    np.maximum.at(best, position, totals)
+    return best
+
+
+def build_tablebase(rows, columns, max_tiles, topology=SQUARE_TOPOLOGY, path=None):
+    """
+    Work out the best remaining score (classic rules) of every position of a board with at most max_tiles non-empty
+    tiles, and write them to a file. Positions are solved in order of their # of tiles: a move always removes at least
+    two tiles, so it leads to a position that is already solved. Only one position of each symmetry class is solved
+    and stored.
+    :param rows: # of rows in the board
+    :param columns: # of columns in the board
+    :param max_tiles: most non-empty tiles. rows * columns covers every position, which is feasible up to about nine
+    tiles.
+    :param topology: one of TOPOLOGIES. Default is square.
+    :param path: file to write. Default is None (a file in TABLEBASE_DIR named after the board and limit).
+    :return: path of the written file
+    """
+    cells = rows * columns
+    if cells > MAX_CELLS:
+        raise ValueError(f"Boards of more than {MAX_CELLS} tiles are not supported: {rows}x{columns}")
+    if not 0 <= max_tiles <= cells:
+        raise ValueError(f"max_tiles must be between 0 and {cells}: {max_tiles}")
+    board_topology = get_topology(rows, columns, topology)
+    permutations = symmetries(board_topology)
+    first, second = board_topology.edges
+    table_keys = np.zeros(0, dtype=np.uint64)
+    table_scores = np.zeros(0, dtype=np.uint16)
+
+    for tiles in range(2, max_tiles + 1):
+        types = np.array(list(product(NONEMPTY_TYPES, repeat=tiles)), dtype=np.uint8)
+        level_keys, level_scores = [], []
+        placements = combinations(range(cells), tiles)
+        while True:
+            batch = np.array([p for _, p in zip(range(max(BUILD_BATCH_SIZE // len(types), 1)), placements)],
+                             dtype=np.intp)
+            if len(batch) == 0:
+                break
+            states = np.zeros((len(batch) * len(types), cells), dtype=np.uint8)
+            states[np.arange(len(states))[:, np.newaxis], np.repeat(batch, len(types), axis=0)] = \
+                np.tile(types, (len(batch), 1))
+            # Only the image of each position with the smallest key is solved, and only if it has a move
+            keys = _keys(states, permutations)
+            own = (states.astype(np.uint64) * np.uint64(5) ** np.arange(cells, dtype=np.uint64)).sum(
+                axis=1, dtype=np.uint64)
+            keep = (own == keys) & ((states[:, first] == states[:, second]) & (states[:, first] != EMPTY)).any(axis=1)
+            scores = _evaluate(states[keep], board_topology, permutations, table_keys, table_scores)
+            level_keys.append(keys[keep])
+            level_scores.append(scores)
+        table_keys = np.concatenate([table_keys] + level_keys)
+        table_scores = np.concatenate([table_scores] + [s.astype(np.uint16) for s in level_scores])
+        order = np.argsort(table_keys, kind='stable')
+        table_keys, table_scores = table_keys[order], table_scores[order]
+
+    if path is None:
+        os.makedirs(TABLEBASE_DIR, exist_ok=True)
+        path = os.path.join(TABLEBASE_DIR, f"{topology}-{rows}x{columns}-{max_tiles}{TABLEBASE_EXTENSION}")
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, rows, columns, max_tiles, TOPOLOGIES.index(topology),
+                            len(table_keys)))
+        f.write(table_keys.astype('<u8').tobytes())
+        f.write(table_scores.astype('<u2').tobytes())
+    os.replace(temp_path, path)
+    return path
+
+
+class TablebaseError(Exception):
+    pass
+
+
+class Tablebase(object):
+    """
+    Tablebase class. Exact best remaining scores of the positions of one board shape with few tiles left, read
+    straight from a memory-mapped file: a lookup is a binary search over the sorted keys.
+    """
+
+    def __init__(self, path):
+        """
+        Tablebase construct.
+        :param path: file written by build_tablebase
+        """
+        with open(path, 'rb') as f:
+            data = f.read(HEADER.size)
+        if len(data) < HEADER.size:
+            raise TablebaseError(f"File too short to be a tablebase: {path}")
+        magic, version, rows, columns, max_tiles, topology, count = HEADER.unpack(data)
+        if magic != MAGIC:
+            raise TablebaseError(f"Not a tablebase: {path}")
+        if version != FORMAT_VERSION:
+            raise TablebaseError(f"Unsupported tablebase version {version}: {path}")
+        if topology >= len(TOPOLOGIES):
+            raise TablebaseError(f"Unknown topology {topology}: {path}")
+        self.path = path
+        self.max_tiles = max_tiles
+        self.topology = get_topology(rows, columns, TOPOLOGIES[topology])
+        self._permutations = symmetries(self.topology)
+        if count:
+            self._keys = np.memmap(path, dtype='<u8', mode='r', offset=HEADER.size, shape=(count,))
+            self._scores = np.memmap(path, dtype='<u2', mode='r', offset=HEADER.size + 8 * count, shape=(count,))
+        else:
+            self._keys, self._scores = np.zeros(0, dtype='<u8'), np.zeros(0, dtype='<u2')
+
+    def __len__(self):
+        return len(self._keys)
+
+    def covers(self, grid, topology=None):
+        """
+        Is the position in the table's range?
+        :param grid: 2D numpy array of tile type values
+        :param topology: Topology of the board. Default is a square board of the grid's shape.
+        :return: Boolean
+        """
+        kind = topology.kind if topology is not None else SQUARE_TOPOLOGY
+        return (grid.shape == (self.topology.rows, self.topology.columns) and kind == self.topology.kind
+                and np.count_nonzero(grid) <= self.max_tiles)
+
+    def best_score(self, grid):
+        """
+        Best score that can still be made from a position the table covers.
+        :param grid: 2D numpy array of tile type values
+        :return: int
+        """
+        key = _keys(grid.reshape(1, -1), self._permutations)
+        return int(_lookup(key, self._keys, self._scores)[0])
+
+    def best_move(self, grid):
+        """
+        A move that makes the best remaining score from a position the table covers.
+        :param grid: 2D numpy array of tile type values
+        :return: (row_pos, col_pos), or None if there are no moves
+        """
+        labels = label_groups(grid, self.topology)
+        counts = np.bincount(labels.ravel(), minlength=grid.size + 1)[:grid.size]
+        best, best_score = None, -1
+        for cell in np.flatnonzero(counts > 1).tolist():
+            child = grid.copy()
+            move = divmod(cell, grid.shape[1])
+            score = apply_move(child, *move, topology=self.topology).points + self.best_score(child)
+            if score > best_score:
+                best, best_score = move, score
+        return best
+
+
+@lru_cache(maxsize=None)
+def load_tablebase(rows, columns, topology=SQUARE_TOPOLOGY, directory=TABLEBASE_DIR):
+    """
+    The tablebase with the highest tile limit built for a board, opened once and shared.
+    :param rows: # of rows in the board
+    :param columns: # of columns in the board
+    :param topology: one of TOPOLOGIES. Default is square.
+    :param directory: directory to look in
+    :return: Tablebase, or None if none has been built
+    """
+    prefix = f"{topology}-{rows}x{columns}-"
+    if not os.path.isdir(directory):
+        return None
+    limits = [int(name[len(prefix):-len(TABLEBASE_EXTENSION)]) for name in os.listdir(directory)
+              if name.startswith(prefix) and name.endswith(TABLEBASE_EXTENSION)]
+    if not limits:
+        return None
+    return Tablebase(os.path.join(directory, f"{prefix}{max(limits)}{TABLEBASE_EXTENSION}"))
+
+
+def tablebase_score(grid, topology=None):
+    """
+    Exact best remaining score of a position, if a tablebase covers it.
+    :param grid: 2D numpy array of tile type values
+    :param topology: Topology of the board. Default is a square board of the grid's shape.
+    :return: int, or None if no tablebase covers the position
+    """
+    kind = topology.kind if topology is not None else SQUARE_TOPOLOGY
+    tablebase = load_tablebase(grid.shape[0], grid.shape[1], kind)
+    if tablebase is None or not tablebase.covers(grid, topology):
+        return None
+    return tablebase.best_score(grid)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an exact endgame tablebase for a Tile Miner board.")
+    parser.add_argument('--rows', type=int, default=4)
+    parser.add_argument('--columns', type=int, default=4)
+    parser.add_argument('--max-tiles', type=int, default=5, help="most non-empty tiles of the positions covered")
+    parser.add_argument('--topology', choices=TOPOLOGIES, default=SQUARE_TOPOLOGY)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    path = build_tablebase(args.rows, args.columns, args.max_tiles, args.topology)
+    tablebase = Tablebase(path)
+    print(f"{len(tablebase)} positions with moves, {os.path.getsize(path)} bytes, "
+          f"{len(symmetries(tablebase.topology))} symmetries, built in {time.perf_counter() - start:.1f} s: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import arcade
 from enum import Enum
 import os
+from asset_atlas import load_atlas
 
 # Tile image file paths
 dirname = os.path.dirname(__file__)
@@ -43,16 +44,22 @@ class Tile(arcade.Sprite):
     Tile class.
     """
 
-    def __init__(self, tile_type=TileType.EMPTY):
+    def __init__(self, tile_type=TileType.EMPTY, scale=1.0):
+        """
+        Tile construct.
+        :param tile_type: TileType enum
+        :param scale: tile scale. The textures come from the atlas pre-scaled to it, so the sprite itself is never
+        scaled.
+        """
         # Tile type used. This represents the 'block' currently being used.
         self.tile_type: TileType = tile_type
         # Grid coordinates for the tile
         self.coordinates: tuple = (0, 0)
-        try:
-            self.filename: str = TileType.get_file_name(self._tile_type)
-        except FileNotFoundError as e:
-            print(f"SPRITE IMAGE CANNOT BE FOUND: {e}")
-        super().__init__(self.filename)
+        self.filename: str = TileType.get_file_name(self._tile_type)
+        # Tile textures, indexed by tile type value
+        self._textures = load_atlas(scale).tile_textures
+        super().__init__()
+        self.set_tile_texture()
 
     @property
     def coordinates(self):
@@ -89,19 +96,88 @@ class Tile(arcade.Sprite):
 
     def set_tile_texture(self):
         """
-        Load texture for Tile object using the specified file path. Should use when tile_type field is set to a
+        Set the texture for the Tile object's type from the atlas. Should use when tile_type field is set to a
         different value.
         :return:
         """
-        try:
-            img = TileType.get_file_name(self._tile_type)
-            self.texture = arcade.load_texture(img)
-        except FileNotFoundError as e:
-            print(f"SPRITE IMAGE CANNOT BE FOUND: {e}")
+        self.texture = self._textures[self._tile_type.value]
+
+    def reset(self, tile_type, center_x, center_y, coordinates):
+        """
+        Reuse this Tile for a new board position: set its type, texture, position and grid coordinates, and clear
+        any highlight colour.
+        :param tile_type: TileType enum
+        :param center_x: x position of the sprite centre
+        :param center_y: y position of the sprite centre
+        :param coordinates: grid coordinates (row_pos, col_pos)
+        :return:
+        """
+        if tile_type != self._tile_type:
+            self.tile_type = tile_type
+            self.set_tile_texture()
+        self.coordinates = coordinates
+        self.center_x = center_x
+        self.center_y = center_y
+        self.color = (255, 255, 255)
 
     def __str__(self):
         return str(self.tile_type.value)
 
 
+class TilePool(object):
+    """
+    Recycles Tile sprites (and the sprite list holding them) between game sessions, so that starting a new game
+    does not create a new sprite for every cell.
+    """
+
+    def __init__(self, scale=1.0):
+        """
+        TilePool construct.
+        :param scale: tile scale of every Tile the pool creates
+        """
+        self._scale = scale
+        self._free_tiles = []
+        self._free_list = None
+
+    def acquire(self, count):
+        """
+        Get a sprite list holding `count` Tile objects. The sprite list of the previous game is handed back unchanged
+        if it has the right size; otherwise one is built from free tiles, creating new ones only if the pool runs out.
+        The tiles must be reset before use.
+        :param count: number of tiles needed
+        :return: arcade.SpriteList, list of Tile
+        """
+        if self._free_list is not None:
+            sprite_list, self._free_list = self._free_list, None
+            if len(sprite_list) == count:
+                return sprite_list, list(sprite_list)
+            self._free_tiles.extend(sprite_list)
+            for tile in list(sprite_list):
+                tile.remove_from_sprite_lists()
+
+        sprite_list = arcade.SpriteList()
+        tiles = []
+        while len(tiles) < count:
+            if self._free_tiles:
+                tile = self._free_tiles.pop()
+            else:
+                tile = Tile(TileType.ONE_TILE, self._scale)
+            tiles.append(tile)
+            sprite_list.append(tile)
+        return sprite_list, tiles
+
+    def release(self, sprite_list):
+        """
+        Give a sprite list of Tile objects back to the pool once its game is over.
+        :param sprite_list: arcade.SpriteList obtained from acquire
+        :return:
+        """
+        if self._free_list is not None and self._free_list is not sprite_list:
+            self._free_tiles.extend(self._free_list)
+            for tile in list(self._free_list):
+                tile.remove_from_sprite_lists()
+        self._free_list = sprite_list
+
+
 if __name__ == "__main__":
     tile = Tile(TileType.ONE_TILE)
@@ -1,13 +1,26 @@
 import arcade
 import random
 import time
-from tile import Tile, TileType
+import numpy as np
+from tile import TileType, TilePool
 from board import Board
+from board_cache import BoardCache
+from topology import get_topology
+from headless_board import any_legal_moves
+from move_hints import HintWorker
+from move_history import MoveHistory
+import session_file
+import session_journal
 from dashboard import Dashboard
+from difficulty import ModelNotCalibratedError, calibrate_in_background, generate_board
 from constants import *
 # import logging
 import return_view
+from game_history import END_NO_MOVES, END_TIME_UP
 import datetime
+from profiler import profiler
+from metrics import metrics
+from idle_throttle import idle_throttle
 
 # Logger (for debugging)
 # logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
@@ -19,59 +32,116 @@ import datetime
 ROW_COUNT = 4
 COLUMN_COUNT = 4
 
+# In endless mode, the sprites are brought back down to the bottom of the world after this many rows have scrolled,
+# so that their positions never grow large enough to lose precision
+SCROLL_REBASE_ROWS = 4096
+
+# Tile sprites are recycled between games instead of being created afresh for every new board
+tile_pool = TilePool(SCALE_FACTOR)
+
+BACKGROUND_COLOR = arcade.color.LIGHT_TAUPE
+
 
 class TileMiner(arcade.View):
     """
     Main application class.
     """
 
-    def __init__(self, row_count=ROW_COUNT, column_count=COLUMN_COUNT, total_time=60):
+    def __init__(self, row_count=ROW_COUNT, column_count=COLUMN_COUNT, total_time=60, seed=None, board_setup=None,
+                 score=0, timer=None, mode=CLASSIC_MODE, topology=SQUARE_TOPOLOGY, journal=None, difficulty=None):
         """
         TileMiner construct.
+        :param row_count: # of rows in the board
+        :param column_count: # of columns in the board
+        :param total_time: time the game starts with in seconds
+        :param seed: seed used to generate the board. If None, a random seed is picked.
+        :param board_setup: 2D array of tile type values to start from instead of a random board, e.g. when resuming
+        a saved game. Default is None.
+        :param score: score to start from. Default is 0.
+        :param timer: time left in seconds, if different from total_time. Default is None.
+        :param mode: game mode, one of GAME_MODES. Default is classic.
+        :param topology: board topology, one of TOPOLOGIES. Default is square. On hex boards, odd rows are drawn shifted
+        half a tile to the right.
+        :param journal: file to journal the game's moves in as they are played, so that the game can be recovered
+        if the process dies (see from_journal). Default is None (not journalled).
+        :param difficulty: difficulty of the random board, between 0 (easiest) and 1 (hardest) or one of
+        difficulty.DIFFICULTY_LEVELS. If the difficulty model for this board size has not been calibrated yet, the
+        game starts from any board with a legal move while the model is calibrated in the background. Default is None
+        (any board with a legal move).
         """
 
         super().__init__()
-        arcade.set_background_color(arcade.color.LIGHT_TAUPE)
+        arcade.set_background_color(BACKGROUND_COLOR)
 
         self.row_count = row_count
         self.column_count = column_count
         self._total_time = total_time
+        if mode not in GAME_MODES:
+            raise ValueError(f"Unknown game mode: {mode}")
+        self.mode = mode
+        if topology not in TOPOLOGIES:
+            raise ValueError(f"Unknown topology: {topology}")
+        if mode == ENDLESS_MODE and topology == HEX_TOPOLOGY:
+            raise ValueError("Endless mode does not support the hex topology")
+        self.topology = topology
+
+        # Seed of the random number generator used for this board, kept so that the game can be saved
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self._rng = random.Random(self.seed)
+
+        # Horizontal shift of odd rows: half a tile on hex boards, so that each tile sits between two tiles of the
+        # rows above and below
+        self._odd_row_shift = (TILE_SCALED_WIDTH + MARGIN) / 2 if topology == HEX_TOPOLOGY else 0
 
         # window dimensions
-        self.screen_width = (TILE_SCALED_WIDTH + MARGIN) * self.column_count + 2 * VERTICAL_BORDER_MARGIN
+        self.screen_width = (TILE_SCALED_WIDTH + MARGIN) * self.column_count + 2 * VERTICAL_BORDER_MARGIN + \
+            int(self._odd_row_shift)
         self.screen_height = (TILE_SCALED_HEIGHT + MARGIN) * self.row_count + HORIZONTAL_BORDER_MARGIN
 
-        # Create (1D) list of all sprites
-        self.grid_sprite_list = arcade.SpriteList()
+        # List of non-empty tile types
+        nonempty_types = [i for i in TileType if i != TileType.EMPTY]
+
+        # Pick the initial tile types randomly. Make sure we have legal moves to begin with.
+        board_topology = get_topology(self.row_count, self.column_count, topology)
+        difficulty_ready = True
+        if board_setup is None and difficulty is not None:
+            try:
+                # Kept as the board setup, so that the journal can set up this same board again
+                board_setup = generate_board(self.row_count, self.column_count, difficulty, topology, seed=self.seed)
+            except ModelNotCalibratedError:
+                # Calibrating takes seconds, far too long to hold up the game, so it happens on another thread and
+                # the next game of this size gets its difficulty
+                calibrate_in_background(self.row_count, self.column_count, topology)
+                difficulty_ready = False
+        if board_setup is not None:
+            initial_types = [[TileType(int(t)) for t in row] for row in board_setup]
+        else:
+            while True:
+                initial_types = [[self._rng.choice(nonempty_types) for _ in range(self.column_count)]
+                                 for _ in range(self.row_count)]
+                if any_legal_moves(np.array([[t.value for t in row] for row in initial_types]),
+                                   topology=board_topology):
+                    break
+
+        # (1D) list of all sprites, recycled from a previous game if one has finished
+        self.grid_sprite_list, tiles = tile_pool.acquire(self.row_count * self.column_count)
 
         # 2D grid of sprites to that points to the same sprites that are in grid_sprite_list. Improves runtime of the
         # code.
         board_template = []
-
-        # List of non-empty tile types
-        nonempty_types = [i for i in TileType if i != TileType.EMPTY]
-
-        # Set up the initial board of tiles randomly. Make sure we have legal moves to begin with.
-        while True:
-            for row in range(self.row_count):
-                board_template.append([])
-                for column in range(self.column_count):
-                    x = column * (TILE_SCALED_WIDTH + MARGIN) + (
-                                TILE_SCALED_WIDTH / 2 + MARGIN / 2) + VERTICAL_BORDER_MARGIN
-                    y = row * (TILE_SCALED_HEIGHT + MARGIN) + (TILE_SCALED_HEIGHT / 2 + MARGIN / 2)
-                    initial_tile_type = random.choice(nonempty_types)
-                    sprite = Tile(initial_tile_type)
-                    sprite.center_x = x
-                    sprite.center_y = y
-                    sprite.coordinates = (int(y // (TILE_SCALED_HEIGHT + MARGIN)),
-                                          int((x - VERTICAL_BORDER_MARGIN) // (TILE_SCALED_WIDTH + MARGIN)))
-                    sprite.scale = SCALE_FACTOR
-                    self.grid_sprite_list.append(sprite)
-                    board_template[row].append(sprite)
-            self._board = Board(self.row_count, self.column_count, board_template)
-            if self._board.any_legal_moves():
-                # logging.info("Board now set up")
-                break
+        for row in range(self.row_count):
+            board_template.append([])
+            for column in range(self.column_count):
+                x = column * (TILE_SCALED_WIDTH + MARGIN) + (
+                            TILE_SCALED_WIDTH / 2 + MARGIN / 2) + VERTICAL_BORDER_MARGIN + \
+                    (row % 2) * self._odd_row_shift
+                y = row * (TILE_SCALED_HEIGHT + MARGIN) + (TILE_SCALED_HEIGHT / 2 + MARGIN / 2)
+                sprite = tiles[row * self.column_count + column]
+                sprite.reset(initial_types[row][column], x, y, (row, column))
+                board_template[row].append(sprite)
+        self._board = Board(self.row_count, self.column_count, board_template, allow_empty=board_setup is not None,
+                            topology=topology)
+        # logging.info("Board now set up")
 
         # Information to draw the rectangle which we'll use as our dash board to display the time left, score and
         # game messages
@@ -81,25 +151,121 @@ class TileMiner(arcade.View):
             'width': self.screen_width - 2 * MARGIN,
             'height': HORIZONTAL_BORDER_MARGIN - 2 * MARGIN,
         }
-        self.dashboard = Dashboard(self.dashboard_data, timer=total_time)
+        self.dashboard = Dashboard(self.dashboard_data, timer=total_time, score=score)
+        if timer is not None:
+            self.dashboard.timer = timer
+        if not difficulty_ready:
+            self.dashboard.message = "Difficulty not ready yet"
 
         # Evaluates to True if no available moves can be found (i.e. the game ends)
         self.no_moves = False
 
+        # Moves played so far (less any undone), recorded in the game history when the game ends
+        self.moves = 0
+
         # Group of same-type tiles to be highlighted when the cursor hovers over them
         self._highlighted_group = []
 
         # Has _highlighted_group changed?
         self._highlight_target_changed = False
 
+        # Latest mouse position not yet handled. Motion events only record it; the hover highlight is worked out once
+        # per update, however many events the mouse sends in between.
+        self._pending_motion = None
+
         # dashboard message timer. Message pops up for a given amount of time for certain events.
         self._timer = 0
 
         # Has the game already started?
         self.game_started = True
 
+        # Endless mode: rows scrolled since the sprites were last brought back down. The view follows the sprites up.
+        self._scrolled_rows = 0
+
+        # The board as last drawn, redrawn only where tiles have changed
+        self._board_cache = BoardCache(self.window, BACKGROUND_COLOR)
+
+        # Moves played so far, for undo (Ctrl+Z) and redo (Ctrl+Y)
+        self._history = MoveHistory(self.column_count)
+
+        # Ranks the groups of the current board in the background so that a hint (H key) shows up instantly
+        self._hints = HintWorker(self._board.topology)
+        self._hints.start()
+        self._hints.submit(self._board.version, self._board.type_grid)
+
+        # Journal of the moves played, started with everything needed to set up this same game again
+        self._journal = None
+        if journal is not None:
+            self._journal = session_journal.create_journal(journal, session_journal.JournalHeader(
+                row_count, column_count, self.seed, total_time, self.dashboard.timer, score, mode, topology),
+                board_setup)
+
         # logging.info("Initial board setup:\n" + str(self._board))
 
+    @classmethod
+    def from_save(cls, path, journal=None):
+        """
+        Resume a game from a saved session file.
+        :param path: saved session file
+        :param journal: file to journal the resumed game's moves in (see __init__). Default is None (not journalled).
+        :return: TileMiner
+        """
+        header = session_file.read_header(path)
+        return cls(row_count=header.rows, column_count=header.columns, total_time=header.total_time,
+                   seed=header.seed, board_setup=session_file.load_grid(path, header), score=header.score,
+                   timer=header.timer, mode=header.mode, topology=header.topology, journal=journal)
+
+    @classmethod
+    def from_journal(cls, path=session_journal.JOURNAL_FILE):
+        """
+        Recover a game that was cut short from its journal: set the game up as it started and play its moves again.
+        The recovered game carries on journalling to the same file.
+        :param path: journal file
+        :return: TileMiner
+        :raises JournalError: if the game cannot be set up or replayed from the journal
+        """
+        header, grid, records, length = session_journal.read_journal(path)
+        try:
+            view = cls(row_count=header.rows, column_count=header.columns, total_time=header.total_time,
+                       seed=header.seed, board_setup=grid, score=header.score, timer=header.timer, mode=header.mode,
+                       topology=header.topology)
+        except (ValueError, TypeError) as e:
+            raise session_journal.JournalError(f"Session journal does not set up a valid game: {path}") from e
+        try:
+            for record in records:
+                if record.kind == session_journal.MOVE:
+                    view.play_move(record.row, record.column)
+                elif record.kind == session_journal.UNDO:
+                    view.undo_move()
+                else:
+                    view.redo_move()
+                if view.dashboard.score != record.score:
+                    raise session_journal.JournalError(
+                        f"Session journal does not replay to its recorded score: {path}")
+        except Exception as e:
+            # The partly replayed game is abandoned: stop its hint thread and give its tiles back to the pool
+            view._release()
+            if isinstance(e, session_journal.JournalError):
+                raise
+            raise session_journal.JournalError(f"Session journal cannot be replayed: {path}") from e
+        if records:
+            view.dashboard.timer = records[-1].timer
+        view._journal = session_journal.SessionJournal(path, length)
+        view._journal.start()
+        return view
+
+    def save(self, path=None):
+        """
+        Save the current game so it can be resumed later.
+        :param path: file to write. If None, a new file is created in the saves directory.
+        :return: path of the saved session
+        """
+        if path is None:
+            path = session_file.new_save_path()
+        session_file.save_session(path, self._board.type_grid, self.dashboard.timer, self._total_time,
+                                  self.dashboard.score, self.seed, self.mode, self.topology)
+        return path
+
     @property
     def player_data(self):
         """
@@ -117,23 +283,67 @@ class TileMiner(arcade.View):
                 'score': str(self.dashboard.score)
                 }
 
+    def on_hide_view(self):
+        """
+        What to do when hiding this view. The game is over, so its tiles go back to the pool for the next game.
+        :return:
+        """
+
+        self._release()
+        if self._journal is not None:
+            self._journal.close(remove=True)
+            self._journal = None
+
+    def _release(self):
+        """
+        Stop the hint thread and give the tiles back to the pool, once the game is over or abandoned.
+        :return:
+        """
+
+        self._hints.stop()
+        tile_pool.release(self.grid_sprite_list)
+
     def on_draw(self):
         """
         Render the screen.
         """
 
         arcade.start_render()
+        self._board_cache.draw(self.grid_sprite_list, self._board.take_dirty_tiles(),
+                               self._scrolled_rows * (TILE_SCALED_HEIGHT + MARGIN))
         self.dashboard.setup_dashboard()
-        self.grid_sprite_list.draw()
 
-    def on_mouse_motion(self, x, y, dx, dy):
+    def _grid_position(self, x, y):
         """
-        Called when the user moves the mouse.
+        Change x/y screen coordinates to grid coordinates.
+        :param x: x screen coordinate
+        :param y: y screen coordinate
+        :return: row and column (which may lie outside the board)
         """
 
-        # Change the x/y screen coordinates to grid coordinates
-        column = int((x - VERTICAL_BORDER_MARGIN) // (TILE_SCALED_WIDTH + MARGIN))
         row = int(y // (TILE_SCALED_HEIGHT + MARGIN))
+        column = int((x - VERTICAL_BORDER_MARGIN - (row % 2) * self._odd_row_shift) // (TILE_SCALED_WIDTH + MARGIN))
+        return row, column
+
+    def on_mouse_motion(self, x, y, dx, dy):
+        """
+        Called when the user moves the mouse. Only the latest position is kept until the next update.
+        """
+
+        if self._pending_motion is not None:
+            metrics.add('motion_events_coalesced')
+        metrics.add('motion_events')
+        self._pending_motion = (x, y)
+
+    def _hover(self, x, y):
+        """
+        Highlight the group under the mouse.
+        :param x: x screen coordinate
+        :param y: y screen coordinate
+        :return:
+        """
+
+        row, column = self._grid_position(x, y)
 
         # Highlight a group of tiles of the same type (single tiles will never be highlighted)
         if row < 0 or row >= self.row_count or column < 0 or column >= self.column_count \
@@ -154,9 +364,7 @@ class TileMiner(arcade.View):
         Called when the user presses a mouse button.
         """
 
-        # Change the x/y screen coordinates to grid coordinates
-        column = int((x - VERTICAL_BORDER_MARGIN) // (TILE_SCALED_WIDTH + MARGIN))
-        row = int(y // (TILE_SCALED_HEIGHT + MARGIN))
+        row, column = self._grid_position(x, y)
 
         # logging.info(f"Click coordinates: ({x}, {y}). Grid coordinates: ({row}, {column})")
 
@@ -165,12 +373,32 @@ class TileMiner(arcade.View):
         if row < 0 or row >= self.row_count or column < 0 or column >= self.column_count \
                 or self._board.get_tile_type(row, column) == TileType.EMPTY:
             return
-        group, perimeter = self._board.find_group_and_perimeter(row, column)
-        if len(group) > 1:
-            self._board.remove_tiles(group)
-            self._board.flush_tiles(group)
-            self._board.increment_board_tiles(perimeter)
-            self.dashboard.calculate_new_score(group)
+        self.play_move(row, column)
+
+    def play_move(self, row, column):
+        """
+        Remove the group of a tile, if it is part of one, and journal the move.
+        :param row: row of the tile
+        :param column: column of the tile
+        :return:
+        """
+
+        move = self._board.apply_move(row, column)
+        if move is not None:
+            self.moves += 1
+            self._board.flush_tiles(move.group)
+            self.dashboard.calculate_new_score(move.group)
+            if self.mode == CLASSIC_MODE:
+                # Moves are only recorded in classic mode: a diff of the changed tiles cannot reverse falling or
+                # scrolling tiles
+                self._history.record(move.group, move.incremented, move.tile_type, move.points)
+            elif self.mode == GRAVITY_MODE:
+                self._drop_tiles()
+            else:
+                self._scroll_board()
+            self._hints.submit(self._board.version, self._board.type_grid)
+            if self._journal is not None:
+                self._journal.append(session_journal.MOVE, row, column, self.dashboard.score, self.dashboard.timer)
         else:
             self.dashboard.message = "Only one tile!"
         any_more_moves = self._board.any_legal_moves()
@@ -178,6 +406,122 @@ class TileMiner(arcade.View):
             self.dashboard.message = "NO MORE MOVES!"
             self.no_moves = True
 
+    def _drop_tiles(self):
+        """
+        Gravity mode: let tiles fall into the gaps and refill the board from the top. Only the sprites that changed
+        cell are moved on screen.
+        :return:
+        """
+
+        # The highlighted cells are about to hold different tiles
+        self._clear_highlight()
+        for tile in self._board.apply_gravity(self._rng):
+            row, column = tile.coordinates
+            # On hex boards, a tile that falls an odd number of rows also moves half a tile sideways
+            tile.center_x = column * (TILE_SCALED_WIDTH + MARGIN) + (TILE_SCALED_WIDTH / 2 + MARGIN / 2) + \
+                VERTICAL_BORDER_MARGIN + (row % 2) * self._odd_row_shift
+            tile.center_y = row * (TILE_SCALED_HEIGHT + MARGIN) + (TILE_SCALED_HEIGHT / 2 + MARGIN / 2)
+
+    def _scroll_board(self):
+        """
+        Endless mode: scroll cleared rows off the board. Rather than moving every sprite down, the view moves up, so
+        only the sprites of the rows that arrive at the top are repositioned.
+        :return:
+        """
+
+        self._clear_highlight()
+        scrolled = self._board.scroll(self._rng)
+        if not scrolled:
+            return
+        # Every row has moved on screen
+        self._board_cache.invalidate()
+        self._scrolled_rows += scrolled
+        if self._scrolled_rows >= SCROLL_REBASE_ROWS:
+            for tile in self.grid_sprite_list:
+                tile.center_y -= self._scrolled_rows * (TILE_SCALED_HEIGHT + MARGIN)
+            self._scrolled_rows = 0
+        for row in range(max(self.row_count - scrolled, 0), self.row_count):
+            y = (self._scrolled_rows + row) * (TILE_SCALED_HEIGHT + MARGIN) + (TILE_SCALED_HEIGHT / 2 + MARGIN / 2)
+            for tile in self._board.row_sprites(row):
+                tile.center_y = y
+
+    def on_key_press(self, symbol, modifiers):
+        """
+        Called when the user presses a key. H highlights the best group, as ranked in the background; Ctrl+Z/Ctrl+Y
+        undo and redo moves; Ctrl+S saves the game.
+        """
+
+        if symbol == arcade.key.H:
+            hint = self._hints.best_group(self._board.version)
+            if hint is None:
+                # Either the ranking of this board has not finished, or there is nothing to rank
+                self.dashboard.message = "No hint yet!" if self._board.any_legal_moves() else "No moves to hint!"
+                return
+            self._highlighted_group = sorted(hint)
+            self._board.flush_board()
+            self._timer = 0
+            self._highlight_target_changed = False
+        elif symbol == arcade.key.Z and modifiers & arcade.key.MOD_CTRL:
+            self.undo_move()
+        elif symbol == arcade.key.Y and modifiers & arcade.key.MOD_CTRL:
+            self.redo_move()
+        elif symbol == arcade.key.S and modifiers & arcade.key.MOD_CTRL:
+            self.save()
+            self.dashboard.message = "Game saved!"
+
+    def undo_move(self):
+        """
+        Take back the last move, changing only the tiles that move changed.
+        :return:
+        """
+
+        move = self._history.undo()
+        if move is None:
+            return
+        self._board.restore_tiles(move.removed, TileType(move.tile_type))
+        self._board.decrement_board_tiles(move.incremented)
+        self.dashboard.score = self.dashboard.score - move.score_delta
+        self.moves -= 1
+        self._clear_highlight()
+        self._hints.submit(self._board.version, self._board.type_grid)
+        if self._journal is not None:
+            self._journal.append(session_journal.UNDO, 0, 0, self.dashboard.score, self.dashboard.timer)
+
+    def redo_move(self):
+        """
+        Play an undone move again.
+        :return:
+        """
+
+        move = self._history.redo()
+        if move is None:
+            return
+        self._board.remove_tiles(move.removed)
+        self._board.increment_board_tiles(move.incremented)
+        self.dashboard.score = self.dashboard.score + move.score_delta
+        self.moves += 1
+        self._clear_highlight()
+        self._hints.submit(self._board.version, self._board.type_grid)
+        if self._journal is not None:
+            self._journal.append(session_journal.REDO, 0, 0, self.dashboard.score, self.dashboard.timer)
+
+    def _clear_highlight(self):
+        self._board.flush_tiles(self._highlighted_group)
+        self._highlighted_group = []
+        self._highlight_target_changed = False
+
+    def time_to_next_change(self):
+        """
+        How long the screen stays the same without input, for the idle throttle.
+        :return: 0 while a group is highlighted, a message is counting down or the game is ending; otherwise the time
+        until the timer shows the next second
+        """
+
+        if len(self._highlighted_group) > 1 or self.dashboard.message != "" or self.no_moves:
+            return 0
+        # A little past the second, so that the update lands after the displayed time has changed
+        return self.dashboard.timer % 1 + 0.001
+
     def on_update(self, new_time):
         """
         Called every frame.
@@ -185,7 +529,11 @@ class TileMiner(arcade.View):
         :return:
         """
 
-        self.dashboard.timer -= new_time
+        if self._pending_motion is not None:
+            self._hover(*self._pending_motion)
+            self._pending_motion = None
+
+        self.dashboard.tick(new_time)
         self._timer += new_time
 
         if self.dashboard.message != "" and self.dashboard.message != "NO MORE MOVES!":
@@ -199,12 +547,18 @@ class TileMiner(arcade.View):
 
         if self.dashboard.timer < 0 or self.no_moves:
             time.sleep(1.5)
-            next_view = return_view.ReturnView(self.player_data)
+            next_view = return_view.ReturnView(self.player_data, {
+                'moves': self.moves, 'end_reason': END_NO_MOVES if self.no_moves else END_TIME_UP,
+                'mode': self.mode, 'topology': self.topology})
             self.window.width = WIDTH
             self.window.height = HEIGHT
             self.window.show_view(next_view)
 
 
+profiler.register(TileMiner, 'on_update', 'on_draw', 'on_mouse_motion', '_hover', 'on_mouse_press', 'play_move',
+                  frame='on_draw')
+
+
 def main():
     """
     Main method to run game from.
@@ -214,6 +568,8 @@ def main():
     screen_height = (TILE_SCALED_HEIGHT + MARGIN) * ROW_COUNT + HORIZONTAL_BORDER_MARGIN
 
     window = arcade.Window(screen_width, screen_height, "Tile Miner")
+    profiler.attach(window)
+    idle_throttle.attach(window)
     tile_miner = TileMiner()
     window.show_view(tile_miner)
     arcade.run()
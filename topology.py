@@ -0,0 +1,96 @@
+from functools import lru_cache
+import numpy as np
+
+from constants import SQUARE_TOPOLOGY, TORUS_TOPOLOGY, HEX_TOPOLOGY, TOPOLOGIES
+
+
+def _neighbour_offsets(kind, row):
+    """
+    Offsets of the neighbours of a tile, in the order the group search visits them: the row below (row 0 is at the
+    bottom of the screen), the same row, then the row above.
+    :param kind: one of TOPOLOGIES
+    :param row: row of the tile (hex boards shift odd rows half a tile to the right)
+    :return: list of (row offset, column offset)
+    """
+    if kind == HEX_TOPOLOGY:
+        shift = row % 2
+        return [(-1, shift - 1), (-1, shift), (0, -1), (0, 1), (1, shift - 1), (1, shift)]
+    return [(-1, 0), (0, -1), (0, 1), (1, 0)]
+
+
+class Topology(object):
+    """
+    Neighbour table for a board shape, precomputed once so that the graph operations need no edge checks. Tiles are
+    numbered row by row (row * columns + column) and the table is stored CSR-style: the neighbours of tile i are
+    indices[indptr[i]:indptr[i + 1]]. The same table is also kept as a padded (tiles, max degree) array and as a list of
+    neighbour tuples, for vectorized and pure Python code respectively.
+    """
+
+    __slots__ = ('kind', 'rows', 'columns', 'indptr', 'indices', 'padded', 'edges', 'neighbours')
+
+    def __init__(self, rows, columns, kind=SQUARE_TOPOLOGY):
+        """
+        Topology construct.
+        :param rows: # of rows in the board
+        :param columns: # of columns in the board
+        :param kind: one of TOPOLOGIES. Default is square.
+        """
+        if kind not in TOPOLOGIES:
+            raise ValueError(f"Unknown topology: {kind}")
+        self.kind = kind
+        self.rows = rows
+        self.columns = columns
+
+        neighbours = []
+        for row in range(rows):
+            for col in range(columns):
+                cell_neighbours = []
+                for row_step, col_step in _neighbour_offsets(kind, row):
+                    adjacent_row, adjacent_col = row + row_step, col + col_step
+                    if kind == TORUS_TOPOLOGY:
+                        adjacent_row, adjacent_col = adjacent_row % rows, adjacent_col % columns
+                    elif not (0 <= adjacent_row < rows and 0 <= adjacent_col < columns):
+                        continue
+                    adjacent = adjacent_row * columns + adjacent_col
+                    # Small tori can reach the same tile both ways round
+                    if adjacent != row * columns + col and adjacent not in cell_neighbours:
+                        cell_neighbours.append(adjacent)
+                neighbours.append(tuple(cell_neighbours))
+        self.neighbours = neighbours
+
+        degrees = np.array([len(n) for n in neighbours], dtype=np.intp)
+        self.indptr = np.concatenate([[0], np.cumsum(degrees)]).astype(np.intp)
+        self.indices = np.fromiter((a for n in neighbours for a in n), dtype=np.intp, count=int(degrees.sum()))
+
+        # Padded with the index one past the last tile, which callers map to a sentinel value
+        cells = rows * columns
+        self.padded = np.full((cells, int(degrees.max())), cells, dtype=np.intp)
+        for cell, cell_neighbours in enumerate(neighbours):
+            self.padded[cell, :len(cell_neighbours)] = cell_neighbours
+
+        # Every neighbouring pair once, as two arrays of tile indices
+        first = np.repeat(np.arange(cells), degrees)
+        once = first < self.indices
+        self.edges = (first[once], self.indices[once])
+
+    @property
+    def cells(self):
+        return self.rows * self.columns
+
+
+@lru_cache(maxsize=None)
+def get_topology(rows, columns, kind=SQUARE_TOPOLOGY):
+    """
+    Shared Topology for a board shape. Tables are built once per shape and reused by every board of that shape.
+    :param rows: # of rows in the board
+    :param columns: # of columns in the board
+    :param kind: one of TOPOLOGIES. Default is square.
+    :return: Topology
+    """
+    return Topology(rows, columns, kind)
+
+
+if __name__ == "__main__":
+    for topology_kind in TOPOLOGIES:
+        topology = get_topology(4, 4, topology_kind)
+        print(topology_kind, [topology.neighbours[i] for i in (0, 5, 15)], len(topology.edges[0]), "edges")